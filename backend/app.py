@@ -12,6 +12,7 @@ from routes.resource import resource_bp
 from routes.battle import battle_bp
 from routes.upload import upload_bp
 from routes.ocr import ocr_bp
+from utils.resource_index import warm_season_indexes
 
 app = Flask(__name__)
 
@@ -21,7 +22,19 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///san
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['WECHAT_APP_ID'] = os.getenv('WECHAT_APP_ID', 'YOUR_APP_ID')
 app.config['WECHAT_APP_SECRET'] = os.getenv('WECHAT_APP_SECRET', 'YOUR_APP_SECRET')
+# 管理接口（如发布赛季地图）令牌，未设置时管理接口不可用
+app.config['ADMIN_TOKEN'] = os.getenv('ADMIN_TOKEN')
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static/uploads')
+# 请求体大小上限（上传统计文件、zip、赛季地图），与 nginx 的 client_max_body_size 一致
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+# 同盟统计存储方式: rows（明细行）/ packed（打包快照）/ both
+app.config['ALLIANCE_STORAGE_MODE'] = os.getenv('ALLIANCE_STORAGE_MODE', 'rows')
+# 赛季地图 CSV 目录
+app.config['MAPS_FOLDER'] = os.path.join(app.root_path, 'maps')
+# 地图预计算数据（编译地图、所属郡栅格等）缓存目录
+app.config['MAP_CACHE_FOLDER'] = os.getenv('MAP_CACHE_FOLDER', os.path.join(app.root_path, 'map_cache'))
+# 资源热力图瓦片缓存目录（位于 static 下，由 nginx 直接返回）
+app.config['TILE_CACHE_FOLDER'] = os.path.join(app.root_path, 'static/tiles')
 
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -40,5 +53,12 @@ app.register_blueprint(battle_bp)
 app.register_blueprint(upload_bp)
 app.register_blueprint(ocr_bp)
 
+# 预先为各赛季资源点建立内存索引
+with app.app_context():
+    try:
+        warm_season_indexes()
+    except Exception as e:
+        print(f"WARNING: Failed to build resource indexes: {e}")
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
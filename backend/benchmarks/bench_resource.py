@@ -0,0 +1,223 @@
+"""
+资源查询性能基准
+
+用合成地图（见 synthetic_map.py）在临时 SQLite 数据库上测量:
+    build      建立赛季索引（含所属郡栅格与默认密度栅格）
+    county     所属郡判断 SeasonIndex.county_at
+    nearest    GET  /api/resource/nearest   （Flask 测试客户端）
+    relocate   POST /api/resource/relocate  （Flask 测试客户端）
+输出 p50 / p99 延迟和 tracemalloc 统计的内存峰值。结果缓存在每次请求前
+清空，测量的是实际计算开销。
+
+同时对一部分随机坐标，用与旧版完全相同的纯 Python 暴力算法
+（逐点 hex_distance 排序、逐格扫描计分）计算参考结果，要求接口返回一致。
+
+在 backend 目录下运行:
+    python -m benchmarks.bench_resource
+    python -m benchmarks.bench_resource --sizes 10000 100000 1000000 --queries 500 --checks 10
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+# 暴力参考算法与旧版保持一致
+LEVEL = '8铜'
+NEAREST_LIMIT = 40
+SEARCH_RADIUS = 20
+NEAR_RADIUS = 5
+FAR_RADIUS = 20
+MAP_MAX = 1500
+
+
+def reference_hex_distance(x1, y1, x2, y2):
+    q1 = x1 - (y1 - (y1 & 1)) / 2
+    q2 = x2 - (y2 - (y2 & 1)) / 2
+    return (abs(q1 - q2) + abs(y1 - y2) + abs(q1 + y1 - q2 - y2)) / 2
+
+
+def reference_county(x, y, points):
+    """距离最近的资源点所属郡，距离相同时取郡名最小的一个（与栅格规则一致）"""
+    best = None
+    best_county = None
+    for _, px, py, county, _ in points:
+        d = reference_hex_distance(x, y, px, py)
+        if best is None or d < best or (d == best and county < best_county):
+            best = d
+            best_county = county
+    return best_county
+
+
+def reference_nearest(x, y, points, county, level, limit=NEAREST_LIMIT):
+    with_dist = []
+    for pid, px, py, c, lv in points:
+        if c == county and lv == level:
+            with_dist.append((reference_hex_distance(x, y, px, py), pid))
+    with_dist.sort(key=lambda item: item[0])
+    return [(pid, int(d)) for d, pid in with_dist[:limit]]
+
+
+def reference_relocate(x, y, points, county):
+    coppers = [(px, py) for _, px, py, c, lv in points
+               if c == county and '8铜' in lv and reference_hex_distance(x, y, px, py) <= SEARCH_RADIUS + FAR_RADIUS]
+
+    scored = []
+    for dx in range(-SEARCH_RADIUS, SEARCH_RADIUS + 1):
+        for dy in range(-SEARCH_RADIUS, SEARCH_RADIUS + 1):
+            cx = x + dx
+            cy = y + dy
+            if not (0 <= cx <= MAP_MAX and 0 <= cy <= MAP_MAX):
+                continue
+            if reference_hex_distance(x, y, cx, cy) > SEARCH_RADIUS:
+                continue
+            near = far = 0
+            for px, py in coppers:
+                d = reference_hex_distance(cx, cy, px, py)
+                if d <= NEAR_RADIUS:
+                    near += 1
+                if d <= FAR_RADIUS:
+                    far += 1
+            if far > 0:
+                scored.append((cx, cy, near, far, int(reference_hex_distance(x, y, cx, cy))))
+    scored.sort(key=lambda item: (-item[2], -item[3]))
+    return scored[:NEAREST_LIMIT]
+
+
+def percentiles(samples):
+    arr = np.array(samples) * 1000
+    return np.percentile(arr, 50), np.percentile(arr, 99), arr.mean()
+
+
+def load_season(db, ResourcePoint, season, count, seed):
+    from benchmarks.synthetic_map import generate_map
+    xs, ys, counties, levels = generate_map(count, seed=seed)
+    rows = [{'season': season, 'county': c, 'level': lv, 'x': x, 'y': y}
+            for x, y, c, lv in zip(xs, ys, counties, levels)]
+    table = ResourcePoint.__table__
+    for start in range(0, len(rows), 50000):
+        db.session.execute(table.insert(), rows[start:start + 50000])
+    db.session.commit()
+
+
+def run_size(app, count, args, report):
+    from extensions import db
+    from models import ResourcePoint
+    from routes.resource import result_cache
+    from utils.resource_index import get_season_index, reset_season_indexes
+    from utils.relocation import warm_density_grids
+
+    season = f"BENCH-{count}"
+    rng = np.random.default_rng(args.seed + count)
+    client = app.test_client()
+
+    with app.app_context():
+        t = time.perf_counter()
+        load_season(db, ResourcePoint, season, count, args.seed)
+        print(f"INFO: {season}: inserted {count} rows in {time.perf_counter() - t:.1f}s")
+
+        # 1. 建立索引
+        reset_season_indexes()
+        tracemalloc.start()
+        t = time.perf_counter()
+        index = get_season_index(season)
+        warm_density_grids(index)
+        build_time = time.perf_counter() - t
+        _, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report.append((count, 'build', build_time * 1000, build_time * 1000, build_time * 1000, build_peak))
+
+        coords = rng.integers(0, MAP_MAX + 1, size=(args.queries, 2)).tolist()
+
+        def query_county(x, y):
+            index.county_at(x, y)
+
+        def query_nearest(x, y):
+            result_cache.clear()
+            r = client.get('/api/resource/nearest', query_string={'season': season, 'x': x, 'y': y, 'type': LEVEL})
+            assert r.status_code in (200, 404), r.status_code
+            return r
+
+        def query_relocate(x, y):
+            result_cache.clear()
+            r = client.post('/api/resource/relocate', json={'season': season, 'x': x, 'y': y})
+            assert r.status_code in (200, 404), r.status_code
+            return r
+
+        # 2. 延迟与内存峰值（内存单独跑一遍，tracemalloc 会拖慢执行）
+        for name, fn in (('county', query_county), ('nearest', query_nearest), ('relocate', query_relocate)):
+            fn(*coords[0])
+            samples = []
+            for x, y in coords:
+                t = time.perf_counter()
+                fn(x, y)
+                samples.append(time.perf_counter() - t)
+
+            tracemalloc.start()
+            for x, y in coords[:50]:
+                fn(x, y)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report.append((count, name) + percentiles(samples) + (peak,))
+
+        # 3. 与暴力算法对比
+        if args.checks:
+            points = db.session.query(
+                ResourcePoint.id, ResourcePoint.x, ResourcePoint.y, ResourcePoint.county, ResourcePoint.level
+            ).filter(ResourcePoint.season == season).order_by(ResourcePoint.id).all()
+
+            t = time.perf_counter()
+            for x, y in coords[:args.checks]:
+                county = reference_county(x, y, points)
+                assert index.county_at(x, y) == county, ('county', x, y)
+
+                data = query_nearest(x, y).get_json()
+                got = [(p['id'], p['distance']) for p in data['points']]
+                assert data['county'] == county and got == reference_nearest(x, y, points, county, LEVEL), ('nearest', x, y)
+
+                data = query_relocate(x, y).get_json()
+                got = [(p['x'], p['y'], p['score_near'], p['score_far'], p['distance']) for p in data['top_locations']]
+                assert got == reference_relocate(x, y, points, county), ('relocate', x, y)
+            print(f"INFO: {season}: {args.checks} queries match brute force ({time.perf_counter() - t:.1f}s)")
+
+        ResourcePoint.query.filter_by(season=season).delete()
+        db.session.commit()
+        reset_season_indexes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resource lookup benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--checks', type=int, default=5, help='queries compared against brute force per size')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # 使用临时数据库和缓存目录，必须在导入 app 之前设置
+    work_dir = tempfile.mkdtemp(prefix='san_bench_')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ['MAP_CACHE_FOLDER'] = os.path.join(work_dir, 'map_cache')
+
+    try:
+        from app import app
+        from extensions import db
+        with app.app_context():
+            db.create_all()
+
+        report = []
+        for count in args.sizes:
+            run_size(app, count, args, report)
+
+        print()
+        print(f"{'points':>9} {'op':<9} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'peak MB':>9}")
+        for count, name, p50, p99, mean, peak in report:
+            print(f"{count:>9} {name:<9} {p50:>9.2f} {p99:>9.2f} {mean:>9.2f} {peak / 2**20:>9.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+同盟趋势分析性能基准
+
+模拟一个同盟一个月的整点统计快照（默认 30 天 x 24 次 x 200 人，成员会陆续
+加入和离开），另一个同盟的上传作为干扰数据，写入临时 SQLite 数据库后测量
+GET /api/alliance/trends?openid=...:
+    load       load_trend_matrix（上传列表、成员数据两条查询 + 构造矩阵）
+    report     trend_report（增长、日增量滑动平均、名次、分组汇总）
+    request    完整请求（含 JSON 序列化），单指标 / 全部指标
+并对部分成员用逐行的纯 Python 计算核对增长量和日增量，确认结果不含其他同盟
+的上传。完整请求的平均耗时超过 TARGET_MS 时以非零状态退出。
+
+在 backend 目录下运行:
+    python -m benchmarks.bench_trends
+    python -m benchmarks.bench_trends --days 60 --members 300
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# 完整请求（全部指标）的目标耗时
+TARGET_MS = 1000
+
+
+def make_rows(rng, members, hour, roster):
+    """一次快照的行元组（ROW_FIELDS 顺序），roster: {名字: [分组, 战功, 势力]}"""
+    # 每小时少量成员离开 / 加入
+    for name in list(roster):
+        if rng.random() < 0.0005:
+            del roster[name]
+    while len(roster) < members:
+        roster[f"成员{hour:04d}_{len(roster):03d}"] = [rng.choice(['一组', '二组', '三组', '未分组']), 0, rng.randint(1000, 50000)]
+
+    rows = []
+    for i, (name, state) in enumerate(roster.items()):
+        state[1] += rng.choice([0, 0, rng.randint(0, 3000)])
+        state[2] += rng.randint(-50, 200)
+        rows.append((i + 1, name, state[0], rng.randint(0, 10 ** 5), state[2], state[1], rng.randint(0, 50), 0))
+    return rows
+
+
+def reference(rows_by_hour, name, start):
+    """纯 Python：某成员的 (增长量, {日期: 当天最后的战功})"""
+    seen = [(start + timedelta(hours=h), rows[name]) for h, rows in enumerate(rows_by_hour) if name in rows]
+    end_of_day = {}
+    for ts, value in seen:
+        end_of_day[str(ts.date())] = value
+    return seen[-1][1] - seen[0][1], end_of_day
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Alliance trend analytics benchmark')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--members', type=int, default=200)
+    parser.add_argument('--other-days', type=int, default=5, help='days of uploads from another alliance')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='san_bench_')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ['MAP_CACHE_FOLDER'] = os.path.join(work_dir, 'map_cache')
+
+    try:
+        from app import app
+        from extensions import db
+        from models import User, Alliance, AllianceMember
+        from utils.alliance_ingest import write_snapshot
+        from utils.alliance_trends import load_trend_matrix, trend_report
+
+        rng = random.Random(args.seed)
+        start = datetime(2026, 1, 1)
+        roster = {}
+        rows_by_hour = []
+        hours = args.days * 24
+
+        with app.app_context():
+            db.create_all()
+            for n in (1, 2):
+                openid = f"bench_user_{n}"
+                db.session.add(User(openid=openid, alliance_name=f"盟{n}", zone='1', server_info='1'))
+                db.session.add(Alliance(alliance_id=f"A{n}", alliance_name=f"盟{n}", zone='1', server_info='1', creator_openid=openid))
+                db.session.add(AllianceMember(alliance_id=f"A{n}", openid=openid))
+            db.session.commit()
+
+            t = time.perf_counter()
+            for hour in range(hours):
+                rows = make_rows(rng, args.members, hour, roster)
+                rows_by_hour.append({row[1]: row[5] for row in rows})
+                write_snapshot(rows, f"bench_trends_{hour}.csv", start + timedelta(hours=hour), 'bench_user_1')
+                db.session.commit()
+            # 另一个同盟同一时段的上传，成员名与本同盟相同
+            other_roster = {}
+            for hour in range(args.other_days * 24):
+                rows = make_rows(rng, args.members, hour, other_roster)
+                write_snapshot(rows, f"bench_other_{hour}.csv", start + timedelta(hours=hour), 'bench_user_2')
+                db.session.commit()
+            print(f"INFO: inserted {hours} + {args.other_days * 24} snapshots in {time.perf_counter() - t:.1f}s")
+
+            timings = {'load': [], 'report': []}
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                matrix = load_trend_matrix(['battle'], ['bench_user_1'])
+                timings['load'].append(time.perf_counter() - t)
+                t = time.perf_counter()
+                report = trend_report(matrix, ['battle'])
+                timings['report'].append(time.perf_counter() - t)
+
+            # 核对：增长量与每天的日增量
+            index = {m['name']: i for i, m in enumerate(report['members'])}
+            names = rng.sample(sorted(index), 20)
+            for name in names:
+                growth, end_of_day = reference(rows_by_hour, name, start)
+                item = report['metrics']['battle']['members'][index[name]]
+                assert item['growth'] == growth, (name, item['growth'], growth)
+                for d, day in enumerate(report['days'][1:], start=1):
+                    prev = end_of_day.get(report['days'][d - 1])
+                    cur = end_of_day.get(day)
+                    expected = cur - prev if cur is not None and prev is not None else None
+                    assert item['daily'][d] == expected, (name, day, item['daily'][d], expected)
+            print(f"INFO: {len(names)} members match the row-by-row reference")
+            assert matrix.shape[1] == hours, matrix.shape
+
+        client = app.test_client()
+        for label, metrics in (('request', 'battle'), ('request all', 'all')):
+            timings[label] = []
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                r = client.get('/api/alliance/trends', query_string={'metrics': metrics, 'openid': 'bench_user_1'})
+                timings[label].append(time.perf_counter() - t)
+                assert r.status_code == 200 and r.get_json()['success']
+                assert len(r.get_json()['snapshots']) == hours
+        r = client.get('/api/alliance/trends', query_string={'metrics': 'battle'})
+        assert not r.get_json()['success'], 'trends without openid must be rejected'
+
+        print()
+        print(f"{hours} snapshots x {args.members} members, matrix {matrix.shape}")
+        print(f"{'step':<12} {'best ms':>9} {'mean ms':>9}")
+        for name, samples in timings.items():
+            print(f"{name:<12} {min(samples) * 1000:>9.1f} {sum(samples) / len(samples) * 1000:>9.1f}")
+        mean_ms = sum(timings['request all']) / len(timings['request all']) * 1000
+        print(f"request all mean {mean_ms:.1f} ms, target < {TARGET_MS} ms: {'ok' if mean_ms < TARGET_MS else 'FAILED'}")
+        return 0 if mean_ms < TARGET_MS else 1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
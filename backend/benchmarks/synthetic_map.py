@@ -0,0 +1,42 @@
+"""
+合成赛季地图
+
+在 0-1500 的地图上随机撒点（坐标不重复），郡按若干随机郡治的六边形
+Voronoi 划分（与 county_raster 相同的 BFS），每 NUM_COUNTIES_PER_STATE
+个郡归入一个州，名称形如 "州03-郡17"。等级按 LEVEL_WEIGHTS 随机分配。
+"""
+import numpy as np
+from utils.county_raster import build_county_raster, MAP_SIZE
+
+LEVEL_WEIGHTS = {
+    '6铜': 0.35,
+    '7铜': 0.30,
+    '8铜': 0.20,
+    '9铜': 0.10,
+    '10铜': 0.05,
+}
+
+NUM_COUNTIES = 120
+NUM_COUNTIES_PER_STATE = 10
+
+
+def generate_map(count, seed=0, num_counties=NUM_COUNTIES):
+    """返回 (xs, ys, counties, levels)，counties / levels 为字符串列表"""
+    rng = np.random.default_rng(seed)
+    flat = rng.choice(MAP_SIZE * MAP_SIZE, size=count, replace=False)
+    xs = flat % MAP_SIZE
+    ys = flat // MAP_SIZE
+
+    seed_xs = rng.integers(0, MAP_SIZE, num_counties)
+    seed_ys = rng.integers(0, MAP_SIZE, num_counties)
+    raster = build_county_raster(seed_xs, seed_ys, np.arange(num_counties))
+    county_codes = raster[ys, xs]
+    county_names = [f"州{i // NUM_COUNTIES_PER_STATE:02d}-郡{i:03d}" for i in range(num_counties)]
+
+    level_names = list(LEVEL_WEIGHTS)
+    weights = np.array(list(LEVEL_WEIGHTS.values()))
+    level_codes = rng.choice(len(level_names), size=count, p=weights / weights.sum())
+
+    counties = [county_names[c] for c in county_codes]
+    levels = [level_names[lv] for lv in level_codes]
+    return xs.tolist(), ys.tolist(), counties, levels
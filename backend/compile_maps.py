@@ -0,0 +1,18 @@
+"""
+把 maps/*.csv 编译为 .sanmap 二进制地图（见 utils/map_format.py）。
+后端启动时会自动编译缺失或过期的地图，部署时也可以先手动执行本脚本：
+
+    python compile_maps.py
+"""
+import os
+from utils.map_format import compile_maps_dir, CompiledMap
+
+if __name__ == '__main__':
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    maps_dir = os.path.join(base_dir, 'maps')
+    cache_dir = os.getenv('MAP_CACHE_FOLDER', os.path.join(base_dir, 'map_cache'))
+
+    for path in compile_maps_dir(maps_dir, cache_dir):
+        compiled = CompiledMap(path)
+        print(f"INFO: Compiled {compiled.season}: {compiled.count} points, "
+              f"{len(compiled.counties)} counties -> {path} ({os.path.getsize(path)} bytes)")
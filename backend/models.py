@@ -44,10 +44,18 @@ class UploadRecord(db.Model):
     member_count = db.Column(db.Integer, default=0)
     # 存储从文件名解析出的统计时间，用于去重
     stats_time = db.Column(db.DateTime, nullable=True)
+    # 文件内容指纹（规范化后各行的 sha256），用于去重
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
     
     # 关联的用户ID
     user_id = db.Column(db.String(64), db.ForeignKey('users.openid'), nullable=True)
 
+    # 去重范围：上传者 openid，匿名上传为空字符串（唯一约束中 NULL 互不相等）
+    hash_scope = db.Column(db.String(64), nullable=False, default='')
+
+    # 同一范围内的同一内容只能写入一次（并发上传时由数据库保证）
+    __table_args__ = (db.UniqueConstraint('hash_scope', 'content_hash', name='_upload_content_uc'),)
+
     def to_dict(self):
         # Helper for Shichen format
         def format_shichen(dt):
@@ -71,9 +79,11 @@ class UploadRecord(db.Model):
 class AllianceData(db.Model):
     __tablename__ = 'alliance_data'
     id = db.Column(db.Integer, primary_key=True)
-    upload_id = db.Column(db.Integer, db.ForeignKey('upload_records.id'), nullable=False)
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload_records.id'), nullable=False, index=True)
     rank = db.Column(db.Integer, default=0)
     name = db.Column(db.String(64), nullable=False)
+    # 成员维度表中的 id（见 utils/alliance_members.py），改名后不变
+    member_id = db.Column(db.Integer, db.ForeignKey('member_profiles.id'), nullable=True, index=True)
     group_name = db.Column(db.String(64), default='未分组')
     contribution = db.Column(db.Integer, default=0)
     power = db.Column(db.Integer, default=0)
@@ -113,6 +123,74 @@ class AllianceData(db.Model):
             'donation': self.donation
         }
 
+class AllianceSnapshot(db.Model):
+    __tablename__ = 'alliance_snapshots'
+    # 一次上传的全部成员数据打包为一行（见 utils/alliance_snapshot.py）
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload_records.id'), primary_key=True)
+    member_count = db.Column(db.Integer, default=0)
+    # 成员名 / 分组名字典（JSON 数组）
+    names = db.Column(db.Text, nullable=False)
+    groups = db.Column(db.Text, nullable=False)
+    # 各列的定长整数数组，zlib 压缩
+    data = db.Column(db.LargeBinary(length=2 ** 24), nullable=False)
+
+    upload_record = db.relationship('UploadRecord', backref=db.backref('snapshot', uselist=False, cascade='all, delete-orphan'))
+
+class AllianceSnapshotMember(db.Model):
+    __tablename__ = 'alliance_snapshot_members'
+    # 打包快照中每个成员 id 所在的下标，按成员查历史时只解包包含该成员的快照
+    upload_id = db.Column(db.Integer, db.ForeignKey('alliance_snapshots.upload_id'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    member_id = db.Column(db.Integer, db.ForeignKey('member_profiles.id'), nullable=False, index=True)
+
+    snapshot = db.relationship('AllianceSnapshot', backref=db.backref('members', cascade='all, delete-orphan'))
+
+class CompareResult(db.Model):
+    __tablename__ = 'compare_results'
+    # /api/alliance/compare 的结果缓存（见 utils/alliance_compare.py）
+    id = db.Column(db.Integer, primary_key=True)
+    early_upload_id = db.Column(db.Integer, db.ForeignKey('upload_records.id'), nullable=False)
+    late_upload_id = db.Column(db.Integer, db.ForeignKey('upload_records.id'), nullable=False, index=True)
+    metric = db.Column(db.String(32), nullable=False)
+    # 对比结果与分组图片 [{group, filename}]（JSON）
+    results = db.Column(db.Text, nullable=False)
+    images = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (db.UniqueConstraint('early_upload_id', 'late_upload_id', 'metric', name='_compare_result_uc'),)
+
+class MemberProfile(db.Model):
+    __tablename__ = 'member_profiles'
+    # 同盟统计中的成员，id 在 scope（同盟 ID，未加入同盟的上传者为 openid）内唯一对应一个人
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(64), nullable=False, default='')
+    # 当前名字
+    name = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (db.Index('ix_member_profiles_scope_name', 'scope', 'name'),)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'aliases': sorted(a.name for a in self.aliases)
+        }
+
+class MemberAlias(db.Model):
+    __tablename__ = 'member_aliases'
+    # 成员用过的名字（含当前名字），同一 scope 内一个名字只对应一个成员
+    id = db.Column(db.Integer, primary_key=True)
+    member_id = db.Column(db.Integer, db.ForeignKey('member_profiles.id'), nullable=False, index=True)
+    scope = db.Column(db.String(64), nullable=False, default='')
+    name = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    member = db.relationship('MemberProfile', backref=db.backref('aliases', cascade='all, delete-orphan'))
+
+    # 名字在前：按名字查询（不限 scope）也能使用该索引
+    __table_args__ = (db.UniqueConstraint('name', 'scope', name='_member_alias_uc'),)
+
 class ResourcePoint(db.Model):
     __tablename__ = 'resource_points'
     id = db.Column(db.Integer, primary_key=True)
@@ -132,6 +210,24 @@ class ResourcePoint(db.Model):
             'y': self.y
         }
 
+class MapVersion(db.Model):
+    __tablename__ = 'map_versions'
+    # 每个赛季地图文件最后一次导入时的内容哈希，用于增量导入
+    season = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(256), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    row_count = db.Column(db.Integer, default=0)
+    loaded_at = db.Column(db.DateTime, default=datetime.now)
+
+    def to_dict(self):
+        return {
+            'season': self.season,
+            'filename': self.filename,
+            'content_hash': self.content_hash,
+            'row_count': self.row_count,
+            'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None
+        }
+
 class BattleMerit(db.Model):
     __tablename__ = 'battle_merits'
     id = db.Column(db.Integer, primary_key=True)
@@ -1,11 +1,22 @@
 from flask import Blueprint, request, jsonify, current_app, send_from_directory
 from extensions import db
 from models import UploadRecord, AllianceData, User, Alliance, AllianceMember
-from utils.image_generator import ImageGenerator
+from utils.alliance_batch import submit_batch, batch_status
+from utils.alliance_snapshot import load_snapshot, packed_member_history, METRIC_ALIASES
+from utils.alliance_trends import load_trend_matrix, trend_report, DEFAULT_TREND_WINDOW, MAX_TREND_SNAPSHOTS
+from utils.alliance_compare import (
+    compute_comparison, compare_all_metrics, ALL_METRICS, cacheable, get_cached_comparison, store_comparison,
+    submit_render, render_status, invalidate_comparisons, remove_images
+)
+from utils.alliance_members import member_scope, find_member_ids, member_alias_names, rename_member, MemberError
+from utils.alliance_ingest import (
+    open_alliance_csv, write_snapshot, parse_stats_time, find_duplicate_upload,
+    archive_upload, CSVFormatError
+)
 import os
-from datetime import datetime
-import re
-import csv
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import numpy as np
 import hashlib
 
 alliance_bp = Blueprint('alliance', __name__)
@@ -20,11 +31,27 @@ def get_uploads():
             'uploads': [u.to_dict() for u in uploads]
         })
     
+    member_openids = _alliance_openids(openid)
+    if not member_openids:
+        # User has no alliance, return empty list
+        return jsonify({'uploads': []})
+    
+    # Get uploads from all alliance members (primarily the creator)
+    # In practice, only creators upload, but this allows flexibility
+    uploads = UploadRecord.query.filter(
+        UploadRecord.user_id.in_(member_openids)
+    ).order_by(UploadRecord.upload_time.desc()).all()
+    
+    return jsonify({
+        'uploads': [u.to_dict() for u in uploads]
+    })
+
+def _alliance_openids(openid):
+    """用户所在同盟全部成员的 openid，未加入同盟时返回空列表"""
     # Get user's alliance
     user = User.query.get(openid)
     if not user or not user.alliance_name:
-        # User has no alliance, return empty list
-        return jsonify({'uploads': []})
+        return []
     
     # Find the alliance
     alliance = Alliance.query.filter_by(
@@ -34,21 +61,11 @@ def get_uploads():
     ).first()
     
     if not alliance:
-        return jsonify({'uploads': []})
+        return []
     
     # Get all members of this alliance
     members = AllianceMember.query.filter_by(alliance_id=alliance.alliance_id).all()
-    member_openids = [m.openid for m in members]
-    
-    # Get uploads from all alliance members (primarily the creator)
-    # In practice, only creators upload, but this allows flexibility
-    uploads = UploadRecord.query.filter(
-        UploadRecord.user_id.in_(member_openids)
-    ).order_by(UploadRecord.upload_time.desc()).all()
-    
-    return jsonify({
-        'uploads': [u.to_dict() for u in uploads]
-    })
+    return [m.openid for m in members]
 
 @alliance_bp.route('/api/alliance/detail/<int:upload_id>', methods=['GET'])
 def get_upload_detail(upload_id):
@@ -56,25 +73,14 @@ def get_upload_detail(upload_id):
     if not record:
         return jsonify({'success': False, 'message': 'Record not found'})
     
-    data = AllianceData.query.filter_by(upload_id=upload_id).order_by(AllianceData.rank).all()
+    snapshot = load_snapshot(upload_id)
+    order = np.argsort(snapshot.metrics['rank'], kind='stable')
     return jsonify({
         'success': True,
         'record': record.to_dict(),
-        'data': [d.to_dict() for d in data]
+        'data': snapshot.to_dicts(order)
     })
 
-def parse_int(value):
-    """Helper to parse integer from string, handling empty or invalid values."""
-    if not value:
-        return 0
-    try:
-        # Remove commas if present (e.g. "1,234")
-        if isinstance(value, str):
-            value = value.replace(',', '')
-        return int(float(value))
-    except (ValueError, TypeError):
-        return 0
-
 @alliance_bp.route('/api/alliance/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -89,150 +95,80 @@ def upload_file():
 
     # 尝试从文件名解析时间戳
     # 格式示例：同盟统计2025年01月25日13时30分12秒.csv
-    # 正则匹配：(\d{4})年(\d{1,2})月(\d{1,2})日(\d{1,2})时(\d{1,2})分(\d{1,2})秒
-    stats_time = None
-    match = re.search(r'(\d{4})年(\d{1,2})月(\d{1,2})日(\d{1,2})时(\d{1,2})分(\d{1,2})秒', original_filename)
-    if match:
-        try:
-            stats_time = datetime(
-                int(match.group(1)),
-                int(match.group(2)),
-                int(match.group(3)),
-                int(match.group(4)),
-                int(match.group(5)),
-                int(match.group(6))
-            )
-        except ValueError:
-            pass
+    stats_time = parse_stats_time(original_filename)
 
     # 获取 openid
     openid = request.form.get('openid')
 
-    # 去重逻辑：
-    # 1. 如果解析出了 stats_time，则检查数据库中是否存在相同 stats_time 的记录
-    # 2. 如果没有解析出 stats_time，则退化为检查 filename
-    # 3. 必须是同一个用户的记录才算重复
-    existing_record = None
-    if stats_time:
-        query = UploadRecord.query.filter_by(stats_time=stats_time)
-        if openid:
-            query = query.filter_by(user_id=openid)
-        existing_record = query.first()
-    else:
-        query = UploadRecord.query.filter_by(filename=original_filename)
-        if openid:
-            query = query.filter_by(user_id=openid)
-        existing_record = query.first()
-
+    # 上传的文件流（werkzeug 对较大的文件使用临时文件）上一遍完成：判断编码、
+    # 解析表头、计算内容指纹；成员数据行在写入时才从流中逐块解析，不整体读入内存
+    stream = file.stream
+    try:
+        used_encoding, headers, content_hash, rows = open_alliance_csv(stream)
+        print(f"CSV Headers detected: {headers} ({used_encoding})")
+    except CSVFormatError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        print(f"Error parsing CSV: {e}")
+        return jsonify({'success': False, 'message': f'Error parsing CSV: {str(e)}'})
+    
+    # 去重：在写文件、写入数据库之前按内容指纹（及统计时间）检查，改名的同一文件也能识别
+    existing_record = find_duplicate_upload(stats_time, content_hash, openid)
     if existing_record:
-        return jsonify({'success': True, 'message': 'File already exists (duplicate timestamp), skipped.', 'skipped': True})
-    
-    if file:
-        # 保存文件
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder)
-            
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        safe_filename = f"{timestamp}_{original_filename}"
-        file_path = os.path.join(upload_folder, safe_filename)
-        file.save(file_path)
-        
-        member_count = 0
-        data_objects = []
-        
-        # 尝试不同的编码读取 CSV
-        encodings = ['utf-8-sig', 'gb18030', 'utf-8']
-        csv_content = None
-        used_encoding = None
+        return jsonify({'success': True, 'message': 'File already exists (duplicate content or timestamp), skipped.', 'skipped': True})
+    
+    member_count = len(rows)
+    
+    # 保存原始文件
+    archive_upload(current_app.config['UPLOAD_FOLDER'], original_filename, stream)
+
+    # 保存记录到数据库：上传记录与详情数据在同一事务中批量写入
+    try:
+        write_snapshot(rows, original_filename, stats_time, openid, content_hash)
+        db.session.commit()
         
-        for enc in encodings:
-            try:
-                with open(file_path, 'r', encoding=enc) as f:
-                    # 尝试读取第一行来验证编码
-                    f.readline()
-                    used_encoding = enc
-                break
-            except UnicodeDecodeError:
-                continue
+        return jsonify({'success': True, 'message': 'Upload successful', 'count': member_count})
         
-        if not used_encoding:
-            return jsonify({'success': False, 'message': 'Failed to decode file. Unknown encoding.'})
+    except IntegrityError:
+        # 并发上传了相同内容，唯一约束拒绝后写入的一个
+        db.session.rollback()
+        return jsonify({'success': True, 'message': 'File already exists (duplicate content or timestamp), skipped.', 'skipped': True})
+    except Exception as e:
+        db.session.rollback()
+        print(f"Database error: {e}")
+        return jsonify({'success': False, 'message': 'Database error'})
 
-        try:
-            with open(file_path, 'r', encoding=used_encoding) as f:
-                reader = csv.DictReader(f)
-                
-                # 映射 CSV 列名到数据库字段
-                # 假设 CSV 列名包含：排名, 成员, 贡献, 势力值, 战功, 攻占, 攻城, 拆除
-                # 实际列名可能略有不同，这里做简单匹配
-                
-                first_row = True
-                for row in reader:
-                    # 清理 key 中的空白字符
-                    clean_row = {k.strip(): v for k, v in row.items() if k}
-                    
-                    if first_row:
-                        print(f"CSV Headers detected: {list(clean_row.keys())}")
-                        #print(f"First row sample: {clean_row}")
-                        first_row = False
-
-                    # 查找对应的列值
-                    def get_val(keys):
-                        for k in keys:
-                            if k in clean_row:
-                                return clean_row[k]
-                        return None
-
-                    name = get_val(['成员', '名字', 'Name'])
-                    if not name:
-                        continue # 跳过没有名字的行
-
-                    member_count += 1
-                    
-                    data = AllianceData(
-                        rank=parse_int(get_val(['排名', 'Rank', '贡献排行'])),
-                        name=name,
-                        group_name=get_val(['分组', 'Group']) or '未分组',
-                        contribution=parse_int(get_val(['贡献', 'Contribution', '贡献总量'])),
-                        power=parse_int(get_val(['势力值', '势力', 'Power'])),
-                        battle_achievement=parse_int(get_val(['战功', 'Battle', '战功总量'])),
-                        assist=parse_int(get_val(['助攻', 'Assist', '助攻总量'])),
-                        donation=parse_int(get_val(['捐献', 'Donation', '捐献总量']))
-                    )
-                    data_objects.append(data)
-
-        except Exception as e:
-            print(f"Error parsing CSV: {e}")
-            return jsonify({'success': False, 'message': f'Error parsing CSV: {str(e)}'})
-
-        # 保存记录到数据库
-        try:
-            # 1. 创建上传记录
-            record = UploadRecord(
-                filename=original_filename,
-                member_count=member_count,
-                stats_time=stats_time,
-                user_id=openid
-            )
-            db.session.add(record)
-            db.session.flush() # 获取 record.id
-            
-            # 2. 关联 upload_id 并批量保存详情数据
-            for obj in data_objects:
-                obj.upload_id = record.id
-            
-            db.session.bulk_save_objects(data_objects)
-            db.session.commit()
-            
-            return jsonify({'success': True, 'message': 'Upload successful', 'count': member_count})
-            
-        except Exception as e:
-            db.session.rollback()
-            print(f"Database error: {e}")
-            return jsonify({'success': False, 'message': 'Database error'})
-
-    return jsonify({'success': False, 'message': 'Upload failed'})
+
+@alliance_bp.route('/api/alliance/upload/batch', methods=['POST'])
+def upload_batch():
+    # 一次上传多个 CSV（files 字段可重复）或一个 zip，立即返回任务 id，后台解析写入
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    uploads = [f for f in uploads if f.filename]
+    if not uploads:
+        return jsonify({'success': False, 'message': 'No file part'})
+    
+    openid = request.form.get('openid')
+    # 单个文件时与 /api/alliance/upload 一样使用前端传递的原始文件名
+    names = [request.form.get('filename', uploads[0].filename)] if len(uploads) == 1 else [f.filename for f in uploads]
+    
+    try:
+        job_id = submit_batch(
+            current_app._get_current_object(),
+            [(name, f.read()) for name, f in zip(names, uploads)],
+            openid,
+            current_app.config['UPLOAD_FOLDER']
+        )
+    except CSVFormatError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    
+    return jsonify({'success': True, 'job_id': job_id, 'job': batch_status(job_id)}), 202
+
+@alliance_bp.route('/api/alliance/upload/batch/<job_id>', methods=['GET'])
+def upload_batch_status(job_id):
+    job = batch_status(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
 
 
 @alliance_bp.route('/api/alliance/delete', methods=['POST'])
@@ -245,8 +181,11 @@ def delete_upload():
         
     record = UploadRecord.query.get(upload_id)
     if record:
+        # 涉及该上传的对比缓存一并删除
+        stale_images = invalidate_comparisons(record.id)
         db.session.delete(record)
         db.session.commit()
+        remove_images(os.path.join(current_app.root_path, 'static', 'generated'), stale_images)
         return jsonify({'success': True})
     
     return jsonify({'success': False, 'message': 'Record not found'})
@@ -257,7 +196,7 @@ def compare_uploads():
     data = request.get_json()
     upload_id_1 = data.get('upload_id_1')
     upload_id_2 = data.get('upload_id_2')
-    metric = data.get('metric', 'battle') # battle, power, contribution
+    metric = data.get('metric', 'battle') # battle, power, contribution, assist, donation, all
 
     if not upload_id_1 or not upload_id_2:
         return jsonify({'success': False, 'message': 'Missing upload IDs'})
@@ -279,94 +218,32 @@ def compare_uploads():
         early_record, late_record = record1, record2
         early_ts, late_ts = t1, t2
 
-    # Fetch data
-    early_data = AllianceData.query.filter_by(upload_id=early_record.id).all()
-    late_data = AllianceData.query.filter_by(upload_id=late_record.id).all()
-
-    print(f"Comparing Upload, id {early_record.id} ({len(early_data)}) vs id {late_record.id} ({len(late_data)})")
-    # if early_data:
-    #     print(f"Sample Early: {early_data[0].name} - Battle: {early_data[0].battle_achievement}")
-    # if late_data:
-    #     print(f"Sample Late: {late_data[0].name} - Battle: {late_data[0].battle_achievement}")
-
-    # Helper to get metric value
-    def get_metric_value(item, metric_name):
-        if metric_name == 'battle':
-            return item.battle_achievement
-        elif metric_name == 'power':
-            return item.power
-        elif metric_name == 'contribution':
-            return item.contribution
-        elif metric_name == 'assist':
-            return item.assist
-        elif metric_name == 'donation':
-            return item.donation
-        return 0
-
-    # Build dicts
-    early_map = {item.name: {'val': get_metric_value(item, metric), 'group': item.group_name} for item in early_data}
-    
-    results = []
-    
-    # Compare
-    for item in late_data:
-        name = item.name
-        late_val = get_metric_value(item, metric)
-        late_group = item.group_name
-        
-        if name in early_map:
-            early_val = early_map[name]['val']
-            diff = late_val - early_val
-            # Use late group if available, else early group
-            group = late_group if late_group != '未分组' else early_map[name]['group']
-            
-            results.append({
-                'name': name,
-                'group': group,
-                'diff': diff,
-                'early_val': early_val,
-                'late_val': late_val
-            })
-    
-    # Sort by group then diff descending
-    results.sort(key=lambda x: (x['group'], -x['diff']))
-
-    # Generate Images
-    try:
-        print("Initializing ImageGenerator...")
-        resource_dir = os.path.join(current_app.root_path, 'resources')
-        output_dir = os.path.join(current_app.root_path, 'static', 'generated')
-        generator = ImageGenerator(resource_dir)
-        
-        metric_label = {
-            'battle': '战功值',
-            'power': '势力值',
-            'contribution': '贡献',
-            'assist': '攻城值',
-            'donation': '罚款捐献'
-        }.get(metric, metric)
-        
-        image_paths = generator.generate_comparison_images(
-            results, 
-            early_ts.strftime('%Y-%m-%d %H:%M'), 
-            late_ts.strftime('%Y-%m-%d %H:%M'), 
-            metric_label, 
-            output_dir,
-            metric
+    output_dir = os.path.join(current_app.root_path, 'static', 'generated')
+    cached = get_cached_comparison(early_record.id, late_record.id, metric, output_dir) if cacheable(metric) else None
+    render_job = None
+
+    if cached:
+        results, image_paths = cached
+        image_paths = [dict(img, ready=True) for img in image_paths]
+    elif metric == ALL_METRICS:
+        # 全部指标一次返回，只有数据，不生成图片
+        results = compare_all_metrics(early_record.id, late_record.id)
+        image_paths = []
+        store_comparison(early_record.id, late_record.id, metric, results, image_paths)
+    elif cacheable(metric):
+        results = compute_comparison(early_record.id, late_record.id, metric)
+        # 图片交给后台渲染队列，数据立即返回；客户端轮询 /api/alliance/compare/render/<job_id>
+        render_job = submit_render(
+            current_app._get_current_object(), early_record.id, late_record.id, metric, results,
+            early_ts.strftime('%Y-%m-%d %H:%M'), late_ts.strftime('%Y-%m-%d %H:%M')
         )
-        
-        # Add image URLs to response
-        base_url = request.host_url.rstrip('/')
-        images = []
-        for img in image_paths:
-            img_url = f"{base_url}/api/alliance/images/{img['filename']}"
-            images.append({
-                'group': img['group'],
-                'url': img_url
-            })
-    except Exception as e:
-        print(f"Image generation failed: {e}")
-        images = []
+        image_paths = render_status(render_job)['images']
+    else:
+        # 未知指标差值都为 0，不生成图片
+        results = compute_comparison(early_record.id, late_record.id, metric)
+        image_paths = []
+
+    images = _image_urls(image_paths)
 
     return jsonify({
         'success': True,
@@ -374,7 +251,35 @@ def compare_uploads():
         'early_ts': early_ts.strftime('%Y-%m-%d %H:%M'),
         'late_ts': late_ts.strftime('%Y-%m-%d %H:%M'),
         'metric': metric,
-        'images': images
+        'images': images,
+        'images_ready': all(img['ready'] for img in images),
+        'render_job': render_job,
+        'cached': bool(cached)
+    })
+
+
+def _image_urls(image_paths):
+    # Add image URLs to response
+    base_url = request.host_url.rstrip('/')
+    return [{
+        'group': img['group'],
+        'url': f"{base_url}/api/alliance/images/{img['filename']}",
+        'ready': img['ready']
+    } for img in image_paths]
+
+
+@alliance_bp.route('/api/alliance/compare/render/<job_id>', methods=['GET'])
+def compare_render_status(job_id):
+    # 对比图片的后台渲染进度，每张图片带 ready 标记
+    job = render_status(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({
+        'success': True,
+        'status': job['status'],
+        'error': job['error'],
+        'images': _image_urls(job['images']),
+        'images_ready': job['ready']
     })
 
 
@@ -387,35 +292,111 @@ def get_image(filename):
 @alliance_bp.route('/api/alliance/member/history', methods=['GET'])
 def get_member_history():
     name = request.args.get('name')
-    if not name:
+    member_id = request.args.get('member_id', type=int)
+    if not name and not member_id:
         return jsonify({'success': False, 'message': 'Name is required'})
     
+    # 名字（含曾用名）-> 成员 id；传入 openid 时只查其所在同盟，查不到时再查全部
+    if member_id:
+        member_ids = [member_id]
+    else:
+        openid = request.args.get('openid')
+        member_ids = find_member_ids(name, member_scope(openid)) if openid else []
+        if not member_ids:
+            member_ids = find_member_ids(name)
+    
     results = db.session.query(AllianceData, UploadRecord).join(
         UploadRecord, AllianceData.upload_id == UploadRecord.id
     ).filter(
-        AllianceData.name == name
-    ).order_by(
-        UploadRecord.stats_time.asc()
-    ).all()
+        AllianceData.member_id.in_(member_ids)
+    ).all() if member_ids else []
+    
+    entries = [(record, data.battle_achievement, data.power, data.assist, data.donation) for data, record in results]
+    # 只以打包快照存储的上传
+    for record, snapshot, i in packed_member_history(member_ids, {record.id for _, record in results}):
+        m = snapshot.metrics
+        entries.append((record, int(m['battle_achievement'][i]), int(m['power'][i]), int(m['assist'][i]), int(m['donation'][i])))
+    # Order by stats_time (records without stats_time first, as in SQL ASC)
+    entries.sort(key=lambda e: (e[0].stats_time is not None, e[0].stats_time or datetime.min))
     
     history = []
-    for data, record in results:
+    for record, battle, power, assist, donation in entries:
         history.append({
             'ts': record.stats_time.strftime('%Y-%m-%d %H:%M:%S') if record.stats_time else record.upload_time.strftime('%Y-%m-%d %H:%M:%S'),
             'display_time': record.to_dict()['display_time'],
-            'battle': data.battle_achievement,
-            'power': data.power,
-            'assist': data.assist,
-            'donation': data.donation
+            'battle': battle,
+            'power': power,
+            'assist': assist,
+            'donation': donation
         })
         
     return jsonify({
         'success': True,
         'name': name,
+        'member_ids': member_ids,
         'count': len(history),
         'history': history
     })
 
+@alliance_bp.route('/api/alliance/trends', methods=['GET'])
+def get_alliance_trends():
+    # 多次上传的成员趋势：增长、日增量滑动平均、名次变化、分组汇总
+    openid = request.args.get('openid')
+    if not openid:
+        # 不同同盟的上传不能混在一个矩阵中
+        return jsonify({'success': False, 'message': 'Missing openid'})
+    metrics = [m for m in request.args.get('metrics', 'battle').split(',') if m]
+    if metrics == [ALL_METRICS]:
+        metrics = list(METRIC_ALIASES)
+    if not metrics or any(m not in METRIC_ALIASES for m in metrics):
+        return jsonify({'success': False, 'message': f"Unknown metric, expected {', '.join(METRIC_ALIASES)} or all"})
+    
+    window = request.args.get('window', DEFAULT_TREND_WINDOW, type=int)
+    days = request.args.get('days', type=int)
+    limit = request.args.get('limit', MAX_TREND_SNAPSHOTS, type=int)
+    if not window or window < 1 or not limit or limit < 2:
+        return jsonify({'success': False, 'message': 'Invalid window or limit'})
+    
+    upload_ids = None
+    if request.args.get('upload_ids'):
+        try:
+            upload_ids = [int(v) for v in request.args['upload_ids'].split(',') if v]
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid upload_ids'})
+    
+    # 只分析其所在同盟的上传；未加入同盟时为本人的上传（与成员 id 的 scope 一致）
+    user_ids = _alliance_openids(openid) or [openid]
+    since = datetime.now() - timedelta(days=days) if days else None
+    matrix = load_trend_matrix(metrics, user_ids, upload_ids, since, min(limit, MAX_TREND_SNAPSHOTS))
+    if matrix is None:
+        return jsonify({'success': False, 'message': 'No uploads found'})
+    
+    report = trend_report(matrix, metrics, window)
+    report['success'] = True
+    return jsonify(report)
+
+@alliance_bp.route('/api/alliance/member/rename', methods=['POST'])
+def rename_alliance_member():
+    # 登记成员改名：新名字作为别名归入原成员，历史与对比按同一成员计算
+    data = request.get_json()
+    old_name = (data.get('old_name') or '').strip()
+    new_name = (data.get('new_name') or '').strip()
+    if not old_name or not new_name:
+        return jsonify({'success': False, 'message': 'Missing old_name or new_name'})
+    
+    scope = member_scope(data.get('openid'))
+    try:
+        member_id = rename_member(scope, old_name, new_name)
+        # 合并成员会改变对比结果，缓存全部失效
+        stale_images = invalidate_comparisons()
+        db.session.commit()
+    except MemberError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+    remove_images(os.path.join(current_app.root_path, 'static', 'generated'), stale_images)
+    
+    return jsonify({'success': True, 'member_id': member_id, 'aliases': member_alias_names([member_id])})
+
 @alliance_bp.route('/api/alliance/info', methods=['GET'])
 def get_alliance_info():
     openid = request.args.get('openid')
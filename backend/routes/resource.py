@@ -1,217 +1,434 @@
-from flask import Blueprint, request, jsonify
-from extensions import db
-from models import ResourcePoint
-from utils.hex_math import hex_distance, get_nearest_points
-from sqlalchemy import func
+from flask import Blueprint, request, jsonify, current_app, send_file, Response
+import os
+import hmac
+import hashlib
+from collections import Counter
+from utils.hex_math import hex_distance_matrix, top_k_rows
+from utils.resource_index import get_season_index, get_catalog
+from utils.map_format import MapFormatError
+from utils.map_publisher import publish_map, publish_jobs
+from utils.result_cache import TTLCache
+from utils.coverage import plan_coverage, default_coverage_levels
+from utils.map_export import export_season_map, EXPORT_FORMATS
+from utils.map_tiles import (
+    get_tile, valid_tile, TILE_FORMATS, TILE_SIZE, WORLD_SIZE, MAX_ZOOM, ALL_LEVELS
+)
+from utils.relocation import (
+    recommend_locations, default_copper_levels,
+    DEFAULT_SEARCH_RADIUS, DEFAULT_NEAR_RADIUS, DEFAULT_FAR_RADIUS,
+    DEFAULT_LIMIT, MAX_LIMIT, MAX_RADIUS, MAP_MAX
+)
 
 resource_bp = Blueprint('resource', __name__)
 
+def _cached_json(payload, etag, max_age=None):
+    # 内容只随地图版本变化：带 ETag 返回，客户端重复请求时直接 304
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    if max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+# 查询结果缓存，键为 (接口, 赛季, 地图版本, 规范化参数)
+result_cache = TTLCache(maxsize=4096, ttl=600)
+
+# 带地图版本的 GET 查询结果允许 nginx / 客户端缓存的时间（秒）
+QUERY_MAX_AGE = 300
+
+def _query_data():
+    # GET 使用查询参数，POST 使用 JSON
+    if request.method == 'GET':
+        return request.args
+    return request.get_json(silent=True) or {}
+
+def _query_response(endpoint, index, params, compute):
+    """
+    params 为规范化后的参数元组。先查结果缓存，未命中时 compute() 计算，
+    返回 (payload, status)。GET 请求附带与地图版本绑定的 ETag / Cache-Control。
+    """
+    key = (endpoint, index.season, index.version) + params
+    cached = result_cache.get(key)
+    if cached is None:
+        cached = compute()
+        result_cache.set(key, cached)
+    payload, status = cached
+
+    if request.method != 'GET' or status != 200:
+        return jsonify(payload), status
+    # 只有带当前地图版本 (v=) 的地址允许 nginx / 客户端按 max-age 缓存：发布新地图后
+    # 版本变化，地址随之变化。不带版本或版本已过期时 no-cache，只做 ETag 协商
+    etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20]
+    versioned = request.args.get('v') == index.version
+    response = _cached_json(payload, etag, max_age=QUERY_MAX_AGE if versioned else None)
+    response.headers['X-Map-Version'] = index.version
+    return response
+
 @resource_bp.route('/api/resource/seasons', methods=['GET'])
 def get_seasons():
-    # Get distinct seasons from ResourcePoint
-    seasons = db.session.query(ResourcePoint.season).distinct().all()
-    # seasons is a list of tuples [('S1',), ('S2',)]
-    season_list = [s[0] for s in seasons]
-    season_list.sort()
-    return jsonify({'seasons': season_list})
-
-@resource_bp.route('/api/resource/nearest', methods=['POST'])
+    # Seasons come from the in-memory catalog, no DB query per request
+    catalog = get_catalog()
+    season_list = sorted(entry['season'] for entry in catalog['seasons'])
+    # 各赛季当前的地图版本，查询时作为 v 参数，用于缓存
+    versions = {entry['season']: entry['version'] for entry in catalog['seasons']}
+    return _cached_json({'seasons': season_list, 'versions': versions}, catalog['version'])
+
+@resource_bp.route('/api/resource/catalog', methods=['GET'])
+def get_resource_catalog():
+    # 各赛季概览（不含郡明细）
+    catalog = get_catalog()
+    seasons = [{k: v for k, v in entry.items() if k != 'counties'} for entry in catalog['seasons']]
+    return _cached_json({'version': catalog['version'], 'seasons': seasons}, catalog['version'])
+
+@resource_bp.route('/api/resource/catalog/<season>', methods=['GET'])
+def get_season_catalog(season):
+    # 单个赛季：各郡各等级数量及坐标范围
+    entry = get_catalog()['by_season'].get(season)
+    if not entry:
+        return jsonify({'error': '该赛季暂无资源数据'}), 404
+    return _cached_json(entry, entry['version'])
+
+@resource_bp.route('/api/resource/map/<season>', methods=['GET'])
+def download_season_map(season):
+    # 整个赛季的资源点，供小程序离线查询。format=json（默认）或 sanmap
+    fmt = request.args.get('format', 'json')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'不支持的格式: {fmt}'}), 400
+    
+    index = get_season_index(season)
+    if not index:
+        return jsonify({'error': '该赛季暂无资源数据'}), 404
+    
+    raw, compressed = export_season_map(index, fmt)
+    use_gzip = 'gzip' in request.accept_encodings
+    response = Response(compressed if use_gzip else raw, mimetype=EXPORT_FORMATS[fmt])
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    # 强 ETag：同一版本、格式、编码的字节完全相同
+    response.set_etag(f"{index.version}-{fmt}{'-gz' if use_gzip else ''}")
+    response.headers['X-Map-Version'] = index.version
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@resource_bp.route('/api/resource/nearest', methods=['GET', 'POST'])
 def find_nearest_copper():
-    data = request.json
-    target_x = int(data.get('x', 0))
-    target_y = int(data.get('y', 0))
+    # GET /api/resource/nearest?season=S1&x=100&y=200&type=8铜&v=<地图版本> 可被 nginx 与客户端缓存
+    data = _query_data()
+    try:
+        target_x = int(data.get('x', 0))
+        target_y = int(data.get('y', 0))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'参数错误: {e}'}), 400
     copper_type = data.get('type', '6铜') # e.g. "6铜", "7铜"
     season = data.get('season', 'S1')
     
-    # 1. Determine County (所属郡)
-    # Find the closest resource point (any type) to determine the county of the input coordinate
-    # Optimization: Query a small box around the target first to find *any* point
-    # If not found, expand search or just query all.
-    # Since we need "Same County", we must know the county.
-    
-    # Try to find a point within 50 radius to guess county
-    # Simple box query first for speed
-    nearby_point = ResourcePoint.query.filter(
-        ResourcePoint.season == season,
-        ResourcePoint.x.between(target_x - 50, target_x + 50),
-        ResourcePoint.y.between(target_y - 50, target_y + 50)
-    ).first()
-    
-    county = None
-    if nearby_point:
-        county = nearby_point.county
-    else:
-        # Fallback: find the absolute nearest point in the whole DB
-        # This might be slow if DB is huge, but for ~10k points it's fine to fetch all?
-        # Better: Order by distance (approximate with SQL)
-        # SQLite doesn't support sqrt easily, use simple abs sum
-        closest = ResourcePoint.query.filter_by(season=season).order_by(
-            func.abs(ResourcePoint.x - target_x) + func.abs(ResourcePoint.y - target_y)
-        ).first()
-        if closest:
-            county = closest.county
-            
-    if not county:
+    index = get_season_index(season)
+    if not index:
         return jsonify({'error': '无法确定所属郡，请检查坐标是否在资源州内'}), 404
+    
+    def compute():
+        # 1. Determine County (所属郡)
+        # 使用内存中的赛季索引：以距离输入坐标最近的资源点（任意等级）所属郡为准
+        county = index.county_at(target_x, target_y)
+        if not county:
+            return {'error': '无法确定所属郡，请检查坐标是否在资源州内'}, 404
         
-    # 2. Find nearest copper of specified type in that county
-    candidates = ResourcePoint.query.filter_by(
-        season=season, 
-        county=county, 
-        level=copper_type
-    ).all()
-    
-    results = get_nearest_points(target_x, target_y, candidates, limit=40)
-    
-    response_data = []
-    for dist, p in results:
-        response_data.append({
-            'id': p.id,
-            'county': p.county,
-            'level': p.level,
-            'x': p.x,
-            'y': p.y,
-            'distance': int(dist)
-        })
-        
+        # 2. Find nearest copper of specified type in that county
+        dists, idx = index.nearest(target_x, target_y, county, copper_type, limit=40)
+        response_data = [index.point_dict(i, dist) for dist, i in zip(dists, idx)]
+        return {'county': county, 'points': response_data}, 200
+    
+    return _query_response('nearest', index, (target_x, target_y, copper_type), compute)
+
+def _int_param(data, name, default, low, high):
+    value = data.get(name)
+    if value is None or value == '':
+        return default
+    value = int(value)
+    if not (low <= value <= high):
+        raise ValueError(f'{name} 超出范围 ({low}-{high})')
+    return value
+
+def _levels_param(data, name='levels'):
+    # "8铜,9铜" 或 ["8铜", "9铜"]，其他类型（数字、非字符串元素）抛出 ValueError
+    levels = data.get(name)
+    if levels is None or levels == '' or levels == []:
+        return None
+    if isinstance(levels, str):
+        levels = levels.split(',')
+    if not isinstance(levels, list) or not all(isinstance(lv, str) for lv in levels):
+        raise ValueError(f'{name} 应为字符串或字符串列表')
+    return [lv.strip() for lv in levels if lv.strip()]
+
+# 批量查询的上限
+MAX_BATCH_POINTS = 500
+MAX_BATCH_LEVELS = 10
+
+@resource_bp.route('/api/resource/nearest/batch', methods=['POST'])
+def find_nearest_batch():
+    # 一次查询多个坐标、多个等级的最近资源点（同盟统一规划用）
+    # points: [{'x': 1, 'y': 2}, ...] 或 [[1, 2], ...]; levels: ['8铜', '9铜']
+    data = request.get_json(silent=True) or {}
+    season = data.get('season', 'S1')
+    raw_points = data.get('points') or []
+    
+    try:
+        levels = _levels_param(data) or _levels_param(data, 'type') or []
+        limit = _int_param(data, 'limit', 10, 1, 40)
+        coords = []
+        for p in raw_points:
+            if isinstance(p, dict):
+                coords.append((int(p.get('x', 0)), int(p.get('y', 0))))
+            else:
+                coords.append((int(p[0]), int(p[1])))
+    except (TypeError, ValueError, IndexError, KeyError) as e:
+        return jsonify({'error': f'参数错误: {e}'}), 400
+    
+    if not coords or not levels:
+        return jsonify({'error': '缺少坐标或等级'}), 400
+    if len(coords) > MAX_BATCH_POINTS or len(levels) > MAX_BATCH_LEVELS:
+        return jsonify({'error': f'单次最多 {MAX_BATCH_POINTS} 个坐标、{MAX_BATCH_LEVELS} 个等级'}), 400
+    
+    index = get_season_index(season)
+    if not index:
+        return jsonify({'error': '该赛季暂无资源数据'}), 404
+    
+    # 1. Determine county of every coordinate, then group by county
+    results = []
+    groups = {}
+    for i, (x, y) in enumerate(coords):
+        county = index.county_at(x, y)
+        results.append({'x': x, 'y': y, 'county': county, 'nearest': {}})
+        if county:
+            groups.setdefault(county, []).append(i)
+    
+    # 2. Per county and level: load candidates once, one distance matrix for the whole group
+    for county, members in groups.items():
+        xs = [coords[i][0] for i in members]
+        ys = [coords[i][1] for i in members]
+        for level in levels:
+            candidates = index.select(county, [level])
+            if not len(candidates):
+                for i in members:
+                    results[i]['nearest'][level] = []
+                continue
+            
+            dists = hex_distance_matrix(xs, ys, index.xs[candidates], index.ys[candidates])
+            best = top_k_rows(dists, limit)
+            for row, i in enumerate(members):
+                results[i]['nearest'][level] = [
+                    index.point_dict(candidates[col], dists[row, col]) for col in best[row]
+                ]
+    
     return jsonify({
-        'county': county,
-        'points': response_data
+        'season': season,
+        'levels': levels,
+        'results': results
     })
 
-@resource_bp.route('/api/resource/relocate', methods=['POST'])
+@resource_bp.route('/api/resource/relocate', methods=['GET', 'POST'])
 def recommend_relocation():
-    data = request.json
-    start_x = int(data.get('x', 0))
-    start_y = int(data.get('y', 0))
-    season = data.get('season', 'S1')
+    # GET /api/resource/relocate?season=S1&x=100&y=200&v=<地图版本> 可被 nginx 与客户端缓存
+    data = _query_data()
     
-    # 1. Determine County
-    nearby_point = ResourcePoint.query.filter(
-        ResourcePoint.season == season,
-        ResourcePoint.x.between(start_x - 50, start_x + 50),
-        ResourcePoint.y.between(start_y - 50, start_y + 50)
-    ).first()
+    # 搜索半径、评分半径均可配置（默认 20 / 5 / 20）
+    try:
+        start_x = int(data.get('x', 0))
+        start_y = int(data.get('y', 0))
+        search_radius = _int_param(data, 'search_radius', DEFAULT_SEARCH_RADIUS, 0, MAX_RADIUS)
+        near_radius = _int_param(data, 'near_radius', DEFAULT_NEAR_RADIUS, 0, MAX_RADIUS)
+        far_radius = _int_param(data, 'far_radius', DEFAULT_FAR_RADIUS, 0, MAX_RADIUS)
+        limit = _int_param(data, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+        requested_levels = _levels_param(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'参数错误: {e}'}), 400
+    season = data.get('season', 'S1')
     
-    county = None
-    if nearby_point:
-        county = nearby_point.county
-    else:
-        closest = ResourcePoint.query.filter_by(season=season).order_by(
-            func.abs(ResourcePoint.x - start_x) + func.abs(ResourcePoint.y - start_y)
-        ).first()
-        if closest:
-            county = closest.county
-            
-    if not county:
+    index = get_season_index(season)
+    if not index:
         return jsonify({'error': '无法确定所属郡'}), 404
-
-    # 2. Get all "8 Copper" (or higher?) in the county
-    # Prompt says "8铜数量最多" (Most 8-Copper). Let's assume exactly "8铜" or maybe "8铜" and above?
-    # Usually "8铜" means level 8.
-    # Let's fetch all level 8 coppers.
-    coppers = ResourcePoint.query.filter(
-        ResourcePoint.season == season,
-        ResourcePoint.county == county,
-        ResourcePoint.level.like('%8铜%')
-    ).all()
-    
-    if not coppers:
-        return jsonify({'county': county, 'points': []})
-
-    # 3. Heatmap Algorithm
-    # We want to find a coordinate (cx, cy) within distance 20 of (start_x, start_y)
-    # that maximizes count of coppers within 5 (primary) and 20 (secondary).
-    
-    # Instead of scanning all pixels, we scan the area around each copper.
-    # A copper at (cx, cy) contributes to the score of any candidate point within range 20.
-    
-    # Candidate points must be within 20 of start.
-    # We can use a dictionary to store scores for candidate points.
-    # candidate_scores = { (x,y): {'score5': 0, 'score20': 0} }
-    
-    candidate_scores = {}
-    
-    # Optimization: Only consider coppers that are within 20 + 20 = 40 of start.
-    # If a copper is further than 40, it cannot be within 20 of any point that is within 20 of start.
-    relevant_coppers = []
-    for c in coppers:
-        dist_to_start = hex_distance(start_x, start_y, c.x, c.y)
-        if dist_to_start <= 40:
-            relevant_coppers.append(c)
-            
-    # Now, for each relevant copper, "splat" its influence onto the grid.
-    # But the grid is continuous/large.
-    # Iterating all points within 20 of a copper is expensive (radius 20 ~ 1200 points).
-    # If we have 100 coppers, that's 120k operations. Feasible.
-    
-    # However, we only care about points that are valid candidates (dist to start <= 50).
-    # So we can iterate candidate points?
-    # Area 50 radius ~ 7500 points.
-    # For each candidate point, check distance to all relevant coppers.
-    # 7500 * (num_coppers). If num_coppers is small (<100), this is fast (750k ops).
-    # Python might be slow for 1M ops in a web request.
-    
-    # Let's try the "Candidate Points" approach but optimized.
-    # We only care about "peaks".
-    # The optimal location is likely near a cluster of coppers.
-    # So we can just check points "near" the coppers?
-    # Or just scan the 50-radius area around start?
-    
-    # Let's scan the 20-radius area around start.
-    # To generate points in a hex grid within radius N is complex.
-    # Simple approach: Scan bounding box [start_x-20, start_x+20] x [start_y-20, start_y+20]
-    # Check hex distance <= 20.
-    
-    candidates = []
-    
-    # Bounding box scan
-    for dx in range(-20, 21):
-        for dy in range(-20, 21):
-            cx = start_x + dx
-            cy = start_y + dy
-            
-            # Check map bounds (0-1500)
-            if not (0 <= cx <= 1500 and 0 <= cy <= 1500):
-                continue
-                
-            if hex_distance(start_x, start_y, cx, cy) <= 20:
-                candidates.append((cx, cy))
-                
-    # Calculate scores
-    # To optimize, pre-calculate copper coordinates
-    copper_coords = [(c.x, c.y) for c in relevant_coppers]
-    
-    scored_candidates = []
-    
-    for cx, cy in candidates:
-        score5 = 0
-        score20 = 0
+    
+    # Copper levels to count, "8铜" by default
+    levels = sorted(set(requested_levels or default_copper_levels(index)))
+    
+    def compute():
+        # 1. Determine County
+        county = index.county_at(start_x, start_y)
+        if not county:
+            return {'error': '无法确定所属郡'}, 404
         
-        for cop_x, cop_y in copper_coords:
-            d = hex_distance(cx, cy, cop_x, cop_y)
-            if d <= 5:
-                score5 += 1
-            if d <= 20:
-                score20 += 1
-                
-        if score20 > 0: # Only keep interesting points
-            dist_to_start = hex_distance(start_x, start_y, cx, cy)
-            scored_candidates.append({
-                'x': cx,
-                'y': cy,
-                'score5': score5,
-                'score20': score20,
-                'distance': int(dist_to_start)
-            })
-            
-    # Sort: Primary score5 desc, Secondary score20 desc
-    scored_candidates.sort(key=lambda item: (-item['score5'], -item['score20']))
+        # 2. Heatmap lookup: precomputed per-county density grids
+        top_locations = recommend_locations(
+            index, county, start_x, start_y, levels,
+            search_radius=search_radius,
+            near_radius=near_radius,
+            far_radius=far_radius,
+            limit=limit
+        )
+        return {
+            'county': county,
+            'levels': levels,
+            'search_radius': search_radius,
+            'near_radius': near_radius,
+            'far_radius': far_radius,
+            'top_locations': top_locations
+        }, 200
+    
+    params = (start_x, start_y, tuple(levels), search_radius, near_radius, far_radius, limit)
+    return _query_response('relocate', index, params, compute)
+
+@resource_bp.route('/api/resource/within', methods=['POST'])
+def find_within_radius():
+    # 某坐标周围 radius 格内的所有资源点（不限郡），按距离排序
+    data = request.get_json(silent=True) or {}
+    season = data.get('season', 'S1')
+    
+    try:
+        target_x = _int_param(data, 'x', 0, 0, MAP_MAX)
+        target_y = _int_param(data, 'y', 0, 0, MAP_MAX)
+        radius = _int_param(data, 'radius', 10, 0, MAX_RADIUS)
+        levels = _levels_param(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'参数错误: {e}'}), 400
+    
+    index = get_season_index(season)
+    if not index:
+        return jsonify({'error': '该赛季暂无资源数据'}), 404
+    
+    dists, idx = index.within(target_x, target_y, radius, levels)
     
     return jsonify({
+        'radius': radius,
+        'count': len(idx),
+        'points': [index.point_dict(i, dist) for dist, i in zip(dists, idx)]
+    })
+
+MAX_COVERAGE_MEMBERS = 200
+
+@resource_bp.route('/api/resource/coverage', methods=['POST'])
+def plan_alliance_coverage():
+    # 同盟铜矿覆盖规划：给出成员主城坐标和可达半径，推荐哪些成员迁到哪里
+    # members: [{'name': 'a', 'x': 1, 'y': 2, 'fixed': false}, ...]
+    data = request.get_json(silent=True) or {}
+    season = data.get('season', 'S1')
+    raw_members = data.get('members') or []
+    
+    try:
+        radius = _int_param(data, 'radius', DEFAULT_NEAR_RADIUS, 0, MAX_RADIUS)
+        members = []
+        for i, m in enumerate(raw_members):
+            if isinstance(m, dict):
+                members.append({
+                    'name': m.get('name') or str(i + 1),
+                    'x': int(m['x']),
+                    'y': int(m['y']),
+                    'fixed': bool(m.get('fixed'))
+                })
+            else:
+                members.append({'name': str(i + 1), 'x': int(m[0]), 'y': int(m[1]), 'fixed': False})
+        max_moves = _int_param(data, 'max_moves', len(members), 0, MAX_COVERAGE_MEMBERS)
+        requested_levels = _levels_param(data)
+    except (TypeError, ValueError, IndexError, KeyError) as e:
+        return jsonify({'error': f'参数错误: {e}'}), 400
+    
+    if not members:
+        return jsonify({'error': '缺少成员坐标'}), 400
+    if len(members) > MAX_COVERAGE_MEMBERS:
+        return jsonify({'error': f'单次最多 {MAX_COVERAGE_MEMBERS} 个成员'}), 400
+    
+    index = get_season_index(season)
+    if not index:
+        return jsonify({'error': '该赛季暂无资源数据'}), 404
+    
+    # 未指定郡时取成员主城所在最多的郡
+    county = data.get('county')
+    if not county:
+        counties = Counter(index.county_at(m['x'], m['y']) for m in members)
+        counties.pop(None, None)
+        if not counties:
+            return jsonify({'error': '无法确定所属郡'}), 404
+        county = counties.most_common(1)[0][0]
+    
+    levels = requested_levels or default_coverage_levels(index)
+    result = plan_coverage(index, county, members, levels, radius, max_moves)
+    result.update({
+        'season': season,
         'county': county,
-        'top_locations': scored_candidates[:40]
+        'levels': levels,
+        'radius': radius
     })
+    return jsonify(result)
+
+@resource_bp.route('/api/resource/tiles/<season>', methods=['GET'])
+def get_tile_info(season):
+    # 热力图瓦片参数：当前地图版本与瓦片地址模板（地址经 nginx 静态文件缓存）
+    index = get_season_index(season)
+    if not index:
+        return jsonify({'error': '该赛季暂无资源数据'}), 404
+    payload = {
+        'season': season,
+        'version': index.version,
+        'levels': [ALL_LEVELS] + list(index.levels),
+        'tile_size': TILE_SIZE,
+        'world_size': WORLD_SIZE,
+        'max_zoom': MAX_ZOOM,
+        'formats': sorted(TILE_FORMATS),
+        'url': f"/static/tiles/{season}/{index.version}/{{level}}/{{z}}/{{x}}/{{y}}.png"
+    }
+    return _cached_json(payload, index.version)
+
+@resource_bp.route('/api/resource/tiles/<season>/<version>/<level>/<int:z>/<int:x>/<int:y>.<ext>', methods=['GET'])
+def get_map_tile(season, version, level, z, x, y, ext):
+    # nginx 在 static/tiles 下找不到文件时转发到这里：渲染、写入缓存后返回
+    index = get_season_index(season)
+    if not index or version != index.version:
+        return jsonify({'error': '地图版本已更新，请重新获取瓦片地址'}), 404
+    if ext not in TILE_FORMATS or not valid_tile(z, x, y):
+        return jsonify({'error': '瓦片不存在'}), 404
+    if level != ALL_LEVELS and level not in index.levels:
+        return jsonify({'error': '等级不存在'}), 404
+    
+    path = get_tile(current_app.config['TILE_CACHE_FOLDER'], index, level, z, x, y, ext)
+    # 地址中带地图版本，内容不会变化
+    return send_file(path, mimetype=f'image/{ext}', max_age=30 * 24 * 3600)
+
+def _is_admin():
+    expected = current_app.config.get('ADMIN_TOKEN')
+    # 不接受查询参数中的 token，以免写入访问日志
+    token = request.headers.get('X-Admin-Token') or request.form.get('token')
+    return bool(expected) and bool(token) and hmac.compare_digest(token, expected)
+
+@resource_bp.route('/api/resource/admin/publish', methods=['POST'])
+def publish_season_map():
+    # 上传赛季地图 CSV，后台构建索引后原子替换，无需重启
+    if not _is_admin():
+        return jsonify({'error': '无权限'}), 403
+    
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        return jsonify({'error': 'No file part'}), 400
+    season = request.form.get('season') or os.path.splitext(file.filename)[0]
+    
+    try:
+        job_id = publish_map(season, file.read())
+    except MapFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'success': True, 'job_id': job_id, 'season': season.strip()}), 202
+
+@resource_bp.route('/api/resource/admin/publish/<job_id>', methods=['GET'])
+def get_publish_status(job_id):
+    if not _is_admin():
+        return jsonify({'error': '无权限'}), 403
+    
+    job = publish_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
 @resource_bp.route('/api/resource', methods=['GET'])
 def index():
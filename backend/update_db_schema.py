@@ -46,6 +46,70 @@ def update_schema():
             except Exception as e:
                 print(f"Error updating users table for column {col_name}: {e}")
 
+        # 3. Update upload_records table: content fingerprint for deduplication
+        try:
+            with db.engine.connect() as conn:
+                try:
+                    conn.execute(text("SELECT content_hash FROM upload_records LIMIT 1"))
+                    print("Column 'content_hash' already exists in 'upload_records'.")
+                except Exception:
+                    print("Adding 'content_hash' column to 'upload_records'...")
+                    conn.execute(text("ALTER TABLE upload_records ADD COLUMN content_hash VARCHAR(64)"))
+                    conn.execute(text("CREATE INDEX ix_upload_records_content_hash ON upload_records (content_hash)"))
+                    conn.commit()
+                    print("Success.")
+        except Exception as e:
+            print(f"Error updating upload_records: {e}")
+
+        # 3b. One upload per (uploader, content fingerprint)
+        try:
+            with db.engine.connect() as conn:
+                try:
+                    conn.execute(text("SELECT hash_scope FROM upload_records LIMIT 1"))
+                    print("Column 'hash_scope' already exists in 'upload_records'.")
+                except Exception:
+                    print("Adding 'hash_scope' column to 'upload_records'...")
+                    conn.execute(text("ALTER TABLE upload_records ADD COLUMN hash_scope VARCHAR(64) NOT NULL DEFAULT ''"))
+                    conn.execute(text("UPDATE upload_records SET hash_scope = COALESCE(user_id, '')"))
+                    conn.commit()
+                    print("Success.")
+            with db.engine.connect() as conn:
+                try:
+                    conn.execute(text("CREATE UNIQUE INDEX _upload_content_uc ON upload_records (hash_scope, content_hash)"))
+                    conn.commit()
+                    print("Created unique index '_upload_content_uc'.")
+                except Exception as e:
+                    print(f"Unique index '_upload_content_uc' not created (already exists or duplicate uploads present): {e}")
+        except Exception as e:
+            print(f"Error updating upload_records: {e}")
+
+        # 4. Member dimension tables, alliance_data.member_id and backfill of existing uploads
+        #    (including the per-snapshot member index alliance_snapshot_members)
+        try:
+            db.create_all()
+            with db.engine.connect() as conn:
+                try:
+                    conn.execute(text("SELECT member_id FROM alliance_data LIMIT 1"))
+                    print("Column 'member_id' already exists in 'alliance_data'.")
+                except Exception:
+                    print("Adding 'member_id' column to 'alliance_data'...")
+                    conn.execute(text("ALTER TABLE alliance_data ADD COLUMN member_id INTEGER REFERENCES member_profiles(id)"))
+                    conn.execute(text("CREATE INDEX ix_alliance_data_member_id ON alliance_data (member_id)"))
+                    conn.commit()
+                    print("Success.")
+            with db.engine.connect() as conn:
+                try:
+                    conn.execute(text("CREATE INDEX ix_alliance_data_upload_id ON alliance_data (upload_id)"))
+                    conn.commit()
+                    print("Created index 'ix_alliance_data_upload_id'.")
+                except Exception:
+                    print("Index 'ix_alliance_data_upload_id' already exists.")
+
+            from utils.alliance_members import backfill_member_ids
+            print(f"Assigned member ids for {backfill_member_ids()} uploads.")
+        except Exception as e:
+            print(f"Error updating alliance_data member ids: {e}")
+
     print("Database schema update completed.")
 
 if __name__ == '__main__':
@@ -0,0 +1,198 @@
+"""
+同盟统计批量上传
+
+一次请求上传多个 CSV 或一个 zip 压缩包，接口读入文件后立即返回任务 id，
+后台计算内容指纹、去重、解析、写入。每个文件由有界线程池中的一个线程处理
+（解析 + 同一事务写入），文件之间互不影响，单个文件失败只记录在该文件的状态里。
+并发的批量任务写入同一内容时由 upload_records 的唯一约束拒绝，后写入的文件记为跳过。
+
+任务状态中的 files 列表记录每个文件的进度（见 batch_status）:
+    {'filename', 'stats_time', 'status': pending|running|done|skipped|failed,
+     'count', 'upload_id', 'message'}
+"""
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from utils.jobs import JobRegistry
+from utils.alliance_ingest import (
+    parse_alliance_csv, write_snapshot, parse_stats_time,
+    find_duplicate_upload, archive_upload, content_fingerprint, CSVFormatError
+)
+
+# 同时处理的批量任务数 / 所有任务共享的文件处理线程数
+batch_jobs = JobRegistry('alliance-batch', max_workers=2)
+INGEST_WORKERS = 4
+_file_workers = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='alliance-ingest')
+
+MAX_BATCH_FILES = 50
+# zip 中单个文件解压后的大小上限
+MAX_MEMBER_SIZE = 8 * 1024 * 1024
+# 一批文件（zip 解压后）的总大小上限
+MAX_BATCH_SIZE = 64 * 1024 * 1024
+
+
+def _zip_member_name(info):
+    # 没有 UTF-8 标记的 zip（Windows 压缩）文件名是本地编码，按 GBK 还原
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        try:
+            name = name.encode('cp437').decode('gb18030')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name.rsplit('/', 1)[-1]
+
+
+def expand_uploads(uploads):
+    """
+    [(文件名, bytes)] -> [(文件名, bytes)]，zip 展开为其中的 CSV 文件。
+    先按 zip 目录检查文件数和解压后的总大小，都在上限内才解压。
+    """
+    entries = []
+    archives = []
+    try:
+        for filename, data in uploads:
+            if filename.lower().endswith('.zip') or zipfile.is_zipfile(io.BytesIO(data)):
+                try:
+                    archive = zipfile.ZipFile(io.BytesIO(data))
+                except zipfile.BadZipFile:
+                    raise CSVFormatError(f'{filename}: invalid zip file')
+                archives.append(archive)
+                for info in archive.infolist():
+                    name = _zip_member_name(info)
+                    if info.is_dir() or not name.lower().endswith('.csv') or name.startswith('.'):
+                        continue
+                    if info.file_size > MAX_MEMBER_SIZE:
+                        raise CSVFormatError(f'{name}: file too large')
+                    entries.append((name, info.file_size, filename, archive, info))
+            else:
+                entries.append((filename, len(data), filename, None, data))
+
+        if len(entries) > MAX_BATCH_FILES:
+            raise CSVFormatError(f'At most {MAX_BATCH_FILES} files per batch')
+        if sum(size for _, size, _, _, _ in entries) > MAX_BATCH_SIZE:
+            raise CSVFormatError(f'Batch larger than {MAX_BATCH_SIZE // (1024 * 1024)}MB')
+
+        files = []
+        for name, _, filename, archive, item in entries:
+            if archive is None:
+                files.append((name, item))
+                continue
+            # 读出的数据不会超过目录中记录的大小（超出时 CRC 校验失败）
+            try:
+                files.append((name, archive.read(item)))
+            except (zipfile.BadZipFile, NotImplementedError, RuntimeError):
+                raise CSVFormatError(f'{filename}: invalid zip file')
+        return files
+    finally:
+        for archive in archives:
+            archive.close()
+
+
+def submit_batch(app, uploads, user_id, upload_folder):
+    """
+    uploads: [(文件名, bytes)]，返回任务 id。内容指纹在后台任务中计算，
+    同一批中内容相同或统计时间相同的文件只保留第一个。
+    """
+    files = expand_uploads(uploads)
+    if not files:
+        raise CSVFormatError('No CSV files found')
+
+    entries = []
+    for filename, _ in files:
+        stats_time = parse_stats_time(filename)
+        entries.append({
+            'filename': filename,
+            'stats_time': stats_time.isoformat() if stats_time else None,
+            'status': 'pending',
+            'count': 0,
+            'upload_id': None,
+            'message': None
+        })
+
+    return batch_jobs.submit(
+        app, _run_batch, [data for _, data in files], user_id, upload_folder,
+        files=entries, total=len(entries)
+    )
+
+
+def _run_batch(job, datas, user_id, upload_folder):
+    app = current_app._get_current_object()
+
+    # 指纹在文件线程池中并行计算，按文件顺序去重
+    hashes = list(_file_workers.map(content_fingerprint, datas))
+    seen = set()
+    for entry, content_hash in zip(job['files'], hashes):
+        stats_time = parse_stats_time(entry['filename'])
+        if content_hash in seen or (stats_time and stats_time in seen):
+            entry['status'] = 'skipped'
+            entry['message'] = 'Duplicate content or timestamp in batch, skipped.'
+        seen.update(k for k in (content_hash, stats_time) if k)
+
+    futures = []
+    for entry, payload in zip(job['files'], zip(datas, hashes)):
+        if entry['status'] == 'skipped':
+            continue
+        futures.append(_file_workers.submit(_ingest_file, app, entry, payload, user_id, upload_folder))
+    wait(futures)
+
+    counts = {}
+    for entry in job['files']:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    return counts
+
+
+def _ingest_file(app, entry, payload, user_id, upload_folder):
+    entry['status'] = 'running'
+    try:
+        with app.app_context():
+            try:
+                _ingest(entry, payload, user_id, upload_folder)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+    except CSVFormatError as e:
+        entry['status'] = 'failed'
+        entry['message'] = str(e)
+    except Exception as e:
+        print(f"ERROR: batch upload of {entry['filename']} failed: {e}")
+        entry['status'] = 'failed'
+        entry['message'] = 'Database error'
+
+
+def _ingest(entry, payload, user_id, upload_folder):
+    data, content_hash = payload
+    stats_time = parse_stats_time(entry['filename'])
+    if find_duplicate_upload(stats_time, content_hash, user_id):
+        entry['status'] = 'skipped'
+        entry['message'] = 'File already exists (duplicate content or timestamp), skipped.'
+        return
+
+    _, _, rows = parse_alliance_csv(io.BytesIO(data))
+    try:
+        upload_id = write_snapshot(rows, entry['filename'], stats_time, user_id, content_hash)
+        db.session.commit()
+    except IntegrityError:
+        # 另一个上传同时写入了相同内容
+        db.session.rollback()
+        entry['status'] = 'skipped'
+        entry['message'] = 'File already exists (duplicate content or timestamp), skipped.'
+        return
+    archive_upload(upload_folder, entry['filename'], data)
+    entry['upload_id'] = upload_id
+    entry['count'] = len(rows)
+    entry['status'] = 'done'
+
+
+def batch_status(job_id):
+    job = batch_jobs.get(job_id)
+    if not job:
+        return None
+    files = [dict(entry) for entry in job['files']]
+    job['files'] = files
+    job['finished'] = sum(1 for entry in files if entry['status'] not in ('pending', 'running'))
+    return job
@@ -0,0 +1,308 @@
+"""
+同盟统计对比
+
+对比两次上传中同一成员某项指标的变化（见 compute_comparison）。计算结果和
+生成的分组图片按 (较早上传, 较晚上传, 指标) 存入 compare_results，同盟成员
+重复打开同一对比时直接返回，不再读取成员数据或重新绘图。
+
+metric=all 时一次返回全部指标（见 compare_all_metrics）：在数据库中按成员 id
+把两次上传的明细行自连接，各指标的差值在同一条 SQL 中计算。分组排序和组内
+名次在 Python 中完成，不受数据库排序规则（collation）影响，与数组计算一致。
+
+分组图片不在请求中生成：接口先返回对比数据和预期的图片列表（ready=False），
+图片交给后台渲染队列（render_jobs，单线程），客户端轮询 render_status 取得
+每张图片的就绪状态。全部生成后结果才写入缓存。
+
+删除上传（或登记改名合并成员）时删除相关的缓存记录及其图片文件。
+"""
+import os
+import json
+import threading
+import numpy as np
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import or_, and_, case, func, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import CompareResult, AllianceData, UploadRecord
+from utils.jobs import JobRegistry
+from utils.image_generator import ImageGenerator
+from utils.alliance_snapshot import load_snapshot, match_members, METRIC_ALIASES
+
+# 一次返回全部指标
+ALL_METRICS = 'all'
+
+METRIC_LABELS = {
+    'battle': '战功值',
+    'power': '势力值',
+    'contribution': '贡献',
+    'assist': '攻城值',
+    'donation': '罚款捐献'
+}
+
+# 图片渲染是 CPU 密集的 Pillow 绘图，单线程排队执行，不占用 Web 线程
+render_jobs = JobRegistry('compare-render', max_workers=1)
+# 正在渲染的对比 -> 任务 id，同一对比的重复请求共用一个任务
+_active_renders = {}
+_active_lock = threading.Lock()
+
+DEFAULT_GROUP = '未分组'
+
+
+def _align(early_id, late_id):
+    """读取两次上传并按成员对齐，返回 (early, late, positions, matched, groups)"""
+    # Fetch data：打包快照或明细行，统一为数组
+    early = load_snapshot(early_id)
+    late = load_snapshot(late_id)
+
+    print(f"Comparing Upload, id {early_id} ({len(early)}) vs id {late_id} ({len(late)})")
+
+    # 按成员 id 对齐（改名的成员也能对上）：late 中每个成员在 early 中的下标，不存在为 -1
+    positions = match_members(early, late)
+    matched = np.flatnonzero(positions >= 0)
+
+    late_groups = late.group_names()
+    early_groups = early.group_names()
+    # Use late group if available, else early group
+    groups = [late_groups[i] if late_groups[i] != DEFAULT_GROUP else early_groups[positions[i]] for i in matched]
+    return early, late, positions, matched, groups
+
+
+def compute_comparison(early_id, late_id, metric):
+    """[{name, group, diff, early_val, late_val}]，按分组、差值降序"""
+    early, late, positions, matched, groups = _align(early_id, late_id)
+    late_vals = late.metric(metric)[matched]
+    early_vals = early.metric(metric)[positions[matched]]
+    diffs = late_vals - early_vals
+
+    results = []
+    for k, i in enumerate(matched):
+        group = groups[k]
+        results.append({
+            'name': late.names[i],
+            'group': group,
+            'diff': int(diffs[k]),
+            'early_val': int(early_vals[k]),
+            'late_val': int(late_vals[k])
+        })
+
+    # Sort by group then diff descending
+    results.sort(key=lambda x: (x['group'], -x['diff']))
+    return results
+
+
+def compare_all_metrics(early_id, late_id):
+    """
+    全部指标的对比:
+        [{member_id, name, group, <指标>: {early_val, late_val, diff, rank}}]
+    rank 为该指标差值在组内的名次（从 1 开始）。结果按分组、战功差值降序，
+    与 metric=battle 的顺序一致。
+
+    两次上传都有明细行时由一条 SQL 完成；只有打包快照（或升级前未补成员 id）
+    时回退到数组计算。
+    """
+    results = _compare_all_sql(early_id, late_id)
+    if not results:
+        results = _compare_all_arrays(early_id, late_id)
+    return results
+
+
+def _compare_all_sql(early_id, late_id):
+    late = aliased(AllianceData)
+    early = aliased(AllianceData)
+    # 同一成员在较早的上传中出现多次时取最后一行（与按名字构造 dict 一致）
+    latest = select(func.max(AllianceData.id).label('id')).where(
+        AllianceData.upload_id == early_id, AllianceData.member_id.isnot(None)
+    ).group_by(AllianceData.member_id).subquery()
+
+    group = case((late.group_name != DEFAULT_GROUP, late.group_name), else_=early.group_name)
+    columns = []
+    for metric, field in METRIC_ALIASES.items():
+        early_val = func.coalesce(getattr(early, field), 0)
+        late_val = func.coalesce(getattr(late, field), 0)
+        diff = late_val - early_val
+        columns.extend([
+            early_val.label(f'{metric}_early'),
+            late_val.label(f'{metric}_late'),
+            diff.label(f'{metric}_diff'),
+        ])
+
+    stmt = select(late.member_id, late.name, group.label('grp'), *columns).select_from(late).join(
+        early, and_(early.member_id == late.member_id, early.upload_id == early_id)
+    ).join(
+        latest, latest.c.id == early.id
+    ).where(late.upload_id == late_id).order_by(late.id)
+
+    results = []
+    for row in db.session.execute(stmt).mappings():
+        item = {'member_id': row['member_id'], 'name': row['name'], 'group': row['grp']}
+        for metric in METRIC_ALIASES:
+            item[metric] = {
+                'early_val': int(row[f'{metric}_early']),
+                'late_val': int(row[f'{metric}_late']),
+                'diff': int(row[f'{metric}_diff'])
+            }
+        results.append(item)
+    return _rank_and_sort(results)
+
+
+def _compare_all_arrays(early_id, late_id):
+    early, late, positions, matched, groups = _align(early_id, late_id)
+    results = [{
+        'member_id': int(late.member_ids[i]) if late.member_ids is not None else None,
+        'name': late.names[i],
+        'group': groups[k]
+    } for k, i in enumerate(matched)]
+
+    for metric in METRIC_ALIASES:
+        late_vals = late.metric(metric)[matched]
+        early_vals = early.metric(metric)[positions[matched]]
+        diffs = late_vals - early_vals
+        for k, item in enumerate(results):
+            item[metric] = {'early_val': int(early_vals[k]), 'late_val': int(late_vals[k]), 'diff': int(diffs[k])}
+    return _rank_and_sort(results)
+
+
+def _rank_and_sort(results):
+    """results 按行序排列，填入各指标的组内名次并按分组、战功差值降序排序"""
+    for metric in METRIC_ALIASES:
+        # 组内名次：差值降序，相同时按行序
+        order = sorted(range(len(results)), key=lambda k: (results[k]['group'], -results[k][metric]['diff']))
+        previous = None
+        for k in order:
+            rank = rank + 1 if results[k]['group'] == previous else 1
+            previous = results[k]['group']
+            results[k][metric]['rank'] = rank
+
+    results.sort(key=lambda x: (x['group'], -x['battle']['diff']))
+    return results
+
+
+def cacheable(metric):
+    # 只缓存已知指标，任意字符串不会写入缓存表
+    return metric in METRIC_ALIASES or metric == ALL_METRICS
+
+
+def image_prefix(early_id, late_id, metric):
+    """缓存对比的图片文件名前缀，同一对比重新生成时覆盖原文件"""
+    return f"compare_{early_id}_{late_id}_{metric}"
+
+
+def get_cached_comparison(early_id, late_id, metric, image_dir):
+    """返回 (results, images)；没有缓存或图片文件已不存在时返回 None"""
+    entry = CompareResult.query.filter_by(
+        early_upload_id=early_id, late_upload_id=late_id, metric=metric
+    ).first()
+    if entry is None:
+        return None
+    images = json.loads(entry.images)
+    if not all(os.path.exists(os.path.join(image_dir, img['filename'])) for img in images):
+        return None
+    return json.loads(entry.results), images
+
+
+def store_comparison(early_id, late_id, metric, results, images):
+    """写入（或覆盖）缓存并提交；并发请求同时写入时保留先写入的一条"""
+    values = {
+        'results': json.dumps(results, ensure_ascii=False),
+        'images': json.dumps(images, ensure_ascii=False),
+        'created_at': datetime.now()
+    }
+    entry = CompareResult.query.filter_by(
+        early_upload_id=early_id, late_upload_id=late_id, metric=metric
+    ).first()
+    if entry is None:
+        db.session.add(CompareResult(early_upload_id=early_id, late_upload_id=late_id, metric=metric, **values))
+    else:
+        for key, value in values.items():
+            setattr(entry, key, value)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+
+
+def invalidate_comparisons(upload_id=None):
+    """
+    删除涉及某次上传（upload_id 为 None 时全部）的缓存记录，只修改当前会话，
+    由调用方 commit。返回其图片文件名，提交后用 remove_images 删除。
+    """
+    query = CompareResult.query
+    if upload_id is not None:
+        query = query.filter(or_(
+            CompareResult.early_upload_id == upload_id,
+            CompareResult.late_upload_id == upload_id
+        ))
+    filenames = []
+    for entry in query.all():
+        filenames.extend(img['filename'] for img in json.loads(entry.images))
+        db.session.delete(entry)
+    return filenames
+
+
+def remove_images(image_dir, filenames):
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(image_dir, filename))
+        except OSError:
+            pass
+
+
+def submit_render(app, early_id, late_id, metric, results, early_ts, late_ts):
+    """
+    把一次对比的图片交给后台渲染，返回任务 id。任务状态中的 images 列表
+    在提交时即包含全部预期图片（ready=False），每生成一张更新一次。
+    """
+    key = (early_id, late_id, metric)
+    with _active_lock:
+        job_id = _active_renders.get(key)
+        job = render_jobs.get(job_id) if job_id else None
+        if job and job['status'] in ('pending', 'running'):
+            return job_id
+
+        prefix = image_prefix(early_id, late_id, metric)
+        images = [{
+            'group': group,
+            'filename': ImageGenerator.comparison_filename(prefix, group),
+            'ready': False
+        } for group, _ in ImageGenerator.comparison_groups(results)]
+        job_id = render_jobs.submit(
+            app, _render, key, results, early_ts, late_ts,
+            early_upload_id=early_id, late_upload_id=late_id, metric=metric, images=images
+        )
+        _active_renders[key] = job_id
+        return job_id
+
+
+def _render(job, key, results, early_ts, late_ts):
+    early_id, late_id, metric = key
+    try:
+        generator = ImageGenerator(os.path.join(current_app.root_path, 'resources'))
+        output_dir = os.path.join(current_app.root_path, 'static', 'generated')
+        pending = {img['filename']: img for img in job['images']}
+
+        def on_image(img):
+            pending[img['filename']]['ready'] = True
+
+        image_paths = generator.generate_comparison_images(
+            results, early_ts, late_ts, METRIC_LABELS.get(metric, metric), output_dir, metric,
+            name_prefix=image_prefix(early_id, late_id, metric), on_image=on_image
+        )
+        # 渲染期间上传被删除时不再写入缓存
+        if db.session.get(UploadRecord, early_id) and db.session.get(UploadRecord, late_id):
+            store_comparison(early_id, late_id, metric, results, image_paths)
+        return len(image_paths)
+    finally:
+        with _active_lock:
+            if _active_renders.get(key) == job['id']:
+                del _active_renders[key]
+
+
+def render_status(job_id):
+    job = render_jobs.get(job_id)
+    if not job:
+        return None
+    job['images'] = [dict(img) for img in job['images']]
+    job['ready'] = all(img['ready'] for img in job['images'])
+    return job
@@ -0,0 +1,315 @@
+"""
+同盟统计 CSV 导入
+
+上传的文件流只读一遍：先根据开头的字节判断编码，表头解析一次得到各字段
+所在的列号，之后每行直接转换成与 ROW_FIELDS 顺序一致的元组，不再为每行
+构造 dict 或 ORM 对象。
+
+单文件上传不把整个文件读入内存：open_alliance_csv 在上传的（临时文件）流上
+一遍同时计算内容指纹、校验编码并数行数，返回的 CSVRows 每次迭代从流中重新
+解析，write_snapshot 先迭代一遍登记成员 id，再迭代一遍分块写入。
+
+写入使用 Core insert：上传记录和全部成员数据在同一个事务中，成员数据分块
+executemany（SQLAlchemy 会合并为多行 VALUES），或按配置写为打包快照
+（见 alliance_snapshot）。每行的成员名在写入前换成成员 id（见 alliance_members）。
+"""
+import io
+import os
+import re
+import csv
+import codecs
+import shutil
+import hashlib
+from datetime import datetime
+from sqlalchemy import insert
+from extensions import db
+from models import UploadRecord, AllianceData
+from utils.alliance_snapshot import ROW_FIELDS, storage_mode, write_packed_snapshot
+from utils.alliance_members import member_scope, resolve_member_ids
+
+# 各字段可能的表头名称，按优先级排列
+COLUMN_KEYS = {
+    'rank': ['排名', 'Rank', '贡献排行'],
+    'name': ['成员', '名字', 'Name'],
+    'group_name': ['分组', 'Group'],
+    'contribution': ['贡献', 'Contribution', '贡献总量'],
+    'power': ['势力值', '势力', 'Power'],
+    'battle_achievement': ['战功', 'Battle', '战功总量'],
+    'assist': ['助攻', 'Assist', '助攻总量'],
+    'donation': ['捐献', 'Donation', '捐献总量'],
+}
+
+DEFAULT_GROUP = '未分组'
+
+# 判断编码时读取的字节数，一般的统计文件会被整个读入
+PREFIX_SIZE = 64 * 1024
+
+# 写入明细行时每次 executemany 的行数
+INSERT_CHUNK = 1000
+
+
+# 文件名中的统计时间，例如 同盟统计2025年01月25日13时30分12秒.csv
+STATS_TIME_PATTERN = re.compile(r'(\d{4})年(\d{1,2})月(\d{1,2})日(\d{1,2})时(\d{1,2})分(\d{1,2})秒')
+
+
+class CSVFormatError(Exception):
+    pass
+
+
+def parse_stats_time(filename):
+    """从文件名解析统计时间，解析不出时返回 None"""
+    match = STATS_TIME_PATTERN.search(filename or '')
+    if not match:
+        return None
+    try:
+        return datetime(*(int(g) for g in match.groups()))
+    except ValueError:
+        return None
+
+
+def content_fingerprint(data):
+    """
+    文件内容指纹：解码后逐行去掉首尾空白、忽略空行，再计算 sha256。
+    与编码、BOM、换行符无关，改名后的同一份统计文件指纹相同。
+    """
+    encoding = detect_encoding(data[:PREFIX_SIZE])
+    try:
+        text = data.decode(encoding)
+    except UnicodeDecodeError:
+        text = data.decode('gb18030', errors='replace')
+    h = hashlib.sha256()
+    for line in text.lstrip('\ufeff').splitlines():
+        line = line.strip()
+        if line:
+            h.update(line.encode('utf-8'))
+            h.update(b'\n')
+    return h.hexdigest()
+
+
+def _fingerprint_lines(lines, h):
+    """逐行透传，同时按 content_fingerprint 的规则更新指纹"""
+    first = True
+    for line in lines:
+        normalized = line.lstrip('\ufeff') if first else line
+        first = False
+        for part in normalized.splitlines():
+            part = part.strip()
+            if part:
+                h.update(part.encode('utf-8'))
+                h.update(b'\n')
+        yield line
+
+
+def find_duplicate_upload(stats_time, content_hash, user_id=None):
+    """
+    去重：同一用户已有内容指纹相同（索引查询），或统计时间相同的记录。
+    """
+    query = UploadRecord.query
+    if user_id:
+        query = query.filter_by(user_id=user_id)
+
+    record = query.filter_by(content_hash=content_hash).first()
+    if record is None and stats_time:
+        record = query.filter_by(stats_time=stats_time).first()
+    return record
+
+
+def archive_upload(upload_folder, filename, data):
+    """把原始文件（bytes 或可 seek 的二进制流）保存到上传目录，返回保存路径"""
+    os.makedirs(upload_folder, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    file_path = os.path.join(upload_folder, f"{timestamp}_{os.path.basename(filename)}")
+    with open(file_path, 'wb') as f:
+        if isinstance(data, bytes):
+            f.write(data)
+        else:
+            data.seek(0)
+            shutil.copyfileobj(data, f)
+    return file_path
+
+
+def detect_encoding(prefix):
+    """根据文件开头的字节判断编码：UTF-8（可带 BOM），否则按 GB18030 处理"""
+    if prefix.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        prefix.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        # 截断在多字节字符中间
+        if e.reason == 'unexpected end of data':
+            return 'utf-8'
+        return 'gb18030'
+
+
+def parse_int(value):
+    """Helper to parse integer from string, handling empty or invalid values."""
+    if not value:
+        return 0
+    try:
+        # Remove commas if present (e.g. "1,234")
+        return int(float(value.replace(',', '')))
+    except (ValueError, TypeError):
+        return 0
+
+
+def resolve_columns(header):
+    """表头 -> {字段: 列号}，找不到的字段为 None"""
+    positions = {}
+    for i, key in enumerate(header):
+        key = key.strip()
+        if key and key not in positions:
+            positions[key] = i
+
+    columns = {}
+    for field, keys in COLUMN_KEYS.items():
+        columns[field] = next((positions[k] for k in keys if k in positions), None)
+    return columns
+
+
+def iter_rows(reader, columns):
+    """逐行转换为元组，跳过没有成员名字的行"""
+    name_col = columns['name']
+    if name_col is None:
+        return
+
+    def getter(field, convert):
+        col = columns[field]
+        if col is None:
+            return lambda row: convert(None)
+        return lambda row: convert(row[col]) if col < len(row) else convert(None)
+
+    rank = getter('rank', parse_int)
+    group = getter('group_name', lambda v: v or DEFAULT_GROUP)
+    contribution = getter('contribution', parse_int)
+    power = getter('power', parse_int)
+    battle = getter('battle_achievement', parse_int)
+    assist = getter('assist', parse_int)
+    donation = getter('donation', parse_int)
+
+    for row in reader:
+        name = row[name_col] if name_col < len(row) else None
+        if not name:
+            continue
+        yield (rank(row), name, group(row), contribution(row),
+               power(row), battle(row), assist(row), donation(row))
+
+
+def parse_alliance_csv(stream):
+    """
+    解析二进制文件流（需可 seek），返回 (编码, 表头, 行元组列表)。
+    开头字节判断为 UTF-8 但后面出现非法字节时，按 GB18030 重新解析一次。
+    """
+    encoding, header, _, rows = open_alliance_csv(stream)
+    return encoding, header, list(rows)
+
+
+class CSVRows:
+    """
+    文件流中的成员数据行（编码已确定），每次迭代从流的开头重新解析，
+    不在内存中保留全部行。len() 为有效行数。
+    """
+
+    def __init__(self, stream, start, encoding, count):
+        self.stream = stream
+        self.start = start
+        self.encoding = encoding
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        self.stream.seek(self.start)
+        text = io.TextIOWrapper(self.stream, encoding=self.encoding, newline='')
+        try:
+            reader = csv.reader(text)
+            header = [h.strip() for h in next(reader)]
+            yield from iter_rows(reader, resolve_columns(header))
+        finally:
+            # 不关闭底层的文件流
+            text.detach()
+
+
+def open_alliance_csv(stream):
+    """
+    在二进制文件流（需可 seek）上一遍完成：判断编码、解析表头、数出有效行数并
+    计算内容指纹（与 content_fingerprint 相同）。返回 (编码, 表头, 指纹, CSVRows)。
+    开头字节判断为 UTF-8 但后面出现非法字节时，按 GB18030 重新扫描一次。
+    """
+    start = stream.tell()
+    encoding = detect_encoding(stream.read(PREFIX_SIZE))
+
+    while True:
+        stream.seek(start)
+        text = io.TextIOWrapper(stream, encoding=encoding, newline='')
+        digest = hashlib.sha256()
+        try:
+            reader = csv.reader(_fingerprint_lines(text, digest))
+            header = next(reader, None)
+            if not header:
+                raise CSVFormatError('Empty CSV file')
+            header = [h.strip() for h in header]
+            count = sum(1 for _ in iter_rows(reader, resolve_columns(header)))
+            break
+        except UnicodeDecodeError:
+            if encoding == 'gb18030':
+                raise CSVFormatError('Failed to decode file. Unknown encoding.')
+            encoding = 'gb18030'
+        finally:
+            # 不关闭底层的文件流
+            text.detach()
+
+    # 按 GB18030 重新扫描成功时，解码结果与 content_fingerprint 的容错解码相同
+    content_hash = digest.hexdigest()
+    return encoding, header, content_hash, CSVRows(stream, start, encoding, count)
+
+
+def _chunks(rows, size=INSERT_CHUNK):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_snapshot(rows, filename, stats_time=None, user_id=None, content_hash=None, session=None):
+    """
+    写入一次上传：UploadRecord 一行 + AllianceData 若干行，返回 upload_id。
+    rows 为行元组列表或 CSVRows（会被迭代两遍）。
+    只在当前事务中执行，由调用方 commit / rollback。
+    """
+    session = session or db.session
+    # 成员 id 在独立事务中登记，须在本事务写入之前
+    scope = member_scope(user_id, session)
+    ids = {}
+    for chunk in _chunks(rows):
+        names = [row[1] for row in chunk if row[1] not in ids]
+        ids.update(zip(names, resolve_member_ids(scope, names)))
+
+    result = session.execute(insert(UploadRecord.__table__).values(
+        filename=filename,
+        upload_time=datetime.now(),
+        member_count=len(rows),
+        stats_time=stats_time,
+        content_hash=content_hash,
+        hash_scope=user_id or '',
+        user_id=user_id
+    ))
+    upload_id = result.inserted_primary_key[0]
+
+    mode = storage_mode()
+    if mode in ('rows', 'both'):
+        for chunk in _chunks(rows):
+            session.execute(insert(AllianceData.__table__), [
+                dict(zip(ROW_FIELDS, row), upload_id=upload_id, member_id=ids[row[1]])
+                for row in chunk
+            ])
+    if mode in ('packed', 'both'):
+        # 打包快照本身是整列数组，需要全部行
+        rows = list(rows)
+        write_packed_snapshot(upload_id, rows, session, [ids[row[1]] for row in rows])
+    return upload_id
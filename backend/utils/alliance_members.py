@@ -0,0 +1,174 @@
+"""
+同盟统计中的成员维度表
+
+统计文件里只有成员名字。每个同盟（scope，见 member_scope）内的成员在
+member_profiles 中有一个整数 id，member_aliases 记录该成员用过的所有名字
+（改名后旧名字仍指向同一个 id）。导入时把每行的名字换成 id 写入
+AllianceData.member_id，历史、对比都按 id 查询 / 对齐。
+
+新名字的登记在独立的短事务中提交：同一批上传的多个文件并发导入时，
+先登记的线程提交后其余线程直接查到，不会在上传的事务里互相等待或冲突。
+"""
+import threading
+from datetime import datetime
+import numpy as np
+from sqlalchemy import insert, select, update, bindparam
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import User, Alliance, UploadRecord, AllianceData, AllianceSnapshot, MemberProfile, MemberAlias
+from utils.alliance_snapshot import Snapshot, remap_packed_member, index_packed_members
+
+# 一次 IN 查询的名字数量
+_CHUNK = 500
+
+_register_lock = threading.Lock()
+
+
+class MemberError(Exception):
+    pass
+
+
+def member_scope(user_id, session=None):
+    """
+    成员 id 的范围：上传者所在同盟的 alliance_id；未加入同盟时为上传者
+    openid，匿名上传为空字符串。
+    """
+    if not user_id:
+        return ''
+    session = session or db.session
+    user = session.get(User, user_id)
+    if user and user.alliance_name:
+        alliance = session.query(Alliance).filter_by(
+            alliance_name=user.alliance_name,
+            zone=user.zone,
+            server_info=user.server_info
+        ).first()
+        if alliance:
+            return alliance.alliance_id
+    return user_id
+
+
+def _lookup(conn, table, id_column, scope, names):
+    """{名字: id}，按 scope + name 查询"""
+    found = {}
+    for start in range(0, len(names), _CHUNK):
+        chunk = names[start:start + _CHUNK]
+        rows = conn.execute(
+            select(table.c.name, table.c[id_column]).where(table.c.scope == scope, table.c.name.in_(chunk))
+        )
+        found.update(rows.all())
+    return found
+
+
+def resolve_member_ids(scope, names):
+    """
+    名字列表 -> 成员 id 列表（与 names 一一对应），没见过的名字登记为新成员。
+    须在当前会话写入任何数据之前调用（SQLite 同一时间只允许一个写事务）。
+    """
+    if not names:
+        return []
+    unique = list(dict.fromkeys(names))
+    aliases = MemberAlias.__table__
+    profiles = MemberProfile.__table__
+
+    for attempt in range(3):
+        try:
+            with _register_lock, db.engine.begin() as conn:
+                ids = _lookup(conn, aliases, 'member_id', scope, unique)
+                missing = [name for name in unique if name not in ids]
+                if missing:
+                    now = datetime.now()
+                    conn.execute(insert(profiles), [
+                        {'scope': scope, 'name': name, 'created_at': now} for name in missing
+                    ])
+                    created = _lookup(conn, profiles, 'id', scope, missing)
+                    conn.execute(insert(aliases), [
+                        {'member_id': created[name], 'scope': scope, 'name': name, 'created_at': now}
+                        for name in missing
+                    ])
+                    ids.update(created)
+            return [ids[name] for name in names]
+        except IntegrityError:
+            # 其他进程同时登记了相同的名字，重新查询
+            if attempt == 2:
+                raise
+
+
+def find_member_ids(name, scope=None):
+    """名字（当前名或曾用名）对应的成员 id，scope 为 None 时查所有同盟"""
+    query = db.session.query(MemberAlias.member_id).filter(MemberAlias.name == name)
+    if scope is not None:
+        query = query.filter(MemberAlias.scope == scope)
+    return [member_id for member_id, in query.all()]
+
+
+def member_alias_names(member_ids):
+    rows = db.session.query(MemberAlias.name).filter(MemberAlias.member_id.in_(member_ids)).all()
+    return sorted({name for name, in rows})
+
+
+def rename_member(scope, old_name, new_name):
+    """
+    登记改名：new_name 成为 old_name 所属成员的别名和当前名字。
+    new_name 已经是另一个成员时两者合并（两个成员出现在同一次上传中则拒绝）。
+    只修改当前会话，由调用方 commit。返回成员 id。
+    """
+    old = MemberAlias.query.filter_by(scope=scope, name=old_name).first()
+    if old is None:
+        raise MemberError('Member not found')
+    member = db.session.get(MemberProfile, old.member_id)
+
+    target = MemberAlias.query.filter_by(scope=scope, name=new_name).first()
+    if target is None:
+        db.session.add(MemberAlias(member_id=member.id, scope=scope, name=new_name, created_at=datetime.now()))
+    elif target.member_id != member.id:
+        other_id = target.member_id
+        other = db.aliased(AllianceData)
+        both = db.session.query(AllianceData.upload_id).filter(
+            AllianceData.member_id == member.id,
+            select(other.id).where(other.upload_id == AllianceData.upload_id, other.member_id == other_id).exists()
+        ).first()
+        if both or not remap_packed_member(other_id, member.id):
+            raise MemberError('Both names appear in the same upload')
+        db.session.execute(update(AllianceData).where(AllianceData.member_id == other_id).values(member_id=member.id))
+        db.session.execute(update(MemberAlias).where(MemberAlias.member_id == other_id).values(member_id=member.id))
+        db.session.delete(db.session.get(MemberProfile, other_id))
+
+    member.name = new_name
+    return member.id
+
+
+def backfill_member_ids():
+    """为升级前导入、member_id 为空的明细行和打包快照补上成员 id，返回处理的上传数"""
+    upload_ids = {upload_id for upload_id, in db.session.query(AllianceData.upload_id).filter(
+        AllianceData.member_id.is_(None)).distinct()}
+    packed = {record.upload_id: record for record in AllianceSnapshot.query.all()}
+    upload_ids.update(upload_id for upload_id, record in packed.items() if Snapshot.unpack(record).member_ids is None)
+
+    for upload_id in sorted(upload_ids):
+        upload = db.session.get(UploadRecord, upload_id)
+        scope = member_scope(upload.user_id)
+
+        rows = db.session.execute(
+            select(AllianceData.id, AllianceData.name).where(
+                AllianceData.upload_id == upload_id, AllianceData.member_id.is_(None))
+        ).all()
+        names = [name for _, name in rows]
+        if upload_id in packed:
+            snapshot = Snapshot.unpack(packed[upload_id])
+            names.extend(snapshot.names)
+        ids = dict(zip(names, resolve_member_ids(scope, names)))
+
+        if rows:
+            table = AllianceData.__table__
+            db.session.execute(update(table).where(
+                table.c.id == bindparam('row_id')
+            ).values(member_id=bindparam('mid')), [
+                {'row_id': row_id, 'mid': ids[name]} for row_id, name in rows
+            ])
+        if upload_id in packed and snapshot.member_ids is None:
+            snapshot.member_ids = np.array([ids[name] for name in snapshot.names], dtype=np.int64)
+            packed[upload_id].data = snapshot.pack()[2]
+        db.session.commit()
+    index_packed_members()
+    return len(upload_ids)
@@ -0,0 +1,284 @@
+"""
+同盟统计快照的列式存储
+
+一次上传（约 200 名成员）打包为 alliance_snapshots 中的一行：成员名字典、
+分组名字典，以及每个字段一个定长整数数组（压缩后存为二进制）。读取时直接
+得到 NumPy 数组，对比、历史等计算都是数组运算。成员 id（见 alliance_members）
+作为最后一列存放，早期写入、没有该列的快照读出时 member_ids 为 None。
+
+存储方式由配置 ALLIANCE_STORAGE_MODE 决定:
+    rows     只写 alliance_data 明细行（默认，与旧版相同）
+    packed   只写打包快照
+    both     两者都写，明细行仅用于临时查询
+读取时优先使用打包快照，没有时从明细行构造，两种方式写入的数据都能读。
+"""
+import json
+import zlib
+import numpy as np
+from flask import current_app
+from sqlalchemy import insert, select, update, func
+from extensions import db
+from models import AllianceData, AllianceSnapshot, AllianceSnapshotMember, UploadRecord
+
+# 行元组的字段顺序（AllianceData 的列名）
+ROW_FIELDS = (
+    'rank', 'name', 'group_name', 'contribution',
+    'power', 'battle_achievement', 'assist', 'donation'
+)
+
+# 打包的整数列，按顺序依次存放
+PACKED_COLUMNS = (
+    ('rank', '<i4'),
+    ('group', '<u2'),
+    ('contribution', '<i8'),
+    ('power', '<i8'),
+    ('battle_achievement', '<i8'),
+    ('assist', '<i8'),
+    ('donation', '<i8'),
+    ('member_id', '<i4'),
+)
+
+METRIC_FIELDS = ('rank', 'contribution', 'power', 'battle_achievement', 'assist', 'donation')
+
+# 接口中的指标名 -> 字段
+METRIC_ALIASES = {
+    'battle': 'battle_achievement',
+    'power': 'power',
+    'contribution': 'contribution',
+    'assist': 'assist',
+    'donation': 'donation',
+}
+
+STORAGE_MODES = ('rows', 'packed', 'both')
+
+
+def storage_mode():
+    mode = current_app.config.get('ALLIANCE_STORAGE_MODE', 'rows')
+    return mode if mode in STORAGE_MODES else 'rows'
+
+
+class Snapshot:
+    """一次上传的成员数据：names / group_names 为列表，其余字段为 NumPy 数组"""
+
+    def __init__(self, names, groups, group_codes, metrics, member_ids=None):
+        self.names = names
+        self.groups = groups
+        self.group_codes = group_codes
+        self.metrics = metrics
+        self.member_ids = member_ids
+
+    @classmethod
+    def from_rows(cls, rows, member_ids=None):
+        """rows: 按 ROW_FIELDS 顺序的元组；member_ids 与 rows 对应，有缺失时传 None"""
+        names = [row[1] for row in rows]
+        groups = sorted({row[2] for row in rows})
+        lookup = {g: i for i, g in enumerate(groups)}
+        group_codes = np.array([lookup[row[2]] for row in rows], dtype=np.uint16)
+        metrics = {}
+        for field in METRIC_FIELDS:
+            col = ROW_FIELDS.index(field)
+            metrics[field] = np.array([row[col] or 0 for row in rows], dtype=np.int64)
+        if member_ids is not None:
+            member_ids = np.array(member_ids, dtype=np.int64)
+        return cls(names, groups, group_codes, metrics, member_ids)
+
+    @classmethod
+    def unpack(cls, record):
+        names = json.loads(record.names)
+        groups = json.loads(record.groups)
+        raw = zlib.decompress(record.data)
+        count = len(names)
+        arrays = {}
+        offset = 0
+        for field, dtype in PACKED_COLUMNS:
+            if offset >= len(raw) and count:
+                break
+            arr = np.frombuffer(raw, dtype=dtype, count=count, offset=offset)
+            offset += arr.nbytes
+            arrays[field] = arr
+        group_codes = arrays.pop('group')
+        metrics = {field: arrays[field].astype(np.int64) for field in METRIC_FIELDS}
+        member_ids = arrays['member_id'].astype(np.int64) if 'member_id' in arrays else None
+        return cls(names, groups, group_codes, metrics, member_ids)
+
+    def pack(self):
+        """返回 (names JSON, groups JSON, 压缩后的二进制)"""
+        parts = []
+        for field, dtype in PACKED_COLUMNS:
+            if field == 'group':
+                values = self.group_codes
+            elif field == 'member_id':
+                if self.member_ids is None:
+                    continue
+                values = self.member_ids
+            else:
+                values = self.metrics[field]
+            parts.append(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        return (
+            json.dumps(self.names, ensure_ascii=False),
+            json.dumps(self.groups, ensure_ascii=False),
+            zlib.compress(b''.join(parts))
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def metric(self, name):
+        """按接口指标名取数组，未知指标为全 0（与旧版一致）"""
+        field = METRIC_ALIASES.get(name, name)
+        if field not in self.metrics:
+            return np.zeros(len(self), dtype=np.int64)
+        return self.metrics[field]
+
+    def group_names(self):
+        return [self.groups[c] for c in self.group_codes]
+
+    def name_index(self):
+        """成员名 -> 下标（重名时取最后一个，与按行构造 dict 一致）"""
+        return {name: i for i, name in enumerate(self.names)}
+
+    def find_member(self, member_ids, names=()):
+        """成员 id（任一）所在的下标，没有成员 id 时按名字查找，找不到返回 None"""
+        if self.member_ids is not None:
+            hits = np.flatnonzero(np.isin(self.member_ids, list(member_ids)))
+            return int(hits[-1]) if len(hits) else None
+        index = self.name_index()
+        hits = [index[name] for name in names if name in index]
+        return max(hits) if hits else None
+
+    def to_dicts(self, order=None):
+        groups = self.group_names()
+        order = range(len(self)) if order is None else order
+        return [{
+            'rank': int(self.metrics['rank'][i]),
+            'name': self.names[i],
+            'group_name': groups[i],
+            'contribution': int(self.metrics['contribution'][i]),
+            'power': int(self.metrics['power'][i]),
+            'battle_achievement': int(self.metrics['battle_achievement'][i]),
+            'assist': int(self.metrics['assist'][i]),
+            'donation': int(self.metrics['donation'][i])
+        } for i in order]
+
+
+def match_members(early, late):
+    """
+    late 中每个成员在 early 中的下标，不存在为 -1。两边都有成员 id 时按 id
+    对齐（改名后仍能对上），其余按名字；重复出现时取 early 中最后一个。
+    """
+    positions = np.full(len(late), -1, dtype=np.int64)
+    used = np.zeros(len(early), dtype=bool)
+    if early.member_ids is not None and late.member_ids is not None and len(early):
+        order = np.argsort(early.member_ids, kind='stable')
+        sorted_ids = early.member_ids[order]
+        k = np.searchsorted(sorted_ids, late.member_ids, side='right') - 1
+        found = (k >= 0) & (sorted_ids[np.maximum(k, 0)] == late.member_ids)
+        positions[found] = order[k[found]]
+        used[positions[found]] = True
+
+    missing = np.flatnonzero(positions < 0)
+    if len(missing):
+        # 没有成员 id 的旧数据，或两次上传的 scope 不同（上传者前后加入了同盟）
+        index = {name: i for i, name in enumerate(early.names) if not used[i]}
+        for i in missing:
+            positions[i] = index.get(late.names[i], -1)
+    return positions
+
+
+def write_packed_snapshot(upload_id, rows, session=None, member_ids=None):
+    session = session or db.session
+    names, groups, data = Snapshot.from_rows(rows, member_ids).pack()
+    session.execute(insert(AllianceSnapshot.__table__).values(
+        upload_id=upload_id,
+        member_count=len(rows),
+        names=names,
+        groups=groups,
+        data=data
+    ))
+    if member_ids is not None:
+        _index_members(session, upload_id, member_ids)
+
+
+def _index_members(session, upload_id, member_ids):
+    """登记快照中每个成员 id 的下标"""
+    if len(member_ids):
+        session.execute(insert(AllianceSnapshotMember.__table__), [
+            {'upload_id': upload_id, 'position': i, 'member_id': int(member_id)}
+            for i, member_id in enumerate(member_ids)
+        ])
+
+
+def load_snapshot(upload_id, session=None):
+    """读取一次上传的成员数据，没有任何数据时返回空快照"""
+    session = session or db.session
+    record = session.get(AllianceSnapshot, upload_id)
+    if record is not None:
+        return Snapshot.unpack(record)
+
+    columns = [getattr(AllianceData, field) for field in ROW_FIELDS]
+    rows = session.execute(
+        select(*columns, AllianceData.member_id).where(AllianceData.upload_id == upload_id).order_by(AllianceData.id)
+    ).all()
+    member_ids = [row[-1] for row in rows]
+    if None in member_ids:
+        member_ids = None
+    return Snapshot.from_rows(rows, member_ids)
+
+
+def index_packed_members():
+    """为有成员 id 但尚未登记成员下标的打包快照补登记，返回处理的快照数"""
+    indexed = select(AllianceSnapshotMember.upload_id).where(
+        AllianceSnapshotMember.upload_id == AllianceSnapshot.upload_id).exists()
+    count = 0
+    for packed in AllianceSnapshot.query.filter(~indexed).all():
+        snapshot = Snapshot.unpack(packed)
+        if snapshot.member_ids is not None and len(snapshot):
+            _index_members(db.session, packed.upload_id, snapshot.member_ids)
+            count += 1
+    db.session.commit()
+    return count
+
+
+def packed_member_history(member_ids, exclude_upload_ids=()):
+    """
+    在打包快照中查找成员（member_ids 中任一 id），返回 [(UploadRecord, Snapshot, 下标)]。
+    通过 alliance_snapshot_members 定位，只解包包含该成员的快照。
+    """
+    if not member_ids:
+        return []
+    query = db.session.query(
+        AllianceSnapshotMember.upload_id, func.max(AllianceSnapshotMember.position)
+    ).filter(AllianceSnapshotMember.member_id.in_(list(member_ids)))
+    if exclude_upload_ids:
+        query = query.filter(~AllianceSnapshotMember.upload_id.in_(list(exclude_upload_ids)))
+    positions = dict(query.group_by(AllianceSnapshotMember.upload_id).all())
+    if not positions:
+        return []
+
+    rows = db.session.query(UploadRecord, AllianceSnapshot).join(
+        AllianceSnapshot, AllianceSnapshot.upload_id == UploadRecord.id
+    ).filter(UploadRecord.id.in_(list(positions))).all()
+    return [(record, Snapshot.unpack(packed), positions[record.id]) for record, packed in rows]
+
+
+def remap_packed_member(old_id, new_id):
+    """
+    合并成员时把打包快照中的 old_id 改为 new_id（只修改当前会话）。
+    两个 id 出现在同一个快照中时不做修改，返回 False。
+    """
+    other = db.aliased(AllianceSnapshotMember)
+    both = db.session.query(AllianceSnapshotMember.upload_id).join(
+        other, other.upload_id == AllianceSnapshotMember.upload_id
+    ).filter(AllianceSnapshotMember.member_id == old_id, other.member_id == new_id).first()
+    if both:
+        return False
+
+    upload_ids = select(AllianceSnapshotMember.upload_id).where(
+        AllianceSnapshotMember.member_id == old_id).distinct()
+    for packed in AllianceSnapshot.query.filter(AllianceSnapshot.upload_id.in_(upload_ids)).all():
+        snapshot = Snapshot.unpack(packed)
+        snapshot.member_ids = np.where(snapshot.member_ids == old_id, new_id, snapshot.member_ids)
+        packed.data = snapshot.pack()[2]
+    db.session.execute(update(AllianceSnapshotMember).where(
+        AllianceSnapshotMember.member_id == old_id).values(member_id=new_id))
+    return True
@@ -0,0 +1,369 @@
+"""
+同盟成员多快照趋势分析
+
+一条查询（alliance_data 连接 upload_records）读出选中的全部上传的成员数据，
+按 成员 x 快照 排成矩阵（每个指标一个 float 矩阵，成员不在该快照中为 NaN），
+之后的计算都是整列 / 整行的数组运算:
+    growth        每个成员在区间内首次与最后出现时的数值、增长量、日均增长、增长率
+    daily         按自然日取每天最后一个快照的值（向前填充），相邻两天相减为日增量，
+                  再求 window 天的滑动平均
+    ranks         每个快照中按数值降序的名次，区间首尾名次变化
+    groups        按成员当前分组汇总（成员数、总量、总增长、日增量及其滑动平均）
+
+上传列表（几百行）一条查询，成员数据（含名字和分组）一条查询，逐行的元组直接
+整体转为数组。成员按 member_id 区分（改名后仍是同一行），升级前未补 id 的行按
+名字区分。只以打包快照存储的上传（ALLIANCE_STORAGE_MODE=packed）另外读取后并入。
+"""
+import numpy as np
+from sqlalchemy import select, func, exists
+from extensions import db
+from models import AllianceData, UploadRecord, AllianceSnapshot
+from utils.alliance_snapshot import Snapshot, METRIC_ALIASES
+
+# 一次分析的快照数量上限（一个月的整点快照约 720 个）
+MAX_TREND_SNAPSHOTS = 1000
+DEFAULT_TREND_WINDOW = 7
+
+DEFAULT_GROUP = '未分组'
+
+
+class TrendMatrix:
+    """
+    members: 成员 key（member_id，无 id 时为负数）；names / groups 为成员最后一次
+    出现时的名字和分组；values[指标] 为 (成员数, 快照数) 的 float64 矩阵。
+    """
+
+    def __init__(self, upload_ids, times, members, names, groups, values):
+        self.upload_ids = upload_ids
+        self.times = times
+        self.members = members
+        self.names = names
+        self.groups = groups
+        self.values = values
+
+    @property
+    def shape(self):
+        return len(self.members), len(self.upload_ids)
+
+    @classmethod
+    def from_columns(cls, upload_ids, times, member_keys, names, groups, metrics):
+        """
+        行数据（每列一个数组）-> 矩阵。upload_ids / times 为逐行的上传 id 和快照时间，
+        names / groups 为逐行的名字和分组（object 数组）；同一成员在一个快照中出现
+        多次时取最后一行。
+        """
+        grouped = groups != DEFAULT_GROUP
+        snapshot_ids, first_rows, inverse = np.unique(upload_ids, return_index=True, return_inverse=True)
+        snapshot_times = times[first_rows]
+        order = np.argsort(snapshot_times, kind='stable')
+        snapshot_ids = snapshot_ids[order]
+        snapshot_times = snapshot_times[order]
+        col_of = np.empty(len(order), dtype=np.int64)
+        col_of[order] = np.arange(len(order))
+        cols = col_of[inverse]
+
+        members, rows = np.unique(member_keys, return_inverse=True)
+        shape = (len(members), len(snapshot_ids))
+        flat = rows * shape[1] + cols
+
+        # 同一成员在一个快照中出现多次时只保留最后一行
+        _, last_occurrence = np.unique(flat[::-1], return_index=True)
+        keep = np.sort(len(flat) - 1 - last_occurrence)
+        if len(keep) < len(flat):
+            rows, flat, grouped = rows[keep], flat[keep], grouped[keep]
+            metrics = {metric: column[keep] for metric, column in metrics.items()}
+        else:
+            keep = np.arange(len(flat))
+
+        # 每个成员最后出现的快照中的名字，以及最后一个不是"未分组"的分组
+        last_flat = np.full(len(members), -1, dtype=np.int64)
+        np.maximum.at(last_flat, rows, flat)
+        last_row = np.empty(len(members), dtype=np.int64)
+        is_last = flat == last_flat[rows]
+        last_row[rows[is_last]] = np.flatnonzero(is_last)
+
+        group_flat = np.where(grouped, flat, -1)
+        last_group_flat = np.full(len(members), -1, dtype=np.int64)
+        np.maximum.at(last_group_flat, rows, group_flat)
+        hit = np.flatnonzero(grouped & (flat == last_group_flat[rows]))
+
+        member_names = names[keep[last_row]].tolist()
+        member_groups = [DEFAULT_GROUP] * len(members)
+        for i, group in zip(rows[hit], groups[keep[hit]].tolist()):
+            member_groups[i] = group
+
+        values = {}
+        for metric, column in metrics.items():
+            matrix = np.full(shape, np.nan)
+            matrix.reshape(-1)[flat] = column
+            values[metric] = matrix
+
+        return cls(snapshot_ids, snapshot_times, members, member_names, member_groups, values)
+
+    # 区间内首次 / 最后出现
+    def _presence(self, metric):
+        present = ~np.isnan(self.values[metric])
+        cols = np.arange(self.shape[1])
+        first = np.where(present, cols, self.shape[1]).min(axis=1)
+        last = np.where(present, cols, -1).max(axis=1)
+        return present, first, last
+
+    def growth(self, metric):
+        """{first, last, growth, per_day, pct}，成员数长度的数组"""
+        matrix = self.values[metric]
+        present, first, last = self._presence(metric)
+        rows = np.arange(self.shape[0])
+        seen = last >= 0
+        first_c = np.where(seen, first, 0)
+        last_c = np.where(seen, last, 0)
+
+        first_val = np.where(seen, matrix[rows, first_c], np.nan)
+        last_val = np.where(seen, matrix[rows, last_c], np.nan)
+        growth = last_val - first_val
+        days = (self.times[last_c] - self.times[first_c]) / np.timedelta64(1, 'D')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            per_day = np.where(days > 0, growth / days, np.nan)
+            pct = np.where(first_val > 0, growth / first_val * 100, np.nan)
+        return {'first': first_val, 'last': last_val, 'growth': growth, 'per_day': per_day, 'pct': pct}
+
+    def ranks(self, metric):
+        """每个快照中按数值降序的名次（从 1 开始，不在快照中为 NaN）"""
+        matrix = self.values[metric]
+        filled = np.where(np.isnan(matrix), -np.inf, matrix)
+        order = np.argsort(-filled, axis=0, kind='stable')
+        ranks = np.empty(matrix.shape)
+        np.put_along_axis(ranks, order, np.arange(1, self.shape[0] + 1, dtype=np.float64)[:, None], axis=0)
+        ranks[np.isnan(matrix)] = np.nan
+        return ranks
+
+    def day_columns(self):
+        """(日期列表, 每天最后一个快照的列号)"""
+        days = self.times.astype('datetime64[D]')
+        unique_days, last_idx = np.unique(days[::-1], return_index=True)
+        return unique_days, len(days) - 1 - last_idx
+
+    def daily(self, metric, window=DEFAULT_TREND_WINDOW):
+        """(每天的日增量, window 天滑动平均)，均为 (成员数, 天数)"""
+        matrix = self.values[metric]
+        present, first, last = self._presence(metric)
+        unique_days, day_cols = self.day_columns()
+
+        # 向前填充：每个位置取该成员此前最后一次出现的值
+        cols = np.arange(self.shape[1])
+        idx = np.maximum.accumulate(np.where(present, cols, 0), axis=1)
+        filled = np.take_along_axis(matrix, idx, axis=1)
+        filled[cols[None, :] < first[:, None]] = np.nan
+        end_of_day = filled[:, day_cols]
+        # 最后一次出现之后的日期不再计入（离开同盟的成员）
+        last_day = np.where(last >= 0, np.searchsorted(day_cols, np.maximum(last, 0)), -1)
+        end_of_day[np.arange(len(unique_days))[None, :] > last_day[:, None]] = np.nan
+
+        increments = np.full(end_of_day.shape, np.nan)
+        increments[:, 1:] = end_of_day[:, 1:] - end_of_day[:, :-1]
+        return increments, rolling_mean(increments, window)
+
+
+def rolling_mean(series, window):
+    """沿最后一维的滑动平均（忽略 NaN，窗口内全为 NaN 时为 NaN）"""
+    valid = ~np.isnan(series)
+    values = np.where(valid, series, 0.0)
+    pad = [(0, 0)] * (series.ndim - 1) + [(1, 0)]
+    sums = np.cumsum(np.pad(values, pad), axis=-1)
+    counts = np.cumsum(np.pad(valid.astype(np.int64), pad), axis=-1)
+    n = series.shape[-1]
+    hi = np.arange(1, n + 1)
+    lo = np.maximum(hi - window, 0)
+    window_sums = sums[..., hi] - sums[..., lo]
+    window_counts = counts[..., hi] - counts[..., lo]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(window_counts > 0, window_sums / window_counts, np.nan)
+
+
+def load_trend_matrix(metrics, user_ids, upload_ids=None, since=None, limit=MAX_TREND_SNAPSHOTS):
+    """
+    选出上传（user_ids：上传者 openid 列表，即一个同盟的上传；upload_ids：指定上传；
+    since：快照时间下限），按快照时间取最近的 limit 个，读出成员数据并构造 TrendMatrix。
+    """
+    ts = func.coalesce(UploadRecord.stats_time, UploadRecord.upload_time)
+    has_rows = exists().where(AllianceData.upload_id == UploadRecord.id)
+    uploads = select(UploadRecord.id.label('id'), ts.label('ts'), has_rows.label('has_rows')).where(
+        UploadRecord.user_id.in_(user_ids))
+    if upload_ids is not None:
+        uploads = uploads.where(UploadRecord.id.in_(upload_ids))
+    if since is not None:
+        uploads = uploads.where(ts >= since)
+    uploads = uploads.order_by(ts.desc(), UploadRecord.id.desc()).limit(limit).subquery()
+
+    # 快照时间只按上传读一次（几百行），成员数据的查询不再逐行转换 datetime
+    selected = db.session.execute(select(uploads.c.id, uploads.c.ts, uploads.c.has_rows)).all()
+    if not selected:
+        return None
+    snapshot_times = {upload_id: ts for upload_id, ts, _ in selected}
+    packed_only = [upload_id for upload_id, _, rows in selected if not rows]
+
+    fields = [METRIC_ALIASES[m] for m in metrics]
+    parts = []
+    if len(packed_only) < len(selected):
+        parts.append(_row_columns(uploads, fields))
+    if packed_only:
+        parts.extend(_packed_columns(packed_only, fields))
+    if not parts:
+        return None
+    upload_col, member_col, names, groups, values = (np.concatenate(cols) for cols in zip(*parts))
+    if not len(upload_col):
+        return None
+
+    ids = np.array(list(snapshot_times), dtype=np.int64)
+    id_times = np.array(list(snapshot_times.values()), dtype='datetime64[s]')
+    order = np.argsort(ids)
+    times = id_times[order][np.searchsorted(ids[order], upload_col)]
+    member_keys = _member_keys(member_col, names)
+    metric_values = {metric: values[:, i] for i, metric in enumerate(metrics)}
+    return TrendMatrix.from_columns(upload_col, times, member_keys, names, groups, metric_values)
+
+
+def _row_columns(uploads, fields):
+    """
+    明细行 -> (上传 id, 成员 id（没有为 0）, 名字, 分组, 指标矩阵)。
+    逐行构造 Row 对象和按列拆分元组的开销比查询本身还大，这里直接从 DBAPI 游标
+    取出元组，整体转为 object 数组后按列切片。
+    """
+    table = AllianceData.__table__
+    stmt = select(
+        table.c.upload_id, func.coalesce(table.c.member_id, 0), table.c.name, table.c.group_name,
+        *[func.coalesce(table.c[f], 0) for f in fields]
+    ).join(uploads, uploads.c.id == table.c.upload_id).order_by(table.c.id)
+    result = db.session.connection().execute(stmt)
+    try:
+        rows = result.cursor.fetchall()
+    finally:
+        result.close()
+
+    data = np.empty((len(rows), 4 + len(fields)), dtype=object)
+    if rows:
+        data[:] = rows
+    return (
+        data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2], data[:, 3],
+        data[:, 4:].astype(np.float64)
+    )
+
+
+def _packed_columns(upload_ids, fields):
+    """只有打包快照、没有明细行的上传，解包后与 _row_columns 相同的列"""
+    packed = AllianceSnapshot.query.filter(AllianceSnapshot.upload_id.in_(upload_ids)).all()
+    parts = []
+    for record in packed:
+        snapshot = Snapshot.unpack(record)
+        count = len(snapshot)
+        member_ids = snapshot.member_ids if snapshot.member_ids is not None else np.zeros(count)
+        parts.append((
+            np.full(count, record.upload_id, dtype=np.int64),
+            np.asarray(member_ids, dtype=np.int64),
+            np.array(snapshot.names, dtype=object),
+            np.array(snapshot.group_names(), dtype=object),
+            np.column_stack([snapshot.metrics[f] for f in fields]).astype(np.float64).reshape(count, len(fields))
+        ))
+    return parts
+
+
+def _member_keys(member_ids, names):
+    """成员 key：member_id；没有 member_id（为 0）的行按名字给一个负数 key"""
+    keys = member_ids.copy()
+    by_name = {}
+    for i in np.flatnonzero(keys == 0):
+        keys[i] = -by_name.setdefault(names[i], len(by_name) + 1)
+    return keys
+
+
+def _series(values, digits=2):
+    """数组 -> JSON 列表，NaN 为 None，digits 为 0 时为整数"""
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim > 1:
+        return [_series(row, digits) for row in values]
+    missing = np.isnan(values)
+    if digits == 0:
+        out = np.where(missing, 0, np.round(values)).astype(np.int64).tolist()
+    else:
+        out = np.round(values, digits).tolist()
+    for i in np.flatnonzero(missing):
+        out[i] = None
+    return out
+
+
+def _value(v, digits=2):
+    """单个数值 -> JSON"""
+    return _series([v], digits)[0]
+
+
+def trend_report(matrix, metrics, window=DEFAULT_TREND_WINDOW):
+    """接口返回的数据；members 的顺序与各指标中 members 列表一一对应"""
+    unique_days, _ = matrix.day_columns()
+    group_names = sorted(set(matrix.groups), key=lambda g: (g == DEFAULT_GROUP, g))
+    group_index = {g: i for i, g in enumerate(group_names)}
+    onehot = np.zeros((len(group_names), matrix.shape[0]))
+    onehot[[group_index[g] for g in matrix.groups], np.arange(matrix.shape[0])] = 1
+
+    report = {
+        'snapshots': [{'upload_id': int(u), 'ts': str(t).replace('T', ' ')} for u, t in zip(matrix.upload_ids, matrix.times)],
+        'days': [str(d) for d in unique_days],
+        'window': window,
+        'members': [{
+            'member_id': int(key) if key > 0 else None,
+            'name': name,
+            'group': group
+        } for key, name, group in zip(matrix.members, matrix.names, matrix.groups)],
+        'metrics': {}
+    }
+
+    for metric in metrics:
+        growth = matrix.growth(metric)
+        ranks = matrix.ranks(metric)
+        increments, rolling = matrix.daily(metric, window)
+        rank_first = ranks[:, 0]
+        rank_last = ranks[:, -1]
+        rank_change = rank_first - rank_last
+
+        columns = {
+            'first': _series(growth['first'], 0),
+            'last': _series(growth['last'], 0),
+            'growth': _series(growth['growth'], 0),
+            'per_day': _series(growth['per_day']),
+            'pct': _series(growth['pct']),
+            'rank_first': _series(rank_first, 0),
+            'rank_last': _series(rank_last, 0),
+            'rank_change': _series(rank_change, 0),
+            'daily': _series(increments, 0),
+            'rolling': _series(rolling)
+        }
+        members = [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+        # 分组汇总：one-hot 矩阵乘法，NaN 按 0 计，全组都没有数据的日期为 None
+        has_daily = onehot @ (~np.isnan(increments)) > 0
+        group_daily = np.where(has_daily, onehot @ np.nan_to_num(increments), np.nan)
+        alliance_daily = np.where(has_daily.any(axis=0), np.nansum(increments, axis=0), np.nan)
+        per_day = growth['per_day']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_per_day = (onehot @ np.nan_to_num(per_day)) / (onehot @ ~np.isnan(per_day))
+        groups = []
+        for g, name in enumerate(group_names):
+            groups.append({
+                'group': name,
+                'members': int(onehot[g].sum()),
+                'total_last': _value(onehot[g] @ np.nan_to_num(growth['last']), 0),
+                'total_growth': _value(onehot[g] @ np.nan_to_num(growth['growth']), 0),
+                'mean_per_day': _value(mean_per_day[g]),
+                'daily': _series(group_daily[g], 0),
+                'rolling': _series(rolling_mean(group_daily[g], window))
+            })
+
+        report['metrics'][metric] = {
+            'members': members,
+            'groups': groups,
+            'alliance': {
+                'total_last': _value(np.nansum(growth['last']), 0),
+                'total_growth': _value(np.nansum(growth['growth']), 0),
+                'daily': _series(alliance_daily, 0),
+                'rolling': _series(rolling_mean(alliance_daily, window))
+            }
+        }
+    return report
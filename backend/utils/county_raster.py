@@ -0,0 +1,112 @@
+"""
+所属郡栅格
+
+把整张地图（0-1500 x 0-1500）的每个格子预先归属到一个郡：格子属于按
+hex_distance 距离最近的资源点所在的郡（六边形网格上的 Voronoi 划分）。
+距离相同的多个资源点属于不同郡时，取郡编号最小的一个，结果与数据库返回
+顺序无关。
+
+栅格以 .npy 文件保存在地图缓存目录中，并以 mmap 方式只读打开，
+同一台机器上的多个 worker 共享同一份页缓存。
+"""
+import os
+import hashlib
+import numpy as np
+
+# 地图坐标范围 0-1500
+MAP_SIZE = 1501
+
+# 未归属任何郡
+NO_COUNTY = np.iinfo(np.uint16).max
+
+# Odd-R 偏移坐标下的 6 个相邻格子: (偶数行 dx, 奇数行 dx, dy)
+_NEIGHBORS = (
+    (1, 1, 0),
+    (-1, -1, 0),
+    (-1, 0, -1),
+    (0, 1, -1),
+    (-1, 0, 1),
+    (0, 1, 1),
+)
+
+
+def build_county_raster(xs, ys, county_codes, width=MAP_SIZE, height=MAP_SIZE):
+    """
+    多源广度优先搜索：所有资源点同时作为起点，每一步向外扩展一格，
+    新到达的格子取相邻已归属格子中最小的郡编号。
+    由于六边形距离就是网格上的步数，结果与逐格求最近资源点一致。
+    """
+    labels = np.full(width * height, NO_COUNTY, dtype=np.uint16)
+
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    codes = np.asarray(county_codes, dtype=np.uint16)
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    seeds = ys[inside] * width + xs[inside]
+    np.minimum.at(labels, seeds, codes[inside])
+
+    frontier = np.unique(seeds)
+    while frontier.size:
+        fx = frontier % width
+        fy = frontier // width
+        odd = (fy & 1).astype(bool)
+        frontier_labels = labels[frontier]
+
+        reached = []
+        reached_labels = []
+        for dx_even, dx_odd, dy in _NEIGHBORS:
+            nx = fx + np.where(odd, dx_odd, dx_even)
+            ny = fy + dy
+            valid = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+            idx = ny[valid] * width + nx[valid]
+            lab = frontier_labels[valid]
+            fresh = labels[idx] == NO_COUNTY
+            reached.append(idx[fresh])
+            reached_labels.append(lab[fresh])
+
+        reached = np.concatenate(reached)
+        if not reached.size:
+            break
+        np.minimum.at(labels, reached, np.concatenate(reached_labels))
+        frontier = np.unique(reached)
+
+    return labels.reshape(height, width)
+
+
+def raster_signature(xs, ys, county_codes, counties):
+    h = hashlib.sha1()
+    for arr in (xs, ys, county_codes):
+        h.update(np.ascontiguousarray(arr, dtype=np.int64).tobytes())
+    h.update('\n'.join(counties).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def load_county_raster(cache_dir, season, xs, ys, county_codes, counties):
+    """
+    读取（不存在时先生成）赛季的所属郡栅格，返回只读的 mmap 数组。
+    文件名包含数据签名，地图数据变化后会自动生成新文件并清理旧文件。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    season_key = hashlib.sha1(season.encode('utf-8')).hexdigest()[:12]
+    signature = raster_signature(xs, ys, county_codes, counties)
+    filename = f"county_{season_key}_{signature}.npy"
+    path = os.path.join(cache_dir, filename)
+
+    if not os.path.exists(path):
+        width = max(MAP_SIZE, int(np.max(xs)) + 1)
+        height = max(MAP_SIZE, int(np.max(ys)) + 1)
+        raster = build_county_raster(xs, ys, county_codes, width, height)
+        # 先写临时文件再改名，避免其他 worker 读到写了一半的文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, raster)
+        os.replace(tmp_path, path)
+
+        for name in os.listdir(cache_dir):
+            if name.startswith(f"county_{season_key}_") and name != filename and name.endswith('.npy'):
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except OSError:
+                    pass
+
+    return np.load(path, mmap_mode='r')
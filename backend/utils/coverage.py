@@ -0,0 +1,172 @@
+"""
+同盟铜矿覆盖规划
+
+给定同盟成员的主城坐标和可达半径，计算每个位置能覆盖郡内哪些铜矿，
+再用贪心最大覆盖给出迁城建议。
+
+每个候选位置的覆盖范围是一个位集（Python int，第 i 位对应郡内第 i 个铜矿），
+并集 / 新增数量都是整数位运算。贪心使用惰性求值（lazy greedy）：覆盖
+收益只会随已选位置增加而减少，堆顶重新计算后仍不小于次大值即可直接选中，
+大多数候选不需要重复计算。
+
+候选位置为郡内铜矿所在格子及各成员当前的主城坐标；选中成员自己的主城
+表示该成员不需要迁城。
+"""
+import heapq
+import numpy as np
+from utils.hex_math import hex_distance_matrix
+
+# 迁城规划默认统计的铜矿等级
+DEFAULT_COVERAGE_LEVELS = ('8铜', '9铜', '10铜')
+
+# 一次计算的距离矩阵行数，控制内存占用
+_CHUNK_ROWS = 64
+
+if hasattr(int, 'bit_count'):
+    def _popcount(bits):
+        return bits.bit_count()
+else:
+    def _popcount(bits):
+        return bin(bits).count('1')
+
+
+def default_coverage_levels(index):
+    return [lv for lv in index.levels if lv in DEFAULT_COVERAGE_LEVELS]
+
+
+def coverage_bitsets(site_xs, site_ys, copper_xs, copper_ys, radius):
+    """
+    每个位置 hex_distance <= radius 的铜矿位集列表。
+    copper_ys 须按升序排列：位置按 y 分块后，每块只需与 y 相差不超过
+    radius 的一段铜矿计算距离。
+    """
+    site_xs = np.asarray(site_xs, dtype=np.int64)
+    site_ys = np.asarray(site_ys, dtype=np.int64)
+    bitsets = [0] * len(site_xs)
+    if not len(copper_xs):
+        return bitsets
+
+    order = np.argsort(site_ys, kind='stable')
+    for start in range(0, len(order), _CHUNK_ROWS):
+        rows = order[start:start + _CHUNK_ROWS]
+        lo = int(np.searchsorted(copper_ys, site_ys[rows[0]] - radius, side='left'))
+        hi = int(np.searchsorted(copper_ys, site_ys[rows[-1]] + radius, side='right'))
+        if lo >= hi:
+            continue
+        within = hex_distance_matrix(site_xs[rows], site_ys[rows], copper_xs[lo:hi], copper_ys[lo:hi]) <= radius
+        packed = np.packbits(within, axis=1, bitorder='little')
+        for row, bits in zip(rows, packed):
+            bitsets[row] = int.from_bytes(bits.tobytes(), 'little') << lo
+    return bitsets
+
+
+def greedy_max_coverage(bitsets, k, base=0, eligible=None):
+    """
+    在 bitsets 中最多选 k 个，使 base 与所选位集的并集最大。
+    eligible(i, picked) 返回 False 时跳过该候选（本轮不可选，之后也不再考虑）。
+    返回 [(候选序号, 新增覆盖数)]，按选择顺序；新增为 0 时提前结束。
+    """
+    covered = base
+    heap = [(-_popcount(bits & ~covered), i) for i, bits in enumerate(bitsets)]
+    heapq.heapify(heap)
+    picked = []
+
+    while heap and len(picked) < k:
+        neg_gain, i = heapq.heappop(heap)
+        if eligible is not None and not eligible(i, picked):
+            continue
+        gain = _popcount(bitsets[i] & ~covered)
+        if heap and gain < -heap[0][0]:
+            # 收益已过期，放回堆中等待下次比较
+            heapq.heappush(heap, (-gain, i))
+            continue
+        if gain == 0:
+            break
+        covered |= bitsets[i]
+        picked.append((i, gain))
+
+    return picked, covered
+
+
+def plan_coverage(index, county, members, levels, radius, max_moves):
+    """
+    members: [{'name', 'x', 'y', 'fixed'}]。fixed 的成员不参与迁城，其覆盖作为初始集合。
+    返回覆盖统计与迁城建议。
+    """
+    coppers = index.select(county, levels)
+    # 位集中铜矿按 y 排序（见 coverage_bitsets）
+    coppers = coppers[np.argsort(index.ys[coppers], kind='stable')]
+    copper_xs = index.xs[coppers]
+    copper_ys = index.ys[coppers]
+
+    member_xs = np.array([m['x'] for m in members], dtype=np.int64)
+    member_ys = np.array([m['y'] for m in members], dtype=np.int64)
+    member_bits = coverage_bitsets(member_xs, member_ys, copper_xs, copper_ys, radius)
+
+    current = 0
+    base = 0
+    movable = []
+    for i, m in enumerate(members):
+        current |= member_bits[i]
+        if m.get('fixed'):
+            base |= member_bits[i]
+        else:
+            movable.append(i)
+
+    # 候选：可迁城成员的当前主城（留在原地）+ 郡内每个铜矿格子
+    site_bits = [member_bits[i] for i in movable]
+    site_bits.extend(coverage_bitsets(copper_xs, copper_ys, copper_xs, copper_ys, radius))
+    stay_count = len(movable)
+
+    def eligible(i, picked):
+        # 迁城数量达到上限后只允许"留在原地"
+        if i < stay_count:
+            return True
+        return sum(1 for j, _ in picked if j >= stay_count) < max_moves
+
+    picked, covered = greedy_max_coverage(site_bits, len(movable), base, eligible)
+
+    # 选中自己主城的成员留在原地，其余新位置分配给最近的未分配成员
+    staying = {movable[i] for i, _ in picked if i < stay_count}
+    free = [i for i in movable if i not in staying]
+    moves = []
+    moved = set()
+    for site, gain in picked:
+        if site < stay_count or not free:
+            continue
+        c = site - stay_count
+        to_x, to_y = int(copper_xs[c]), int(copper_ys[c])
+        dists = hex_distance_matrix([to_x], [to_y], member_xs[free], member_ys[free])[0]
+        member = free.pop(int(np.argmin(dists)))
+        moved.add(member)
+        moves.append({
+            'name': members[member].get('name'),
+            'from': {'x': int(member_xs[member]), 'y': int(member_ys[member])},
+            'to': {'x': to_x, 'y': to_y},
+            'distance': int(dists.min()),
+            'gain': gain
+        })
+
+    # 未迁城的成员仍在原地，覆盖计入结果
+    for i in movable:
+        if i not in moved:
+            covered |= member_bits[i]
+
+    # 贪心是近似解，不如现状时维持原布局
+    if _popcount(covered) < _popcount(current):
+        moves = []
+        covered = current
+
+    return {
+        'total': int(len(coppers)),
+        'covered_before': _popcount(current),
+        'covered_after': _popcount(covered),
+        'moves': moves,
+        'members': [{
+            'name': m.get('name'),
+            'x': int(member_xs[i]),
+            'y': int(member_ys[i]),
+            'fixed': bool(m.get('fixed')),
+            'covered': _popcount(member_bits[i])
+        } for i, m in enumerate(members)]
+    }
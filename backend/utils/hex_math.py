@@ -1,4 +1,4 @@
-import math
+import numpy as np
 
 def hex_distance(x1, y1, x2, y2):
     """
@@ -39,29 +39,179 @@ def hex_distance(x1, y1, x2, y2):
     Let's assume "Odd-R" (common).
     """
     # Convert Odd-R offset to cube
-    q1 = x1 - (y1 - (y1 & 1)) / 2
-    r1 = y1
+    q1, r1, _ = offset_to_cube(x1, y1)
+    q2, r2, _ = offset_to_cube(x2, y2)
     
-    q2 = x2 - (y2 - (y2 & 1)) / 2
-    r2 = y2
-    
-    return (abs(q1 - q2) + abs(r1 - r2) + abs(q1 + r1 - q2 - r2)) / 2
+    return (abs(q1 - q2) + abs(r1 - r2) + abs(q1 + r1 - q2 - r2)) // 2
+
+def offset_to_cube(x, y):
+    """
+    Odd-R offset (x, y) -> cube (q, r, s), q + r + s == 0.
+    Works for Python ints and for integer NumPy arrays alike.
+    """
+    q = x - (y - (y & 1)) // 2
+    r = y
+    return q, r, -q - r
+
+def cube_to_offset(q, r):
+    """
+    Cube/axial (q, r) -> Odd-R offset (x, y). Inverse of offset_to_cube.
+    """
+    return q + (r - (r & 1)) // 2, r
+
+# Axial (dq, dr) of the 6 neighbours, in ring-walking order
+CUBE_DIRECTIONS = np.array([(1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1), (0, 1)], dtype=np.int64)
+
+def hex_disk(x, y, radius):
+    """
+    All tiles within `radius` of (x, y), as offset coordinate arrays (xs, ys).
+    Enumerated exactly in cube space: row dr holds 2*radius+1-|dr| tiles,
+    so nothing is generated and then thrown away. 3*R*(R+1)+1 tiles.
+    """
+    if radius < 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    q, r, _ = offset_to_cube(int(x), int(y))
+    drs = np.arange(-radius, radius + 1, dtype=np.int64)
+    lengths = 2 * radius + 1 - np.abs(drs)
+    row_starts = np.maximum(-radius, -radius - drs)
+    # position of each tile inside its row
+    first = np.cumsum(lengths) - lengths
+    within_row = np.arange(lengths.sum(), dtype=np.int64) - np.repeat(first, lengths)
+
+    dr = np.repeat(drs, lengths)
+    dq = np.repeat(row_starts, lengths) + within_row
+    return cube_to_offset(q + dq, r + dr)
+
+def hex_ring(x, y, radius):
+    """
+    Tiles at exactly `radius` from (x, y), as offset coordinate arrays (xs, ys).
+    6*R tiles (1 for R == 0), walked around the ring in order.
+    """
+    if radius < 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    q, r, _ = offset_to_cube(int(x), int(y))
+    if radius == 0:
+        return np.array([x], dtype=np.int64), np.array([y], dtype=np.int64)
+
+    # Start at direction 4 scaled by radius, then walk `radius` steps along each direction
+    corners = CUBE_DIRECTIONS[4] * radius + np.vstack([
+        np.zeros((1, 2), dtype=np.int64),
+        np.cumsum(CUBE_DIRECTIONS[:5] * radius, axis=0)
+    ])
+    steps = np.arange(radius, dtype=np.int64)
+    cells = corners[:, np.newaxis, :] + steps[np.newaxis, :, np.newaxis] * CUBE_DIRECTIONS[:, np.newaxis, :]
+    cells = cells.reshape(-1, 2)
+    return cube_to_offset(q + cells[:, 0], r + cells[:, 1])
+
+def hex_distances(x, y, xs, ys):
+    """
+    Distances from one point (x, y) to arrays of points, as an int64 array.
+    """
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    q, r, _ = offset_to_cube(int(x), int(y))
+    qs, rs, _ = offset_to_cube(xs, ys)
+    dq = qs - q
+    dr = rs - r
+    return (np.abs(dq) + np.abs(dr) + np.abs(dq + dr)) // 2
+
+def hex_distance_matrix(xs1, ys1, xs2, ys2):
+    """
+    Pairwise distances, shape (len(xs1), len(xs2)).
+    """
+    q1, r1, _ = offset_to_cube(np.asarray(xs1, dtype=np.int64), np.asarray(ys1, dtype=np.int64))
+    q2, r2, _ = offset_to_cube(np.asarray(xs2, dtype=np.int64), np.asarray(ys2, dtype=np.int64))
+    dq = q2[np.newaxis, :] - q1[:, np.newaxis]
+    dr = r2[np.newaxis, :] - r1[:, np.newaxis]
+    return (np.abs(dq) + np.abs(dr) + np.abs(dq + dr)) // 2
+
+def top_k(dists, k):
+    """
+    Indices of the k smallest distances, sorted ascending.
+    Equal distances keep their original order (same as a stable sort),
+    but only the k winners are sorted thanks to argpartition.
+    """
+    dists = np.asarray(dists)
+    n = len(dists)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(dists, kind='stable')
+
+    kth = dists[np.argpartition(dists, k - 1)[k - 1]]
+    # Everything strictly closer than the k-th value, plus the first
+    # few ties at the k-th value in original order
+    closer = np.flatnonzero(dists < kth)
+    ties = np.flatnonzero(dists == kth)[:k - len(closer)]
+    picked = np.concatenate([closer, ties])
+    return picked[np.argsort(dists[picked], kind='stable')]
+
+def top_k_rows(dists, k):
+    """
+    Row-wise top_k for a 2D distance matrix: column indices of the k
+    smallest values of every row, ties broken by column order.
+    """
+    dists = np.asarray(dists, dtype=np.int64)
+    rows, cols = dists.shape
+    k = min(k, cols)
+    if k <= 0:
+        return np.zeros((rows, 0), dtype=np.int64)
+
+    # (distance, column) packed into one unique key keeps the order exact
+    keys = dists * cols + np.arange(cols, dtype=np.int64)
+    if k < cols:
+        picked = np.argpartition(keys, k - 1, axis=1)[:, :k]
+    else:
+        picked = np.tile(np.arange(cols, dtype=np.int64), (rows, 1))
+    order = np.argsort(np.take_along_axis(keys, picked, axis=1), axis=1)
+    return np.take_along_axis(picked, order, axis=1)
 
 def get_nearest_points(target_x, target_y, points, limit=10):
     """
     points: list of dict or objects with 'x' and 'y' attributes
     """
-    # Calculate distances
-    with_dist = []
-    for p in points:
-        # Handle both dict and object
-        px = p.get('x') if isinstance(p, dict) else p.x
-        py = p.get('y') if isinstance(p, dict) else p.y
-        
-        dist = hex_distance(target_x, target_y, px, py)
-        with_dist.append((dist, p))
-    
-    # Sort by distance
-    with_dist.sort(key=lambda x: x[0])
-    
-    return with_dist[:limit]
+    if not points:
+        return []
+
+    # Handle both dict and object
+    if isinstance(points[0], dict):
+        xs = [p.get('x') for p in points]
+        ys = [p.get('y') for p in points]
+    else:
+        xs = [p.x for p in points]
+        ys = [p.y for p in points]
+
+    dists = hex_distances(target_x, target_y, xs, ys)
+    return [(int(dists[i]), points[i]) for i in top_k(dists, limit)]
+
+def hex_disk_sum(grid, radius):
+    """
+    Sum of `grid` over the hex disk of `radius` around every cell.
+
+    `grid` is indexed as grid[r, q] in axial coordinates (see offset_to_cube).
+    In axial space a hex disk is a stack of 2*radius+1 horizontal runs, so the
+    convolution is done with row-wise prefix sums (a 1D summed-area table on
+    the sheared axes): cost O(radius * cells), independent of how many
+    non-zero cells there are. Cells outside the grid count as zero.
+    """
+    grid = np.asarray(grid, dtype=np.int64)
+    height, width = grid.shape
+    if radius < 0 or grid.size == 0:
+        return np.zeros_like(grid)
+
+    padded = np.zeros((height + 2 * radius, width + 2 * radius + 1), dtype=np.int64)
+    padded[radius:radius + height, radius + 1:radius + 1 + width] = grid
+    prefix = np.cumsum(padded, axis=1)
+
+    result = np.zeros((height, width), dtype=np.int64)
+    for dr in range(-radius, radius + 1):
+        lo = max(-radius, -radius - dr)
+        hi = min(radius, radius - dr)
+        rows = prefix[radius + dr:radius + dr + height]
+        result += rows[:, radius + hi + 1:radius + hi + 1 + width]
+        result -= rows[:, radius + lo:radius + lo + width]
+    return result
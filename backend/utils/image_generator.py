@@ -76,11 +76,9 @@ class ImageGenerator:
         except:
             return time_str
 
-    def generate_comparison_images(self, results, early_ts, late_ts, metric_label, output_dir, metric_key='battle'):
-        print(f"Starting image generation for {len(results)} items...")
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Prepare data
+    @staticmethod
+    def comparison_groups(results):
+        """要生成的图片：[(分组名, 成员列表)]，全盟在前，未分组不单独生成"""
         # results is list of {name, group, diff, early_val, late_val}
         
         # Group data
@@ -99,6 +97,21 @@ class ImageGenerator:
         for g in sorted_group_names:
             if g != '未分组':
                 render_list.append((g, groups[g]))
+        return render_list
+
+    @staticmethod
+    def comparison_filename(name_prefix, group_name):
+        """固定文件名（缓存的对比结果引用这些图片）"""
+        safe_group = group_name.replace('/', '_').replace('\\', '_')
+        return f"{name_prefix}_{safe_group}.png"
+
+    def generate_comparison_images(self, results, early_ts, late_ts, metric_label, output_dir, metric_key='battle', name_prefix=None, on_image=None):
+        """on_image(图片) 在每张图片写入后调用，供后台渲染任务更新进度"""
+        print(f"Starting image generation for {len(results)} items...")
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # Prepare data
+        render_list = self.comparison_groups(results)
         
         # Load header image
         TARGET_WIDTH = 1170 # iPhone standard width
@@ -314,9 +327,15 @@ class ImageGenerator:
 
             # Save
             safe_group = group_name.replace('/', '_').replace('\\', '_')
-            filename = f"compare_{safe_group}_{datetime.now().strftime('%H%M%S')}.png"
+            if name_prefix:
+                filename = self.comparison_filename(name_prefix, group_name)
+            else:
+                filename = f"compare_{safe_group}_{datetime.now().strftime('%H%M%S')}.png"
             out_path = os.path.join(output_dir, filename)
-            canvas.save(out_path)
+            # 先写临时文件再改名，重新生成时正在下载的客户端不会读到半张图
+            tmp_path = f"{out_path}.{os.getpid()}.tmp"
+            canvas.save(tmp_path, 'PNG')
+            os.replace(tmp_path, out_path)
             
             # Return relative path or full path? 
             # We'll return filename and let the caller handle URL construction
@@ -324,5 +343,7 @@ class ImageGenerator:
                 'group': group_name,
                 'filename': filename
             })
+            if on_image:
+                on_image(saved_paths[-1])
             
         return saved_paths
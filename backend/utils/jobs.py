@@ -0,0 +1,62 @@
+"""
+后台任务
+
+固定大小的线程池 + 内存中的任务状态表。任务函数在应用上下文中执行，
+第一个参数是任务状态 dict，可以在执行过程中更新 progress 等字段，
+供状态查询接口直接返回。只保留最近的若干个任务。
+"""
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class JobRegistry:
+    def __init__(self, name, max_workers=1, keep=200):
+        self.name = name
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, app, fn, *args, **info):
+        """提交任务，返回任务 id。info 中的字段会原样放入任务状态"""
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'pending',
+            'created_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'result': None,
+            'error': None
+        }
+        job.update(info)
+
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.keep:
+                self._jobs.popitem(last=False)
+
+        self._executor.submit(self._run, app, job, fn, args)
+        return job_id
+
+    def _run(self, app, job, fn, args):
+        job['status'] = 'running'
+        try:
+            with app.app_context():
+                job['result'] = fn(job, *args)
+            job['status'] = 'done'
+        except Exception as e:
+            print(f"ERROR: {self.name} job {job['id']} failed: {e}")
+            traceback.print_exc()
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            job['finished_at'] = datetime.now().isoformat()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
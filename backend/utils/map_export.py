@@ -0,0 +1,51 @@
+"""
+赛季地图整包下载
+
+把赛季索引中的全部资源点导出为紧凑的列式数据，供客户端离线查询:
+    json    {"season", "version", "count", "counties", "levels",
+             "x": [...], "y": [...], "county": [...], "level": [...]}
+            county / level 为字符串表中的下标
+    sanmap  与 map_format 相同的二进制格式
+
+两种格式都预先 gzip 压缩，结果缓存在赛季索引上，地图版本变化后随索引一起失效。
+"""
+import gzip
+import json
+import numpy as np
+from utils.map_format import encode_map
+
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'sanmap': 'application/octet-stream',
+}
+
+
+def encode_packed_json(index):
+    payload = {
+        'season': index.season,
+        'version': index.version,
+        'count': len(index),
+        'counties': list(index.counties),
+        'levels': list(index.levels),
+        'x': index.xs.tolist(),
+        'y': index.ys.tolist(),
+        'county': index.county_codes.tolist(),
+        'level': index.level_codes.tolist(),
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encode_sanmap(index):
+    # 索引中的字符串表与 encode_map 一样按名称排序，编号保持一致
+    counties = np.array(index.counties, dtype=str)[index.county_codes]
+    levels = np.array(index.levels, dtype=str)[index.level_codes]
+    return encode_map(index.season, counties, levels, index.xs, index.ys)
+
+
+def export_season_map(index, fmt):
+    """返回 (原始字节, gzip 字节)"""
+    def build():
+        raw = encode_packed_json(index) if fmt == 'json' else encode_sanmap(index)
+        return raw, gzip.compress(raw, compresslevel=9, mtime=0)
+
+    return index.cached(('export', fmt), build)
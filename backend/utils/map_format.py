@@ -0,0 +1,249 @@
+"""
+赛季地图二进制格式 (.sanmap)
+
+把 maps/*.csv 预编译成紧凑的列式文件，运行时直接 mmap，不经过数据库和 ORM。
+
+文件布局（小端）:
+    8 字节   magic  b'SANMAP01'
+    4 字节   header 长度 (uint32)
+    N 字节   header (UTF-8 JSON): 赛季名、点数、源 CSV 的 sha256、
+             字符串表 (counties / levels) 以及各列的 dtype 与偏移
+    若干列   按 8 字节对齐依次存放:
+             x       int16
+             y       int16
+             county  uint16  (counties 中的下标)
+             level   uint8   (levels 中的下标)
+             （列偏移记录在 header 中，相对于数据区起点）
+
+字符串表按名称排序，编号与 SeasonIndex 中的编码一致。点的顺序即 CSV 中的行序。
+"""
+import os
+import io
+import csv
+import json
+import struct
+import hashlib
+import numpy as np
+
+MAGIC = b'SANMAP01'
+FORMAT_VERSION = 1
+EXTENSION = '.sanmap'
+
+COLUMNS = (
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('county', '<u2'),
+    ('level', 'u1'),
+)
+
+# CSV 列名
+COUNTY_KEY = '所属郡'
+LEVEL_KEY = '等级'
+X_KEY = 'X'
+Y_KEY = 'Y'
+
+
+class MapFormatError(Exception):
+    pass
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_map_csv(path):
+    """
+    解析赛季 CSV（表头: 所属郡,等级,X,Y），返回 (counties, levels, xs, ys) 四个列表。
+    无效行会被跳过并打印警告。
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        return parse_map_csv(f, os.path.basename(path))
+
+
+def parse_map_csv(f, source_name='csv'):
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if not header:
+        raise MapFormatError(f'{source_name}: empty file')
+
+    # Handle potential BOM or whitespace in keys
+    header = [h.strip().replace('\ufeff', '') for h in header]
+    try:
+        ci, li, xi, yi = (header.index(k) for k in (COUNTY_KEY, LEVEL_KEY, X_KEY, Y_KEY))
+    except ValueError:
+        raise MapFormatError(f'{source_name}: header must contain {COUNTY_KEY},{LEVEL_KEY},{X_KEY},{Y_KEY}')
+
+    counties, levels, xs, ys = [], [], [], []
+    width = max(ci, li, xi, yi) + 1
+    for row in reader:
+        if not row:
+            continue
+        try:
+            if len(row) < width:
+                raise ValueError('missing columns')
+            x = int(row[xi])
+            y = int(row[yi])
+        except (ValueError, TypeError) as e:
+            print(f"WARNING: Skipping invalid row in {source_name}: {row} - {e}")
+            continue
+        counties.append(row[ci].strip())
+        levels.append(row[li].strip())
+        xs.append(x)
+        ys.append(y)
+    return counties, levels, xs, ys
+
+
+def encode_map(season, counties, levels, xs, ys, source_sha256=None):
+    """把列数据编码为 .sanmap 字节串"""
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    if len(xs) and (xs.min() < -32768 or xs.max() > 32767 or ys.min() < -32768 or ys.max() > 32767):
+        raise MapFormatError(f'{season}: coordinates out of int16 range')
+
+    county_names, county_codes = np.unique(np.array(counties, dtype=str), return_inverse=True)
+    level_names, level_codes = np.unique(np.array(levels, dtype=str), return_inverse=True)
+    if len(county_names) > np.iinfo(np.uint16).max or len(level_names) > np.iinfo(np.uint8).max:
+        raise MapFormatError(f'{season}: too many counties or levels')
+
+    arrays = {
+        'x': xs.astype('<i2'),
+        'y': ys.astype('<i2'),
+        'county': county_codes.astype('<u2'),
+        'level': level_codes.astype('u1'),
+    }
+
+    # 列偏移相对于数据区起点（header 之后按 8 字节对齐）
+    columns = []
+    offset = 0
+    for name, dtype in COLUMNS:
+        columns.append([name, dtype, offset])
+        offset = _align(offset + arrays[name].nbytes)
+
+    header = {
+        'version': FORMAT_VERSION,
+        'season': season,
+        'count': int(len(xs)),
+        'source_sha256': source_sha256,
+        'counties': [str(c) for c in county_names],
+        'levels': [str(lv) for lv in level_names],
+        'columns': columns,
+    }
+    raw_header = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = _align(len(MAGIC) + 4 + len(raw_header))
+
+    out = io.BytesIO()
+    out.write(MAGIC)
+    out.write(struct.pack('<I', len(raw_header)))
+    out.write(raw_header)
+    for name, dtype, col_offset in columns:
+        out.write(b'\0' * (data_start + col_offset - out.tell()))
+        out.write(arrays[name].tobytes())
+    return out.getvalue()
+
+
+def _align(n, to=8):
+    return (n + to - 1) // to * to
+
+
+def compile_map_csv(csv_path, out_path, season=None):
+    """编译一个赛季 CSV，写入 out_path（先写临时文件再原子替换）"""
+    season = season or os.path.splitext(os.path.basename(csv_path))[0]
+    counties, levels, xs, ys = read_map_csv(csv_path)
+    data = encode_map(season, counties, levels, xs, ys, source_sha256=file_sha256(csv_path))
+
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class CompiledMap:
+    """mmap 打开的 .sanmap 文件，各列为只读 numpy 数组"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise MapFormatError(f'{path}: not a sanmap file')
+            (header_len,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+
+        if header.get('version') != FORMAT_VERSION:
+            raise MapFormatError(f"{path}: unsupported version {header.get('version')}")
+
+        self.season = header['season']
+        self.count = header['count']
+        self.source_sha256 = header.get('source_sha256')
+        self.counties = header['counties']
+        self.levels = header['levels']
+
+        data_start = _align(len(MAGIC) + 4 + header_len)
+        self.columns = {}
+        for name, dtype, offset in header['columns']:
+            if self.count:
+                self.columns[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + offset, shape=(self.count,))
+            else:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+
+    @property
+    def xs(self):
+        return self.columns['x']
+
+    @property
+    def ys(self):
+        return self.columns['y']
+
+    @property
+    def county_codes(self):
+        return self.columns['county']
+
+    @property
+    def level_codes(self):
+        return self.columns['level']
+
+
+def compiled_map_path(cache_dir, season):
+    return os.path.join(cache_dir, 'maps', f"{season}{EXTENSION}")
+
+
+def load_compiled_map(cache_dir, maps_dir, season):
+    """
+    取得赛季的编译地图。maps_dir 中有对应 CSV 时，若编译文件不存在或与 CSV
+    内容不一致则重新编译；没有 CSV 时使用已有的编译文件。都没有时返回 None。
+    """
+    path = compiled_map_path(cache_dir, season)
+    csv_path = os.path.join(maps_dir, f"{season}.csv") if maps_dir else None
+
+    if csv_path and os.path.exists(csv_path):
+        if os.path.exists(path):
+            try:
+                compiled = CompiledMap(path)
+                if compiled.source_sha256 == file_sha256(csv_path):
+                    return compiled
+            except MapFormatError:
+                pass
+        compile_map_csv(csv_path, path, season)
+        return CompiledMap(path)
+
+    if os.path.exists(path):
+        return CompiledMap(path)
+    return None
+
+
+def compile_maps_dir(maps_dir, cache_dir):
+    """编译 maps_dir 下所有 CSV，返回编译出的文件路径列表"""
+    outputs = []
+    for filename in sorted(os.listdir(maps_dir)):
+        if filename.endswith('.csv'):
+            season = os.path.splitext(filename)[0]
+            out_path = compiled_map_path(cache_dir, season)
+            compile_map_csv(os.path.join(maps_dir, filename), out_path, season)
+            outputs.append(out_path)
+    return outputs
@@ -0,0 +1,118 @@
+"""
+赛季地图增量导入
+
+每个赛季记录一次导入时 CSV 的内容哈希 (map_versions)。重新部署时哈希不变即
+跳过；CSV 有改动时，与 resource_points 中已有的行逐行比较，只对变化的行
+执行 Core 层的批量 UPDATE / DELETE / INSERT，全部在同一个事务中完成。
+"""
+import os
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import bindparam
+from extensions import db
+from models import ResourcePoint, MapVersion
+from utils.map_format import read_map_csv, file_sha256
+
+# 每条 DELETE ... IN (...) 语句的 id 数量
+DELETE_CHUNK = 500
+
+
+def diff_rows(existing, desired):
+    """
+    existing: [(id, county, level, x, y)]，desired: [(county, level, x, y)]（CSV 行序）
+    按多重集合比较，返回 (updates, deletes, inserts):
+      updates  同一坐标上郡或等级变化的行 [(id, county, level)]
+      deletes  多余的行 id
+      inserts  新增的行 [(county, level, x, y)]
+    """
+    # 完全相同的行保持不动
+    unmatched = defaultdict(list)
+    for row_id, county, level, x, y in existing:
+        unmatched[(county, level, x, y)].append(row_id)
+
+    added = []
+    for row in desired:
+        ids = unmatched.get(row)
+        if ids:
+            ids.pop()
+        else:
+            added.append(row)
+
+    removed_by_coord = defaultdict(list)
+    for (county, level, x, y), ids in unmatched.items():
+        for row_id in ids:
+            removed_by_coord[(x, y)].append(row_id)
+
+    # 同一坐标上先删后增的合并为 UPDATE
+    updates = []
+    inserts = []
+    for county, level, x, y in added:
+        ids = removed_by_coord.get((x, y))
+        if ids:
+            updates.append((ids.pop(), county, level))
+        else:
+            inserts.append((county, level, x, y))
+
+    deletes = sorted(row_id for ids in removed_by_coord.values() for row_id in ids)
+    return updates, deletes, inserts
+
+
+def sync_season_map(season, csv_path):
+    """
+    把一个赛季 CSV 同步到 resource_points，返回统计信息 dict。
+    内容哈希与上次导入一致时不做任何数据库写入。
+    """
+    content_hash = file_sha256(csv_path)
+    version = MapVersion.query.get(season)
+    if version and version.content_hash == content_hash:
+        return {'season': season, 'status': 'unchanged', 'rows': version.row_count}
+
+    counties, levels, xs, ys = read_map_csv(csv_path)
+    desired = list(zip(counties, levels, xs, ys))
+
+    existing = db.session.query(
+        ResourcePoint.id, ResourcePoint.county, ResourcePoint.level,
+        ResourcePoint.x, ResourcePoint.y
+    ).filter(ResourcePoint.season == season).all()
+    existing = [(r[0], r[1] or '', r[2] or '', r[3], r[4]) for r in existing]
+
+    updates, deletes, inserts = diff_rows(existing, desired)
+    table = ResourcePoint.__table__
+
+    try:
+        if updates:
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('_id')).values(
+                    county=bindparam('_county'), level=bindparam('_level')
+                ),
+                [{'_id': row_id, '_county': county, '_level': level} for row_id, county, level in updates]
+            )
+        for i in range(0, len(deletes), DELETE_CHUNK):
+            db.session.execute(table.delete().where(table.c.id.in_(deletes[i:i + DELETE_CHUNK])))
+        if inserts:
+            db.session.execute(
+                table.insert(),
+                [{'season': season, 'county': county, 'level': level, 'x': x, 'y': y}
+                 for county, level, x, y in inserts]
+            )
+
+        if version is None:
+            version = MapVersion(season=season)
+            db.session.add(version)
+        version.filename = os.path.basename(csv_path)
+        version.content_hash = content_hash
+        version.row_count = len(desired)
+        version.loaded_at = datetime.now()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {
+        'season': season,
+        'status': 'updated' if existing else 'loaded',
+        'rows': len(desired),
+        'updated': len(updates),
+        'deleted': len(deletes),
+        'inserted': len(inserts)
+    }
@@ -0,0 +1,94 @@
+"""
+运行时发布赛季地图
+
+管理员上传赛季 CSV 后：校验 -> 写入暂存目录 -> 后台线程中增量同步数据库、
+编译地图、建立空间索引、所属郡栅格和默认迁城密度栅格 -> 原子替换内存中的
+赛季索引 -> 把 CSV 移入 maps 目录。替换前一直使用旧索引提供服务（新赛季在
+替换前查询为无数据），无需重启，也不会有请求在构建期间临时建立索引。
+"""
+import io
+import os
+import shutil
+import tempfile
+from flask import current_app
+from utils.jobs import JobRegistry
+from utils.map_format import parse_map_csv, MapFormatError
+from utils.map_loader import sync_season_map
+from utils.relocation import warm_density_grids, MAP_MAX
+from utils.resource_index import build_season_index, publish_season_index, begin_publish, end_publish
+
+# 同一时间只构建一个赛季
+publish_jobs = JobRegistry('map-publish', max_workers=1)
+
+MAX_SEASON_LENGTH = 64
+
+
+def validate_season_name(season):
+    season = (season or '').strip()
+    if not season or len(season) > MAX_SEASON_LENGTH:
+        raise MapFormatError('赛季名称不能为空且不超过 64 个字符')
+    if season.startswith('.') or any(ch in season for ch in '/\\:*?"<>|'):
+        raise MapFormatError('赛季名称包含非法字符')
+    return season
+
+
+def validate_map_csv(raw):
+    """校验上传的 CSV 内容，返回有效行数"""
+    try:
+        text = raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise MapFormatError('文件需为 UTF-8 编码')
+
+    counties, levels, xs, ys = parse_map_csv(io.StringIO(text, newline=''), 'upload')
+    if not xs:
+        raise MapFormatError('文件中没有有效的资源点')
+    if min(xs) < 0 or max(xs) > MAP_MAX or min(ys) < 0 or max(ys) > MAP_MAX:
+        raise MapFormatError(f'坐标需在 0-{MAP_MAX} 范围内')
+    if not all(counties) or not all(levels):
+        raise MapFormatError('所属郡和等级不能为空')
+    return len(xs)
+
+
+def publish_map(season, raw):
+    """校验并保存赛季 CSV，提交后台构建任务，返回任务 id"""
+    season = validate_season_name(season)
+    row_count = validate_map_csv(raw)
+
+    # 每次发布一个暂存目录（maps/.staging 下），赛季列表不会列出其中的 CSV
+    maps_dir = current_app.config['MAPS_FOLDER']
+    staging_root = os.path.join(maps_dir, '.staging')
+    os.makedirs(staging_root, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=staging_root)
+    with open(os.path.join(staging_dir, f"{season}.csv"), 'wb') as f:
+        f.write(raw)
+
+    begin_publish(season)
+    app = current_app._get_current_object()
+    return publish_jobs.submit(app, _build_and_swap, season, staging_dir, season=season, rows=row_count, stage='queued')
+
+
+def _build_and_swap(job, season, staging_dir):
+    staged_csv = os.path.join(staging_dir, f"{season}.csv")
+    try:
+        # 先同步数据库，新索引中的资源点 id 与数据库一致
+        job['stage'] = 'database'
+        result = sync_season_map(season, staged_csv)
+
+        job['stage'] = 'index'
+        index = build_season_index(season, staging_dir)
+        if index is None:
+            raise MapFormatError(f'{season}: no resource points')
+
+        job['stage'] = 'density'
+        warm_density_grids(index)
+
+        # 新索引已完全就绪，替换后新请求立即使用；之后才把 CSV 移入 maps 目录
+        publish_season_index(season, index)
+        os.replace(staged_csv, os.path.join(current_app.config['MAPS_FOLDER'], f"{season}.csv"))
+        print(f"INFO: Published resource index for {season} ({len(index)} points)")
+    finally:
+        end_publish(season)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    job['stage'] = 'done'
+    return {'points': len(index), 'database': result}
@@ -0,0 +1,120 @@
+"""
+资源密度热力图瓦片
+
+把赛季地图按缩放级别 z 切成 2^z x 2^z 张 256x256 的瓦片，每张瓦片渲染
+指定等级铜矿的分布密度（半透明热力图，可叠加在地图底图上）。密度取自
+与迁城推荐相同的圆盘计数栅格（relocation.DensityGrid）。
+
+瓦片按需渲染并写入磁盘缓存:
+    <TILE_CACHE_FOLDER>/<赛季>/<地图版本>/<等级>/<z>/<x>/<y>.png|webp
+缓存目录位于 static 下，nginx 直接按静态文件返回，文件不存在时才转发到
+后端渲染。地图版本变化后旧版本目录会在首次写入新版本时清理。
+"""
+import os
+import shutil
+import threading
+import numpy as np
+from PIL import Image
+from utils.relocation import DensityGrid, DEFAULT_NEAR_RADIUS
+
+TILE_SIZE = 256
+# 瓦片覆盖的坐标范围取 1536（地图 0-1500 向上取整），z=0 时每像素 6 格
+WORLD_SIZE = 1536
+MAX_ZOOM = 4
+
+TILE_FORMATS = {'png': 'PNG', 'webp': 'WEBP'}
+
+# 所有等级合并为一张热力图
+ALL_LEVELS = 'all'
+
+# 密度半径：每个像素取其所在格子周围该半径内的铜矿数量，与迁城推荐的近距离半径一致
+DENSITY_RADIUS = DEFAULT_NEAR_RADIUS
+
+# 数量映射到色带的尺度，数量为 HEAT_SCALE 时约为色带的 63%
+HEAT_SCALE = 4.0
+
+
+def _heat_palette():
+    """0-255 -> RGBA，透明 -> 蓝 -> 黄 -> 红"""
+    stops = np.array([
+        (0, 0, 0, 255, 0),
+        (1, 0, 128, 255, 90),
+        (128, 255, 230, 0, 180),
+        (255, 230, 20, 20, 230),
+    ], dtype=np.float64)
+    values = np.arange(256)
+    channels = [np.interp(values, stops[:, 0], stops[:, c]) for c in range(1, 5)]
+    return np.stack(channels, axis=1).astype(np.uint8)
+
+
+_PALETTE = _heat_palette()
+
+
+def tile_span(z):
+    return WORLD_SIZE / (1 << z)
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+def level_density(index, level):
+    """某等级（或全部）铜矿在整张地图上的密度栅格，缓存在赛季索引上"""
+    def build():
+        if level == ALL_LEVELS:
+            mask = np.ones(len(index), dtype=bool)
+        else:
+            mask = index.level_codes == index.levels.index(level)
+        grid = DensityGrid(index.xs[mask], index.ys[mask], DENSITY_RADIUS)
+        # 半径 5 内最多 91 格，uint8 足够，整张地图每个等级约 2MB
+        grid.counts = grid.counts.astype(np.uint8)
+        return grid
+
+    return index.cached(('tile_density', level), build)
+
+
+def render_tile(index, level, z, x, y):
+    """渲染一张瓦片，返回 RGBA 的 PIL.Image"""
+    span = tile_span(z)
+    # 一个像素覆盖多个格子时（低缩放级别）取像素内各格子的平均值
+    samples = max(1, int(np.ceil(span / TILE_SIZE)))
+    centers = (np.arange(TILE_SIZE * samples) + 0.5) * span / (TILE_SIZE * samples)
+    map_ys = np.floor(y * span + centers).astype(np.int64)
+    map_xs = np.floor(x * span + centers).astype(np.int64)
+    grid_xs, grid_ys = np.meshgrid(map_xs, map_ys)
+
+    counts = level_density(index, level).lookup(grid_xs.ravel(), grid_ys.ravel())
+    counts = counts.reshape(TILE_SIZE, samples, TILE_SIZE, samples).mean(axis=(1, 3))
+    heat = np.round(255 * (1 - np.exp(-counts / HEAT_SCALE))).astype(np.uint8)
+    return Image.fromarray(_PALETTE[heat], 'RGBA')
+
+
+def tile_path(cache_dir, season, version, level, z, x, y, ext):
+    return os.path.join(cache_dir, season, version, level, str(z), str(x), f"{y}.{ext}")
+
+
+def get_tile(cache_dir, index, level, z, x, y, ext='png'):
+    """取得瓦片文件路径，不存在时渲染并写入缓存"""
+    path = tile_path(cache_dir, index.season, index.version, level, z, x, y, ext)
+    if os.path.exists(path):
+        return path
+
+    version_dir = os.path.join(cache_dir, index.season, index.version)
+    if not os.path.isdir(version_dir):
+        _remove_old_versions(os.path.join(cache_dir, index.season), index.version)
+
+    image = render_tile(index, level, z, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先写临时文件再改名，并发请求同一瓦片时不会读到半个文件
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    image.save(tmp_path, TILE_FORMATS[ext], optimize=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _remove_old_versions(season_dir, version):
+    if not os.path.isdir(season_dir):
+        return
+    for name in os.listdir(season_dir):
+        if name != version:
+            shutil.rmtree(os.path.join(season_dir, name), ignore_errors=True)
@@ -0,0 +1,137 @@
+"""
+迁城推荐热力图
+
+对某个郡内指定等级的铜矿，预先计算"以每个格子为中心、半径 R 内有多少铜矿"
+的密度栅格，即铜矿分布与六边形圆盘核的卷积（见 hex_math.hex_disk_sum）。
+默认参数（默认铜矿等级、近 / 远评分半径）的栅格按郡缓存在赛季索引上，一次
+迁城推荐只需取出候选区域内的得分并排序，耗时与半径大小基本无关。其他等级 /
+半径组合只用搜索区域附近的铜矿临时计算，不写入缓存，以免挤掉预热的栅格。
+"""
+import numpy as np
+from utils.hex_math import offset_to_cube, hex_distances, hex_disk, hex_disk_sum
+
+# 地图坐标范围 0-1500
+MAP_MAX = 1500
+
+# 可配置半径的上限
+MAX_RADIUS = 150
+
+DEFAULT_SEARCH_RADIUS = 20
+DEFAULT_NEAR_RADIUS = 5
+DEFAULT_FAR_RADIUS = 20
+DEFAULT_LIMIT = 40
+MAX_LIMIT = 200
+
+
+class DensityGrid:
+    """一组铜矿在轴向坐标系下的圆盘计数栅格"""
+
+    def __init__(self, xs, ys, radius):
+        self.radius = radius
+        if len(xs) == 0:
+            self.q0 = self.r0 = 0
+            self.counts = np.zeros((0, 0), dtype=np.int32)
+            return
+
+        qs, rs, _ = offset_to_cube(np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64))
+        # 栅格范围：铜矿包围盒向外扩展 radius，范围外的得分必为 0
+        self.q0 = int(qs.min()) - radius
+        self.r0 = int(rs.min()) - radius
+        width = int(qs.max()) + radius - self.q0 + 1
+        height = int(rs.max()) + radius - self.r0 + 1
+
+        occupancy = np.zeros((height, width), dtype=np.int64)
+        np.add.at(occupancy, (rs - self.r0, qs - self.q0), 1)
+        self.counts = hex_disk_sum(occupancy, radius).astype(np.int32)
+
+    def lookup(self, xs, ys):
+        """取出若干格子（偏移坐标）的得分"""
+        qs, rs, _ = offset_to_cube(np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64))
+        rows = rs - self.r0
+        cols = qs - self.q0
+        height, width = self.counts.shape
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        scores = np.zeros(len(rows), dtype=np.int32)
+        scores[inside] = self.counts[rows[inside], cols[inside]]
+        return scores
+
+
+def default_copper_levels(index):
+    # 迁城推荐默认统计 8 铜
+    return [lv for lv in index.levels if '8铜' in lv]
+
+
+def get_density_grid(index, county, levels, radius, around=None):
+    """
+    某郡指定等级铜矿的密度栅格。默认参数的栅格整郡计算并缓存；其他组合不缓存，
+    给出 around=(x, y, 搜索半径) 时只统计可能影响该搜索区域得分的铜矿。
+    """
+    levels = sorted(levels)
+    if levels == sorted(default_copper_levels(index)) and radius in (DEFAULT_NEAR_RADIUS, DEFAULT_FAR_RADIUS):
+        def build():
+            members = index.select(county, levels)
+            return DensityGrid(index.xs[members], index.ys[members], radius)
+
+        return index.cached(('density', county, tuple(levels), radius), build)
+
+    members = index.select(county, levels)
+    xs, ys = index.xs[members], index.ys[members]
+    if around is not None:
+        x, y, reach = around
+        near = hex_distances(x, y, xs, ys) <= reach + radius
+        xs, ys = xs[near], ys[near]
+    return DensityGrid(xs, ys, radius)
+
+
+def warm_density_grids(index):
+    """为每个郡预先生成默认参数下的密度栅格"""
+    levels = default_copper_levels(index)
+    for county in index.counties:
+        for radius in (DEFAULT_NEAR_RADIUS, DEFAULT_FAR_RADIUS):
+            get_density_grid(index, county, levels, radius)
+
+
+def search_area(x, y, radius):
+    """
+    距 (x, y) 不超过 radius 且在地图范围内的所有格子。
+    按 x 优先排序（与旧版逐格扫描的顺序一致，同分时结果不变）。
+    """
+    xs, ys = hex_disk(x, y, radius)
+    in_map = (xs >= 0) & (xs <= MAP_MAX) & (ys >= 0) & (ys <= MAP_MAX)
+    xs = xs[in_map]
+    ys = ys[in_map]
+    order = np.lexsort((ys, xs))
+    xs = xs[order]
+    ys = ys[order]
+    return xs, ys, hex_distances(x, y, xs, ys)
+
+
+def recommend_locations(index, county, x, y, levels,
+                        search_radius=DEFAULT_SEARCH_RADIUS,
+                        near_radius=DEFAULT_NEAR_RADIUS,
+                        far_radius=DEFAULT_FAR_RADIUS,
+                        limit=DEFAULT_LIMIT):
+    """
+    在 (x, y) 周围 search_radius 内寻找迁城点：
+    优先 near_radius 内铜矿最多，其次 far_radius 内铜矿最多。
+    """
+    cand_xs, cand_ys, dist_to_start = search_area(x, y, search_radius)
+    around = (x, y, search_radius)
+    score_near = get_density_grid(index, county, levels, near_radius, around).lookup(cand_xs, cand_ys)
+    score_far = get_density_grid(index, county, levels, far_radius, around).lookup(cand_xs, cand_ys)
+
+    # Only keep interesting points
+    keep = np.flatnonzero(score_far > 0)
+    # Primary near desc, secondary far desc (lexsort is stable)
+    order = keep[np.lexsort((-score_far[keep], -score_near[keep]))][:limit]
+
+    return [{
+        'x': int(cand_xs[i]),
+        'y': int(cand_ys[i]),
+        'score_near': int(score_near[i]),
+        'score_far': int(score_far[i]),
+        # 兼容旧版小程序的字段名
+        'score5': int(score_near[i]),
+        'score20': int(score_far[i]),
+        'distance': int(dist_to_start[i])
+    } for i in order]
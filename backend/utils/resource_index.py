@@ -0,0 +1,557 @@
+"""
+资源点内存空间索引
+
+每个赛季的资源点在启动时加载一次（优先 mmap 编译好的 .sanmap 地图文件，
+否则从 resource_points 表读取），之后所属郡判定和最近资源点查询都直接在
+内存中完成，不再访问数据库。所属郡判定优先使用预先生成的所属郡栅格
+（见 county_raster），一次数组读取即可得到结果。
+
+坐标系与 hex_math.hex_distance 一致（Odd-R 偏移坐标）。索引使用均匀的
+六边形分桶网格：按偏移坐标把点划入 B x B 的桶，查询时从目标所在的桶开始
+逐圈向外扩展，直到剩余的桶不可能包含更近的点为止。
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict, deque
+import numpy as np
+from flask import current_app
+from extensions import db
+from models import ResourcePoint
+from utils.county_raster import load_county_raster, NO_COUNTY
+from utils.hex_math import hex_distances
+from utils.relocation import warm_density_grids
+from utils.map_format import load_compiled_map
+
+
+def _ring_lower_bound(gap):
+    """
+    偏移坐标中 |dx| >= gap 或 |dy| >= gap 的任意两点，其六边形距离的下界。
+    由 dist >= max(|dy|, |dx| - (|dy| + 1) / 2) 推得。
+    """
+    if gap <= 0:
+        return 0
+    return (2 * gap - 1) // 3
+
+
+class _HexGrid:
+    """一组点上的分桶网格，points 的顺序即同距离时的先后顺序。"""
+
+    def __init__(self, xs, ys, indices):
+        self.indices = indices
+        n = len(indices)
+        if n == 0:
+            self.size = 1
+            self.origin = (0, 0)
+            self.shape = (1, 1)
+            self.starts = np.zeros(2, dtype=np.int64)
+            self.order = np.zeros(0, dtype=np.int64)
+            self.xs = self.ys = np.zeros(0, dtype=np.int64)
+            return
+
+        min_x, max_x = int(xs.min()), int(xs.max())
+        min_y, max_y = int(ys.min()), int(ys.max())
+        area = (max_x - min_x + 1) * (max_y - min_y + 1)
+        # 平均每个桶约 4 个点
+        size = int(round(np.sqrt(area * 4.0 / n)))
+        self.size = max(8, min(256, size))
+        self.origin = (min_x, min_y)
+        nbx = (max_x - min_x) // self.size + 1
+        nby = (max_y - min_y) // self.size + 1
+        self.shape = (nbx, nby)
+
+        bucket = ((ys - min_y) // self.size) * nbx + (xs - min_x) // self.size
+        # 稳定排序，保证同一个桶内仍按原顺序排列
+        self.order = np.argsort(bucket, kind='stable')
+        counts = np.bincount(bucket, minlength=nbx * nby)
+        self.starts = np.zeros(nbx * nby + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.starts[1:])
+
+        self.xs = xs[self.order]
+        self.ys = ys[self.order]
+
+    def _bucket_of(self, x, y):
+        nbx, nby = self.shape
+        bx = (x - self.origin[0]) // self.size
+        by = (y - self.origin[1]) // self.size
+        return min(max(bx, 0), nbx - 1), min(max(by, 0), nby - 1)
+
+    def _ring_slots(self, bx, by, ring):
+        """第 ring 圈（切比雪夫距离）上的桶在 order 中的区间"""
+        nbx, nby = self.shape
+        slots = []
+        if ring == 0:
+            b = by * nbx + bx
+            slots.append((self.starts[b], self.starts[b + 1]))
+            return slots
+
+        x0, x1 = max(bx - ring, 0), min(bx + ring, nbx - 1)
+        # 上下两行：同一行内相邻的桶在 order 中是连续的
+        for row in (by - ring, by + ring):
+            if 0 <= row < nby:
+                slots.append((self.starts[row * nbx + x0], self.starts[row * nbx + x1 + 1]))
+        # 左右两列
+        for col in (bx - ring, bx + ring):
+            if 0 <= col < nbx:
+                for row in range(max(by - ring + 1, 0), min(by + ring, nby)):
+                    b = row * nbx + col
+                    slots.append((self.starts[b], self.starts[b + 1]))
+        return slots
+
+    def within(self, x, y, radius):
+        """距离不超过 radius 的所有点，返回 (距离数组, 点序号数组)，排序规则同 nearest"""
+        if len(self.indices) == 0 or radius < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        bx, by = self._bucket_of(x, y)
+        picked = []
+        for ring in range(self._max_ring(bx, by) + 1):
+            # 本圈的点与目标在 x 或 y 上至少相差 (ring - 1) * size + 1
+            if ring > 0 and _ring_lower_bound((ring - 1) * self.size + 1) > radius:
+                break
+            for start, end in self._ring_slots(bx, by, ring):
+                if end > start:
+                    picked.append(np.arange(start, end))
+
+        pos = np.concatenate(picked) if picked else np.zeros(0, dtype=np.int64)
+        dists = hex_distances(x, y, self.xs[pos], self.ys[pos])
+        hit = dists <= radius
+        dists = dists[hit]
+        original = self.order[pos[hit]]
+        sel = np.lexsort((original, dists))
+        return dists[sel], self.indices[original[sel]]
+
+    def _max_ring(self, bx, by):
+        nbx, nby = self.shape
+        return max(bx, nbx - 1 - bx, by, nby - 1 - by)
+
+    def nearest(self, x, y, limit):
+        """返回 (距离数组, 点序号数组)，按距离升序，同距离按原顺序"""
+        n = len(self.indices)
+        if n == 0 or limit <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        limit = min(limit, n)
+        bx, by = self._bucket_of(x, y)
+        max_ring = self._max_ring(bx, by)
+
+        picked = []
+        found = 0
+        ring = 0
+        while True:
+            for start, end in self._ring_slots(bx, by, ring):
+                if end > start:
+                    picked.append(np.arange(start, end))
+                    found += end - start
+            if ring >= max_ring:
+                break
+            if found >= limit:
+                pos = np.concatenate(picked)
+                dists = hex_distances(x, y, self.xs[pos], self.ys[pos])
+                kth = np.partition(dists, limit - 1)[limit - 1]
+                # 下一圈的点与目标在 x 或 y 上至少相差 ring * size + 1
+                if kth < _ring_lower_bound(ring * self.size + 1):
+                    break
+            ring += 1
+
+        pos = np.concatenate(picked) if picked else np.zeros(0, dtype=np.int64)
+        dists = hex_distances(x, y, self.xs[pos], self.ys[pos])
+        # 距离相同时按原始顺序（即数据库 id 顺序）排列
+        original = self.order[pos]
+        sel = np.lexsort((original, dists))[:limit]
+        return dists[sel], self.indices[original[sel]]
+
+
+# 每个赛季索引上最多缓存的派生数据（密度栅格等）数量
+DERIVED_CACHE_SIZE = 128
+
+
+class SeasonIndex:
+    """单个赛季的资源点索引"""
+
+    def __init__(self, season, ids, xs, ys, county_codes, counties, level_codes, levels):
+        """
+        郡与等级以整数编码保存，counties / levels 为按名称排序的字符串表。
+        ids 的顺序即同距离时的先后顺序。
+        """
+        self.season = season
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.xs = np.asarray(xs, dtype=np.int64)
+        self.ys = np.asarray(ys, dtype=np.int64)
+        self.counties = list(counties)
+        self.levels = list(levels)
+        self.county_codes = np.asarray(county_codes, dtype=np.int32)
+        self.level_codes = np.asarray(level_codes, dtype=np.int32)
+        self._county_lookup = {c: i for i, c in enumerate(self.counties)}
+        self._level_lookup = {lv: i for i, lv in enumerate(self.levels)}
+        # 数据版本：地图内容不变时保持不变，供缓存键、ETag 使用
+        self.version = self._signature()
+
+        self._all = _HexGrid(self.xs, self.ys, np.arange(len(self.ids)))
+        # 所属郡栅格 (height x width)，未加载时退回最近点查询
+        self.county_raster = None
+        self._groups = {}
+        self._groups_lock = threading.Lock()
+        self._derived = OrderedDict()
+        self._derived_lock = threading.Lock()
+
+    @classmethod
+    def from_strings(cls, season, ids, xs, ys, counties, levels):
+        # 郡与等级编码为整数，字符串只保存一份
+        county_names, county_codes = np.unique(np.array(counties, dtype=str), return_inverse=True)
+        level_names, level_codes = np.unique(np.array(levels, dtype=str), return_inverse=True)
+        return cls(
+            season, ids, xs, ys,
+            county_codes, [str(c) for c in county_names],
+            level_codes, [str(lv) for lv in level_names]
+        )
+
+    @classmethod
+    def from_compiled(cls, compiled, ids):
+        # 编译地图中没有数据库 id，ids 为各点对应的 resource_points.id（见 _compiled_point_ids）
+        return cls(
+            compiled.season, ids,
+            compiled.xs, compiled.ys,
+            compiled.county_codes, compiled.counties,
+            compiled.level_codes, compiled.levels
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _signature(self):
+        h = hashlib.sha1(self.season.encode('utf-8'))
+        for arr in (self.xs, self.ys, self.county_codes, self.level_codes):
+            h.update(np.ascontiguousarray(arr, dtype=np.int64).tobytes())
+        h.update('\n'.join(self.counties).encode('utf-8'))
+        h.update('\n'.join(self.levels).encode('utf-8'))
+        return h.hexdigest()[:16]
+
+    def catalog(self):
+        """赛季概览：各郡、各等级的资源点数量及坐标范围"""
+        return self.cached('catalog', self._build_catalog)
+
+    def _build_catalog(self):
+        n_counties, n_levels = len(self.counties), len(self.levels)
+        counts = np.bincount(
+            self.county_codes * n_levels + self.level_codes, minlength=n_counties * n_levels
+        ).reshape(n_counties, n_levels)
+
+        min_x = np.full(n_counties, np.iinfo(np.int64).max)
+        max_x = np.full(n_counties, np.iinfo(np.int64).min)
+        min_y = min_x.copy()
+        max_y = max_x.copy()
+        np.minimum.at(min_x, self.county_codes, self.xs)
+        np.maximum.at(max_x, self.county_codes, self.xs)
+        np.minimum.at(min_y, self.county_codes, self.ys)
+        np.maximum.at(max_y, self.county_codes, self.ys)
+
+        def bbox(x0, x1, y0, y1):
+            return {'min_x': int(x0), 'max_x': int(x1), 'min_y': int(y0), 'max_y': int(y1)}
+
+        counties = []
+        for i, name in enumerate(self.counties):
+            counties.append({
+                'name': name,
+                'total': int(counts[i].sum()),
+                'levels': {lv: int(counts[i, j]) for j, lv in enumerate(self.levels) if counts[i, j]},
+                'bbox': bbox(min_x[i], max_x[i], min_y[i], max_y[i])
+            })
+
+        return {
+            'season': self.season,
+            'version': self.version,
+            'total': len(self),
+            'levels': {lv: int(counts[:, j].sum()) for j, lv in enumerate(self.levels)},
+            'bbox': bbox(self.xs.min(), self.xs.max(), self.ys.min(), self.ys.max()),
+            'counties': counties
+        }
+
+    def _group(self, county_code, level_code):
+        key = (county_code, level_code)
+        grid = self._groups.get(key)
+        if grid is None:
+            with self._groups_lock:
+                grid = self._groups.get(key)
+                if grid is None:
+                    members = np.flatnonzero((self.county_codes == county_code) & (self.level_codes == level_code))
+                    grid = _HexGrid(self.xs[members], self.ys[members], members)
+                    self._groups[key] = grid
+        return grid
+
+    def cached(self, key, build):
+        """
+        基于本索引数据计算出的派生结果（如密度栅格）的 LRU 缓存。
+        索引被替换或重建后，旧的派生数据随之失效。
+        """
+        with self._derived_lock:
+            value = self._derived.get(key)
+            if value is not None:
+                self._derived.move_to_end(key)
+                return value
+
+        value = build()
+        with self._derived_lock:
+            self._derived[key] = value
+            self._derived.move_to_end(key)
+            while len(self._derived) > DERIVED_CACHE_SIZE:
+                self._derived.popitem(last=False)
+        return value
+
+    def attach_county_raster(self, cache_dir):
+        self.county_raster = load_county_raster(
+            cache_dir, self.season, self.xs, self.ys, self.county_codes, self.counties
+        )
+
+    def county_at(self, x, y):
+        """以距离最近的资源点（任意等级）所属郡作为坐标所属郡"""
+        raster = self.county_raster
+        if raster is not None and 0 <= y < raster.shape[0] and 0 <= x < raster.shape[1]:
+            code = raster[y, x]
+            return None if code == NO_COUNTY else self.counties[code]
+
+        _, idx = self._all.nearest(x, y, 1)
+        if len(idx) == 0:
+            return None
+        return self.counties[self.county_codes[idx[0]]]
+
+    def nearest(self, x, y, county, level, limit=10):
+        """同郡同等级的最近资源点，返回 (距离数组, 点序号数组)"""
+        county_code = self._county_lookup.get(county)
+        level_code = self._level_lookup.get(level)
+        if county_code is None or level_code is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return self._group(county_code, level_code).nearest(x, y, limit)
+
+    def within(self, x, y, radius, levels=None):
+        """(x, y) 周围 radius 内的资源点（不限郡），可按等级过滤"""
+        dists, idx = self._all.within(x, y, radius)
+        if levels is not None:
+            level_codes = [self._level_lookup[lv] for lv in levels if lv in self._level_lookup]
+            keep = np.isin(self.level_codes[idx], level_codes)
+            dists, idx = dists[keep], idx[keep]
+        return dists, idx
+
+    def select(self, county, levels):
+        """某郡指定等级的全部点序号（按 id 顺序）"""
+        county_code = self._county_lookup.get(county)
+        if county_code is None:
+            return np.zeros(0, dtype=np.int64)
+        level_codes = [self._level_lookup[lv] for lv in levels if lv in self._level_lookup]
+        mask = (self.county_codes == county_code) & np.isin(self.level_codes, level_codes)
+        return np.flatnonzero(mask)
+
+    def point_dict(self, i, distance=None):
+        point_id = int(self.ids[i])
+        item = {
+            # 数据库中还没有的点（尚未同步）为 None
+            'id': point_id or None,
+            'county': self.counties[self.county_codes[i]],
+            'level': self.levels[self.level_codes[i]],
+            'x': int(self.xs[i]),
+            'y': int(self.ys[i])
+        }
+        if distance is not None:
+            item['distance'] = int(distance)
+        return item
+
+
+# 赛季 -> SeasonIndex
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# 正在后台发布、还没有索引的赛季：请求中不临时建立索引（见 begin_publish）
+_publishing = set()
+
+# 全部赛季的资源目录，索引有变化时失效（_generation 递增）
+_catalog = None
+_generation = 0
+
+
+def _indexes_changed():
+    # 调用方需持有 _indexes_lock
+    global _catalog, _generation
+    _catalog = None
+    _generation += 1
+
+
+def _load_from_db(season):
+    # 只取列，不构造 ORM 对象
+    rows = db.session.query(
+        ResourcePoint.id, ResourcePoint.x, ResourcePoint.y,
+        ResourcePoint.county, ResourcePoint.level
+    ).filter(
+        ResourcePoint.season == season
+    ).order_by(ResourcePoint.id).all()
+
+    rows = [r for r in rows if r[1] is not None and r[2] is not None]
+    if not rows:
+        return None
+
+    ids, xs, ys, counties, levels = zip(*rows)
+    counties = [c or '' for c in counties]
+    levels = [lv or '' for lv in levels]
+    return SeasonIndex.from_strings(season, ids, xs, ys, counties, levels)
+
+
+def _compiled_point_ids(season, compiled):
+    """
+    编译地图各点对应的 resource_points.id：按 (郡, 等级, X, Y) 匹配，同一位置有多行时
+    按 id 顺序依次对应。数据库中没有的点为 0。只读 id 与坐标列，不构造 ORM 对象。
+    """
+    ids = np.zeros(compiled.count, dtype=np.int64)
+    try:
+        rows = db.session.query(
+            ResourcePoint.id, ResourcePoint.county, ResourcePoint.level,
+            ResourcePoint.x, ResourcePoint.y
+        ).filter(ResourcePoint.season == season).order_by(ResourcePoint.id).all()
+    except Exception as e:
+        db.session.rollback()
+        print(f"WARNING: Failed to load resource point ids for {season}: {e}")
+        return ids
+
+    by_key = defaultdict(deque)
+    for row_id, county, level, x, y in rows:
+        by_key[(county or '', level or '', x, y)].append(row_id)
+    if not by_key:
+        return ids
+
+    counties = [compiled.counties[c] for c in compiled.county_codes.tolist()]
+    levels = [compiled.levels[c] for c in compiled.level_codes.tolist()]
+    for i, key in enumerate(zip(counties, levels, compiled.xs.tolist(), compiled.ys.tolist())):
+        matches = by_key.get(key)
+        if matches:
+            ids[i] = matches.popleft()
+    return ids
+
+
+def build_season_index(season, maps_dir=None):
+    """
+    建立一个赛季的索引，没有数据时返回 None。
+    优先 mmap 读取编译好的地图文件 (.sanmap，见 map_format)，
+    没有对应地图文件时再从数据库加载。maps_dir 默认为 MAPS_FOLDER，
+    发布地图时为暂存目录。
+    """
+    cache_dir = current_app.config.get('MAP_CACHE_FOLDER')
+    maps_dir = maps_dir or current_app.config.get('MAPS_FOLDER')
+
+    index = None
+    if cache_dir:
+        try:
+            compiled = load_compiled_map(cache_dir, maps_dir, season)
+            if compiled is not None and compiled.count:
+                index = SeasonIndex.from_compiled(compiled, _compiled_point_ids(season, compiled))
+        except Exception as e:
+            print(f"WARNING: Failed to load compiled map for {season}: {e}")
+
+    if index is None:
+        index = _load_from_db(season)
+    if index is None:
+        return None
+
+    if cache_dir:
+        try:
+            index.attach_county_raster(cache_dir)
+        except Exception as e:
+            print(f"WARNING: Failed to build county raster for {season}: {e}")
+    return index
+
+
+def available_seasons():
+    """地图目录中的赛季与数据库中已有的赛季"""
+    seasons = set()
+    maps_dir = current_app.config.get('MAPS_FOLDER')
+    if maps_dir and os.path.isdir(maps_dir):
+        seasons.update(os.path.splitext(f)[0] for f in os.listdir(maps_dir) if f.endswith('.csv'))
+    try:
+        seasons.update(s[0] for s in db.session.query(ResourcePoint.season).distinct().all() if s[0])
+    except Exception as e:
+        db.session.rollback()
+        print(f"WARNING: Failed to list seasons from database: {e}")
+    return sorted(seasons)
+
+
+def get_season_index(season):
+    index = _indexes.get(season)
+    if index is not None:
+        return index
+
+    with _indexes_lock:
+        index = _indexes.get(season)
+        if index is None and season not in _publishing:
+            index = build_season_index(season)
+            if index is not None:
+                _indexes[season] = index
+                _indexes_changed()
+                print(f"INFO: Built resource index for {season} ({len(index)} points)")
+    return index
+
+
+def begin_publish(season):
+    """
+    标记赛季正在发布：新赛季在发布完成前查询返回无数据，不会在请求线程中
+    持锁临时建立索引（已有的赛季继续使用旧索引）。
+    """
+    with _indexes_lock:
+        _publishing.add(season)
+
+
+def end_publish(season):
+    with _indexes_lock:
+        _publishing.discard(season)
+
+
+def publish_season_index(season, index):
+    """原子替换赛季索引：已在处理中的请求继续使用旧索引"""
+    with _indexes_lock:
+        _indexes[season] = index
+        _publishing.discard(season)
+        _indexes_changed()
+
+
+def warm_season_indexes():
+    """启动时为所有赛季建立索引、默认的迁城密度栅格及资源目录"""
+    for season in available_seasons():
+        index = get_season_index(season)
+        if index is not None:
+            warm_density_grids(index)
+    get_catalog()
+
+
+def reset_season_indexes():
+    with _indexes_lock:
+        _indexes.clear()
+        _indexes_changed()
+
+
+def get_catalog():
+    """
+    所有赛季的资源目录（内存缓存）。只在地图变化后的第一次调用时列出赛季，
+    之后直接返回缓存，不访问数据库。
+    """
+    global _catalog
+    catalog = _catalog
+    if catalog is not None:
+        return catalog
+
+    generation = _generation
+    entries = []
+    for season in available_seasons():
+        index = get_season_index(season)
+        if index is not None:
+            entries.append(index.catalog())
+
+    h = hashlib.sha1()
+    for entry in entries:
+        h.update(f"{entry['season']}:{entry['version']}\n".encode('utf-8'))
+    catalog = {
+        'version': h.hexdigest()[:16],
+        'seasons': entries,
+        'by_season': {entry['season']: entry for entry in entries}
+    }
+
+    with _indexes_lock:
+        # 构建期间索引又发生变化时不缓存，下次重新生成
+        if generation == _generation:
+            _catalog = catalog
+    return catalog
@@ -372,7 +372,7 @@ Page({
     wx.chooseMessageFile({
       count: 9, // 支持多选，最多9个
       type: 'file',
-      extension: ['csv'],
+      extension: ['csv', 'zip'], // zip 为一天的统计文件打包，后台批量导入
       success: (res) => {
         const tempFiles = res.tempFiles;
         if (tempFiles.length > 0) {
@@ -407,6 +407,18 @@ Page({
       const file = files[index];
       wx.showLoading({ title: `上传中 ${index + 1}/${total}...` });
 
+      // zip 压缩包走批量接口，后台导入后轮询结果
+      if (/\.zip$/i.test(file.name)) {
+        this.uploadBatch(file, (result) => {
+          successCount += result.done || 0;
+          skipCount += result.skipped || 0;
+          failCount += result.failed || 0;
+          completedCount++;
+          uploadNext(index + 1);
+        });
+        return;
+      }
+
       wx.uploadFile({
         url: `${app.globalData.apiBaseUrl}/api/alliance/upload`,
         filePath: file.path,
@@ -448,6 +460,57 @@ Page({
     uploadNext(0);
   },
 
+  uploadBatch(file, callback) {
+    wx.uploadFile({
+      url: `${app.globalData.apiBaseUrl}/api/alliance/upload/batch`,
+      filePath: file.path,
+      name: 'file',
+      formData: {
+        'filename': file.name,
+        'openid': wx.getStorageSync('openid')
+      },
+      success: (res) => {
+        let data = {};
+        try {
+          data = JSON.parse(res.data);
+        } catch (e) {
+          console.error(`File ${file.name} parse error:`, e);
+        }
+        if (data.success && data.job_id) {
+          this.pollBatch(data.job_id, callback);
+        } else {
+          console.error(`File ${file.name} upload failed:`, data.message);
+          callback({ failed: 1 });
+        }
+      },
+      fail: (err) => {
+        console.error(`File ${file.name} network error:`, err);
+        callback({ failed: 1 });
+      }
+    });
+  },
+
+  pollBatch(jobId, callback) {
+    wx.request({
+      url: `${app.globalData.apiBaseUrl}/api/alliance/upload/batch/${jobId}`,
+      method: 'GET',
+      success: (res) => {
+        const job = res.data && res.data.job;
+        if (!job) {
+          callback({ failed: 1 });
+          return;
+        }
+        if (job.status === 'done' || job.status === 'failed') {
+          callback(job.result || { failed: job.total });
+          return;
+        }
+        wx.showLoading({ title: `导入中 ${job.finished}/${job.total}...` });
+        setTimeout(() => this.pollBatch(jobId, callback), 1000);
+      },
+      fail: () => callback({ failed: 1 })
+    });
+  },
+
   toggleSelection(e) {
     const id = e.currentTarget.dataset.id;
     let selectedIds = [...this.data.selectedIds];
@@ -10,7 +10,8 @@ Page({
     early_ts: '',
     late_ts: '',
     title: '',
-    metric: ''
+    metric: '',
+    rendering: false
   },
 
   onLoad(options) {
@@ -38,6 +39,10 @@ Page({
     this.fetchData(ids[0], ids[1], metric);
   },
 
+  onUnload() {
+    clearTimeout(this.renderTimer);
+  },
+
   goBack() {
     wx.navigateBack();
   },
@@ -90,14 +95,17 @@ Page({
 
           const allImg = images.find(img => img.group === '全盟');
           if (allImg) {
-            currentImage = allImg.url;
+            currentImage = allImg.ready ? allImg.url : '';
           } else if (images.length > 0) {
             // If no '全盟', use the first one from sorted list
             currentGroup = groupObjs[0].value;
             const firstImg = images.find(img => img.group === currentGroup);
-            currentImage = firstImg ? firstImg.url : '';
+            currentImage = firstImg && firstImg.ready ? firstImg.url : '';
           }
 
+          // 图片在后台生成，数据先显示，轮询生成进度
+          const rendering = !res.data.images_ready && !!res.data.render_job;
+
           this.setData({
             early_ts: this.formatShichen(res.data.early_ts),
             late_ts: this.formatShichen(res.data.late_ts),
@@ -105,8 +113,12 @@ Page({
             groups: groupObjs,
             currentGroup: currentGroup,
             currentImage: currentImage,
+            rendering: rendering,
             loading: false
           });
+          if (rendering) {
+            this.pollRender(res.data.render_job);
+          }
         } else {
           wx.showToast({ title: res.data.message || '分析失败', icon: 'none' });
           this.setData({ loading: false });
@@ -120,6 +132,34 @@ Page({
     });
   },
 
+  pollRender(jobId) {
+    this.renderTimer = setTimeout(() => {
+      wx.request({
+        url: `${app.globalData.apiBaseUrl}/api/alliance/compare/render/${jobId}`,
+        success: (res) => {
+          if (!res.data.success) {
+            this.setData({ rendering: false });
+            return;
+          }
+          const images = res.data.images || [];
+          const img = images.find(i => i.group === this.data.currentGroup);
+          const rendering = !res.data.images_ready && res.data.status !== 'failed';
+          this.setData({
+            images: images,
+            currentImage: img && img.ready ? img.url : '',
+            rendering: rendering
+          });
+          if (rendering) {
+            this.pollRender(jobId);
+          }
+        },
+        fail: () => {
+          this.pollRender(jobId);
+        }
+      });
+    }, 1000);
+  },
+
   formatShichen(timeStr) {
     // timeStr format: YYYY-MM-DD HH:MM
     if (!timeStr) return '';
@@ -149,7 +189,7 @@ Page({
     if (img) {
       this.setData({
         currentGroup: group,
-        currentImage: img.url
+        currentImage: img.ready ? img.url : ''
       });
     }
   },
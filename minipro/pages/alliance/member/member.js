@@ -27,7 +27,7 @@ Page({
     wx.showLoading({ title: '加载中...' });
     wx.request({
       url: `${app.globalData.apiBaseUrl}/api/alliance/member/history`,
-      data: { name },
+      data: { name, openid: wx.getStorageSync('openid') },
       success: (res) => {
         wx.hideLoading();
         if (res.data.success) {
@@ -7,6 +7,8 @@ Page({
     levelIndex: 0, // Default 8铜
     
     seasons: [],
+    // 各赛季地图版本，GET 查询带上 v 参数以便缓存
+    mapVersions: {},
     seasonIndex: 0,
     currentSeason: 'S1',
 
@@ -41,7 +43,7 @@ Page({
       url: `${app.globalData.apiBaseUrl}/api/resource/seasons`,
       success: (res) => {
         if (res.data.seasons) {
-          this.setData({ seasons: res.data.seasons });
+          this.setData({ seasons: res.data.seasons, mapVersions: res.data.versions || {} });
           this.syncSeasonIndex();
         }
       }
@@ -92,6 +94,23 @@ Page({
     });
   },
 
+  // 查询参数末尾加上当前赛季的地图版本（未知时不加，服务端不缓存）
+  withMapVersion(data) {
+    const version = this.data.mapVersions[this.data.currentSeason];
+    if (version) data.v = version;
+    return data;
+  },
+
+  // 响应中的地图版本与本地不同（地图已更新）时记下新版本
+  updateMapVersion(res) {
+    const header = res.header || {};
+    const version = header['X-Map-Version'] || header['x-map-version'];
+    const season = this.data.currentSeason;
+    if (version && this.data.mapVersions[season] !== version) {
+      this.setData({ [`mapVersions.${season}`]: version });
+    }
+  },
+
   switchTab(e) {
     const index = parseInt(e.currentTarget.dataset.index);
     this.setData({ currentTab: index });
@@ -113,15 +132,17 @@ Page({
     
     wx.request({
       url: `${app.globalData.apiBaseUrl}/api/resource/nearest`,
-      method: 'POST',
-      data: {
-        x: this.data.findX,
-        y: this.data.findY,
-        type: this.data.levels[this.data.levelIndex],
-        season: this.data.currentSeason
-      },
+      // GET + 固定参数顺序，便于服务端 / nginx 缓存
+      method: 'GET',
+      data: this.withMapVersion({
+        season: this.data.currentSeason,
+        x: parseInt(this.data.findX),
+        y: parseInt(this.data.findY),
+        type: this.data.levels[this.data.levelIndex]
+      }),
       success: (res) => {
         wx.hideLoading();
+        this.updateMapVersion(res);
         if (res.statusCode === 200) {
           // Only show top 10 results for Find Copper
           const top10 = res.data.points.slice(0, 10);
@@ -169,15 +190,16 @@ Page({
 
     wx.request({
       url: `${app.globalData.apiBaseUrl}/api/resource/relocate`,
-      method: 'POST',
-      data: {
-        x: this.data.relocateX,
-        y: this.data.relocateY,
-        season: this.data.currentSeason
-      },
+      method: 'GET',
+      data: this.withMapVersion({
+        season: this.data.currentSeason,
+        x: parseInt(this.data.relocateX),
+        y: parseInt(this.data.relocateY)
+      }),
       success: (res) => {
         wx.hideLoading();
         this.setData({ calculating: false });
+        this.updateMapVersion(res);
         
         if (res.statusCode === 200) {
           this.setData({